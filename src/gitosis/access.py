@@ -1,12 +1,120 @@
 import configparser
+import errno
+import json
 import logging
 import os
 import typing as t
 
-from gitosis import group
+from gitosis import group, transaction, util
 
 _log = logging.getLogger(__name__)
 
+# "writeable" is a popular misspelling that gitosis-serve accepts too
+MODES = ("writable", "writeable", "readonly")
+
+# the grants of every group, precomputed for each generation
+GRANTS = "grants.json"
+GRANTS_VERSION = 1
+
+Grants = dict[str, dict[str, dict[str, str]]]
+
+
+class Grant(t.NamedTuple):
+    path: str
+    mode: str
+    mapping: str
+
+
+def get_prefix(config: configparser.ConfigParser, groupname: str) -> str:
+    """Return the toplevel repository directory for members of ``groupname``.
+
+    A group may override the global ``repositories`` setting with one of
+    its own.
+    """
+    try:
+        return config.get(f"group {groupname}", "repositories")
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        try:
+            return config.get("gitosis", "repositories")
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            return "repositories"
+
+
+def get_grants(config: configparser.ConfigParser) -> Grants:
+    """Collect the repositories every group is given access to.
+
+    Returns ``{group: {mode: {path: mapping}}}``, where ``path`` is the
+    name users refer to the repository by and ``mapping`` is the
+    physical repository, relative to :func:`get_prefix`. As with
+    :func:`have_access`, a plainly listed repository takes precedence
+    over a ``map`` for the same path.
+    """
+    grants = {}
+    for section in config.sections():
+        if not section.startswith(group.GROUP_PREFIX):
+            continue
+        modes: dict[str, dict[str, str]] = {mode: {} for mode in MODES}
+        maps = []
+        for option in config.options(section):
+            if option in modes:
+                for path in config.get(section, option).split():
+                    modes[option][path] = path
+                continue
+            parts = option.split(None, 2)
+            if len(parts) == 3 and parts[0] == "map" and parts[1] in modes:
+                maps.append((parts[1], parts[2], config.get(section, option).strip()))
+        for mode, path, mapping in maps:
+            modes[mode].setdefault(path, mapping)
+        grants[section[len(group.GROUP_PREFIX) :]] = modes
+    return grants
+
+
+def write_grants(
+    config: configparser.ConfigParser, path: str, writes: t.Optional[transaction.WriteTransaction] = None
+) -> None:
+    write_file = util.write_file if writes is None else writes.write_file
+    write_file(path, json.dumps({"version": GRANTS_VERSION, "grants": get_grants(config)}, sort_keys=True))
+
+
+def read_grants(path: str) -> t.Optional[Grants]:
+    """Read grants written by :func:`write_grants`, if they're there."""
+    try:
+        with open(path) as fp:
+            data = json.load(fp)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    except ValueError:
+        return None
+    if data.get("version") != GRANTS_VERSION:
+        return None
+    return data["grants"]
+
+
+def list_access(
+    config: configparser.ConfigParser,
+    user: str,
+    grants: t.Optional[Grants] = None,
+) -> list[Grant]:
+    """List every repository ``user`` has access to, sorted by path.
+
+    Each is given with the access :func:`have_access` would find first:
+    ``writable`` (whichever way it's spelled) or else ``readonly``.
+    ``grants`` is as returned by :func:`get_grants`, which is called if
+    it's not given.
+    """
+    if grants is None:
+        grants = get_grants(config)
+    groups = [groupname for groupname in group.get_membership(config=config, user=user) if groupname in grants]
+    found: dict[str, Grant] = {}
+    for mode in MODES:
+        shown = "readonly" if mode == "readonly" else "writable"
+        for groupname in groups:
+            for path, mapping in grants[groupname].get(mode, {}).items():
+                found.setdefault(path, Grant(path, shown, mapping))
+    return sorted(found.values())
+
 
 def have_access(config: configparser.ConfigParser, user: str, mode: str, path: str) -> t.Optional[tuple[str, str]]:
     """Map request for write access to allowed path.
@@ -44,15 +152,7 @@ def have_access(config: configparser.ConfigParser, user: str, mode: str, path: s
                 _log.debug("Access OK for %s as %s on %s=%s", user, mode, path, mapping)
 
         if mapping is not None:
-            prefix = None
-            try:
-                prefix = config.get(f"group {groupname}", "repositories")
-            except (configparser.NoSectionError, configparser.NoOptionError):
-                try:
-                    prefix = config.get("gitosis", "repositories")
-                except (configparser.NoSectionError, configparser.NoOptionError):
-                    prefix = "repositories"
-
+            prefix = get_prefix(config, groupname)
             _log.debug("Using prefix %s for %s", prefix, mapping)
             return (prefix, mapping)
 
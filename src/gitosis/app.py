@@ -5,6 +5,8 @@ import optparse
 import os
 import sys
 
+from gitosis import config
+
 log = logging.getLogger(__name__)
 
 _level_names = {
@@ -38,7 +40,7 @@ class App:
         self.setup_basic_logging()
         parser = self.create_parser()
         options, args = parser.parse_args()
-        cfg = configparser.ConfigParser(interpolation=None)
+        cfg = config.LazyConfigParser(interpolation=None)
         try:
             self.read_config(options, cfg)
         except CannotReadConfigError as e:
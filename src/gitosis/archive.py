@@ -0,0 +1,465 @@
+"""Cache archives made by ``git archive``.
+
+Release tooling and ``gitweb`` snapshot links tend to ask for the same
+tarballs over and over, and ``git upload-archive`` compresses the whole
+tree again every time. If ``archive-cache`` is set in the ``[gitosis]``
+section, archives are kept in that directory, keyed by the commit and
+tree they were made from, the format and compression level, and the
+prefix and paths asked for. The commit is part of the key as well as
+the tree, because its id and date end up in the archive.
+
+The cache is bounded by ``archive-cache-size`` (default ``1G``); when a
+new archive pushes it over that, the archives used least recently are
+removed. Hits and misses are counted in ``stats.json`` in the cache,
+and ``gitosis-archive`` reports them.
+
+Only archives of refs are cached, as ``git upload-archive`` only serves
+those by default; anything else is handed to ``git upload-archive``
+unchanged.
+"""
+
+from collections import abc
+import configparser
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import optparse
+import os
+import secrets
+import subprocess
+import sys
+import typing as t
+
+from gitosis import app, util
+
+_log = logging.getLogger(__name__)
+
+# format names accepted by ``git archive``, mapped to the extension of
+# the files they produce
+FORMATS = {
+    "tar": "tar",
+    "tgz": "tar.gz",
+    "tar.gz": "tar.gz",
+    "zip": "zip",
+}
+
+DEFAULT_SIZE = 1 << 30
+
+STATS = "stats.json"
+
+
+# pkt-line framing, as used by ``git upload-archive``
+FLUSH = b"0000"
+MAX_PKT_DATA = 65515
+MAX_ARGUMENTS = 64
+
+
+class ArchiveError(Exception):
+    """Cannot make archive"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+class ProtocolError(ArchiveError):
+    """Bad upload-archive request"""
+
+
+class Archive:
+    """The parameters of a ``git archive`` invocation."""
+
+    def __init__(
+        self,
+        treeish: str,
+        fmt: str = "tar",
+        level: t.Optional[int] = None,
+        prefix: str = "",
+        paths: abc.Sequence[str] = (),
+    ) -> None:
+        self.treeish = treeish
+        self.format = fmt
+        self.level = level
+        self.prefix = prefix
+        self.paths = list(paths)
+
+    @classmethod
+    def from_arguments(cls, args: abc.Sequence[str]) -> t.Optional["Archive"]:
+        """Parse the arguments sent to ``git upload-archive``.
+
+        Returns ``None`` if they ask for anything other than a plain
+        archive in one of :data:`FORMATS`.
+        """
+        fmt = "tar"
+        level = None
+        prefix = ""
+        positional = []
+        for arg in args:
+            if positional:
+                if arg.startswith("-"):
+                    return None
+                positional.append(arg)
+            elif arg.startswith("--format="):
+                fmt = arg[len("--format=") :]
+            elif arg.startswith("--prefix="):
+                prefix = arg[len("--prefix=") :]
+            elif len(arg) == 2 and arg[0] == "-" and arg[1].isdigit():
+                level = int(arg[1])
+            elif arg.startswith("-"):
+                return None
+            else:
+                positional.append(arg)
+        if not positional or fmt not in FORMATS:
+            return None
+        treeish, *paths = positional
+        if ":" in treeish:
+            return None
+        return cls(treeish, fmt, level, prefix, paths)
+
+    def arguments(self, treeish: t.Optional[str] = None) -> list[str]:
+        """Return the arguments for ``git archive``, archiving ``treeish`` if given."""
+        args = [f"--format={self.format}"]
+        if self.level is not None:
+            args.append(f"-{self.level}")
+        if self.prefix:
+            args.append(f"--prefix={self.prefix}")
+        return [*args, treeish or self.treeish, *self.paths]
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.format]
+
+
+def resolve(git_dir: str, treeish: str, *, refs_only: bool = True, git: str = "git") -> t.Optional[tuple[str, str]]:
+    """Find the commit and tree ``treeish`` names in ``git_dir``.
+
+    The commit is empty if ``treeish`` names a tree. Returns ``None`` if
+    it can't be resolved, or, with ``refs_only``, if it isn't a ref.
+    """
+    if treeish.startswith("-") or "\n" in treeish:
+        return None
+    if refs_only:
+        result = subprocess.run(  # noqa: S603
+            [git, f"--git-dir={git_dir}", "rev-parse", "--symbolic-full-name", treeish],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+    result = subprocess.run(  # noqa: S603
+        [git, f"--git-dir={git_dir}", "cat-file", "--batch-check"],
+        input=f"{treeish}^{{commit}}\n{treeish}^{{tree}}\n",
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    found = {}
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 3:
+            found[parts[1]] = parts[0]
+    if "tree" not in found:
+        return None
+    return found.get("commit", ""), found["tree"]
+
+
+def is_reachable(git_dir: str, commit: str, *, git: str = "git") -> bool:
+    """Check whether ``commit`` can be reached from any ref in ``git_dir``.
+
+    Objects borrowed from an object pool, or left behind by a forced
+    push, exist in the repository without being reachable.
+    """
+    result = subprocess.run(  # noqa: S603
+        [git, f"--git-dir={git_dir}", "rev-list", "-n", "1", commit, "--not", "--all"],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return result.returncode == 0 and not result.stdout.strip()
+
+
+class ArchiveCache:
+    """Archives stored on local disk, evicting the least recently used."""
+
+    def __init__(self, path: str, max_size: int = DEFAULT_SIZE, git: str = "git") -> None:
+        self.path = path
+        self.max_size = max_size
+        self.git = git
+
+    def key(self, archive: Archive, commit: str, tree: str) -> str:
+        data = json.dumps([commit, tree, archive.format, archive.level, archive.prefix, archive.paths])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _entry(self, key: str, archive: Archive) -> str:
+        return os.path.join(self.path, "objects", key[:2], f"{key[2:]}.{archive.extension}")
+
+    @contextlib.contextmanager
+    def _locked(self) -> abc.Iterator[None]:
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def open(self, git_dir: str, archive: Archive, commit: str, tree: str) -> t.BinaryIO:
+        """Open the archive, making it with ``git archive`` if it's not cached.
+
+        :param git_dir: repository to archive
+
+        :param archive: what to archive
+
+        :param commit: commit ``archive.treeish`` resolves to, if any
+
+        :param tree: tree ``archive.treeish`` resolves to
+
+        Raises :class:`ArchiveError` if ``git archive`` fails.
+        """
+        entry = self._entry(self.key(archive, commit, tree), archive)
+        try:
+            fp = open(entry, "rb")  # noqa: SIM115
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            # mark as recently used
+            with contextlib.suppress(OSError):
+                os.utime(entry)
+            self._record(hit=True)
+            _log.debug("Archive cache hit for %s", entry)
+            return fp
+
+        _log.debug("Archive cache miss for %s", entry)
+        # build from what was resolved, as the ref may have moved since
+        fp = self._build(git_dir, archive, commit or tree, entry)
+        self._record(hit=False, keep=entry)
+        return fp
+
+    def _build(self, git_dir: str, archive: Archive, treeish: str, entry: str) -> t.BinaryIO:
+        tmpdir = os.path.join(self.path, "tmp")
+        os.makedirs(tmpdir, exist_ok=True)
+        tmp = os.path.join(tmpdir, secrets.token_hex(16))
+        with open(tmp, "wb") as out:
+            result = subprocess.run(  # noqa: S603
+                [self.git, f"--git-dir={git_dir}", "archive", *archive.arguments(treeish)],
+                stdout=out,
+                stderr=subprocess.PIPE,
+                close_fds=True,
+                check=False,
+            )
+        if result.returncode != 0:
+            os.unlink(tmp)
+            raise ArchiveError(result.stderr.decode("utf-8", "replace").strip())
+        fp = open(tmp, "rb")  # noqa: SIM115
+        if os.fstat(fp.fileno()).st_size > self.max_size:
+            _log.info("Not caching archive larger than the cache")
+        else:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            os.rename(tmp, entry)
+            return fp
+        # the open file stays readable after it's removed
+        os.unlink(tmp)
+        return fp
+
+    def _record(self, *, hit: bool, keep: t.Optional[str] = None) -> None:
+        with self._locked():
+            stats = self._read_stats()
+            stats["hits" if hit else "misses"] += 1
+            util.write_file(os.path.join(self.path, STATS), json.dumps(stats))
+            if keep is not None:
+                self._evict(keep)
+
+    def _read_stats(self) -> dict[str, int]:
+        try:
+            with open(os.path.join(self.path, STATS)) as fp:
+                stats = json.load(fp)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            stats = {}
+        except ValueError:
+            _log.warning("Ignoring corrupt archive cache statistics")
+            stats = {}
+        return {"hits": stats.get("hits", 0), "misses": stats.get("misses", 0)}
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        found = []
+        for dirpath, _, filenames in os.walk(os.path.join(self.path, "objects")):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, path))
+        return found
+
+    def _evict(self, keep: str) -> None:
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            _log.debug("Evicting %s from archive cache", path)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
+
+    def stats(self) -> dict[str, t.Any]:
+        """Report hits, misses, the hit rate, and the size of the cache."""
+        with self._locked():
+            stats: dict[str, t.Any] = self._read_stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        entries = self._entries()
+        stats["entries"] = len(entries)
+        stats["size"] = sum(size for _, size, _ in entries)
+        return stats
+
+
+def get_cache(config: configparser.ConfigParser, git: str = "git") -> t.Optional[ArchiveCache]:
+    """Return the archive cache, if ``archive-cache`` is configured."""
+    path = util.get(config, "gitosis", "archive-cache")
+    if not path:
+        return None
+    size = util.get(config, "gitosis", "archive-cache-size")
+    max_size = DEFAULT_SIZE
+    if size:
+        try:
+            max_size = util.parse_size(size)
+        except ValueError:
+            _log.warning("Ignoring bad archive-cache-size: %r", size)
+    return ArchiveCache(os.path.join(os.path.expanduser("~"), path), max_size, git)
+
+
+def _pkt(data: bytes) -> bytes:
+    return b"%04x" % (len(data) + 4) + data
+
+
+def _read_pkt(fp: t.BinaryIO) -> t.Optional[bytes]:
+    header = fp.read(4)
+    if len(header) != 4:
+        raise ProtocolError("unexpected end of request")
+    try:
+        length = int(header, 16)
+    except ValueError as e:
+        raise ProtocolError("bad pkt-line length") from e
+    if length == 0:
+        return None
+    if length < 4:
+        raise ProtocolError("bad pkt-line length")
+    data = fp.read(length - 4)
+    if len(data) != length - 4:
+        raise ProtocolError("unexpected end of request")
+    return data
+
+
+def read_arguments(fp: t.BinaryIO) -> tuple[list[bytes], list[str]]:
+    """Read the arguments of an upload-archive request.
+
+    Returns the raw pkt-lines read, so the request can be replayed, and
+    the arguments themselves.
+    """
+    raw = []
+    args = []
+    while True:
+        data = _read_pkt(fp)
+        if data is None:
+            break
+        raw.append(_pkt(data))
+        if len(raw) > MAX_ARGUMENTS:
+            raise ProtocolError("too many arguments")
+        try:
+            line = data.decode("utf-8").rstrip("\n")
+        except UnicodeDecodeError as e:
+            raise ProtocolError("argument is not UTF-8") from e
+        if not line.startswith("argument "):
+            raise ProtocolError(f"expected argument, got {line!r}")
+        args.append(line[len("argument ") :])
+    return raw, args
+
+
+def send_archive(src: t.BinaryIO, out: t.BinaryIO) -> None:
+    """Answer an upload-archive request with the archive in ``src``."""
+    out.write(_pkt(b"ACK\n"))
+    out.write(FLUSH)
+    while True:
+        chunk = src.read(MAX_PKT_DATA)
+        if not chunk:
+            break
+        out.write(_pkt(b"\1" + chunk))
+    out.write(FLUSH)
+    out.flush()
+
+
+def upload_archive(
+    cache: ArchiveCache,
+    git_dir: str,
+    stdin: t.BinaryIO,
+    stdout: t.BinaryIO,
+) -> int:
+    """Serve ``git upload-archive`` for ``git_dir``, using the cache if possible.
+
+    Requests the cache can't answer are passed on to ``git
+    upload-archive``. Returns the exit status to use.
+    """
+    raw, args = read_arguments(stdin)
+    archive = Archive.from_arguments(args)
+    if archive is not None:
+        resolved = resolve(git_dir, archive.treeish, git=cache.git)
+        if resolved is not None:
+            try:
+                fp = cache.open(git_dir, archive, *resolved)
+            except ArchiveError as e:
+                _log.debug("%s", e)
+            else:
+                with fp:
+                    send_archive(fp, stdout)
+                return 0
+
+    _log.debug("Not caching archive for arguments %r", args)
+    stdout.flush()
+    child = subprocess.Popen(  # noqa: S603
+        [cache.git, "upload-archive", git_dir],
+        stdin=subprocess.PIPE,
+        stdout=stdout,
+        close_fds=True,
+    )
+    child.stdin.write(b"".join(raw) + FLUSH)  # type: ignore
+    child.stdin.close()  # type: ignore
+    return child.wait()
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Report archive cache statistics")
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        cache = get_cache(cfg)
+        if cache is None:
+            _log.error("No archive-cache configured")
+            sys.exit(1)
+        stats = cache.stats()
+        sys.stdout.write(
+            f"hits: {stats['hits']}\n"
+            f"misses: {stats['misses']}\n"
+            f"hit rate: {stats['hit_rate']:.1%}\n"
+            f"entries: {stats['entries']}\n"
+            f"size: {stats['size']} of {cache.max_size} bytes\n"
+        )
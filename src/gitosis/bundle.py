@@ -0,0 +1,291 @@
+"""Pre-generated bundles for cloning large repositories.
+
+Cloning a large repository has ``git upload-pack`` compute the same
+huge pack over and over. ``gitosis-bundle``, run from ``cron``, instead
+writes it once as ``git bundle`` files, into ``bundle-dir`` (by default
+``~/bundles``), to be served as static files from ``bundle-uri``. The
+first bundle of a repository holds all of its branches and tags, and
+each later run adds a small bundle of what was pushed since, until
+``bundle-max-increments`` (default 6) of those have piled up, when the
+bundles are replaced with a single new one.
+
+Repositories are given the list of bundles in their ``bundle.*``
+settings, with ``uploadpack.advertiseBundleURIs``, so that clients that
+ask for it can download the bundles first and only fetch what's newer
+from ``upload-pack`` (advertising bundles needs git 2.40 or later on
+the server). Clients can also be pointed at the bundles directly, with
+``git clone --bundle-uri``.
+
+Bundles hold everything in a repository and are served to anyone who
+can reach ``bundle-uri``, so repositories only get them with
+``bundles = yes`` in their ``[repo NAME]`` section (or in ``[gitosis]``
+for every repository), or, with ``bundle-min-size`` set in
+``[gitosis]``, when they're already public, through ``daemon`` or
+``gitweb``, and ``repository-stats`` recorded them as at least that
+large. Repositories that no longer get bundles have theirs removed.
+"""
+
+from collections import abc
+import configparser
+import contextlib
+import errno
+import fcntl
+import functools
+import json
+import logging
+import optparse
+import os
+import shutil
+import sys
+import typing as t
+from urllib.parse import quote
+
+from gitosis import app, layout, repository, stats, util
+
+_log = logging.getLogger(__name__)
+
+STATE = "bundles.json"
+STATE_VERSION = 1
+
+DEFAULT_MAX_INCREMENTS = 6
+
+_REFS = ["--branches", "--tags"]
+
+
+class GitBundleError(repository.GitError):
+    """git bundle failed"""
+
+
+class NoChangeError(Exception):
+    """Nothing to bundle"""
+
+
+_git = functools.partial(repository.run_git, error=GitBundleError)
+
+
+def get_bundle_dir(config: configparser.ConfigParser) -> str:
+    return os.path.expanduser(util.get(config, "gitosis", "bundle-dir", default="~/bundles"))  # type: ignore
+
+
+def is_selected(config: configparser.ConfigParser, name: str, index: t.Optional[stats.Index] = None) -> bool:
+    """Check whether repository ``name`` gets bundles."""
+    default = util.get_boolean(config, "gitosis", "bundles", default=False)
+    if util.get_boolean(config, f"repo {name}", "bundles", default=default):
+        return True
+    min_size = util.get(config, "gitosis", "bundle-min-size")
+    if not min_size or util.get(config, f"repo {name}", "bundles") is not None or not is_public(config, name):
+        return False
+    try:
+        threshold = util.parse_size(min_size)
+    except ValueError:
+        _log.warning("Ignoring bad bundle-min-size: %r", min_size)
+        return False
+    record = (index or stats.Index(stats.get_stats_dir(config))).read(name)
+    return record is not None and record["size"] >= threshold
+
+
+def is_public(config: configparser.ConfigParser, name: str) -> bool:
+    """Check whether repository ``name`` can already be read without logging in."""
+    return any(
+        util.get_boolean(
+            config,
+            f"repo {name}",
+            option,
+            default=util.get_boolean(config, "gitosis", option, default=False),
+        )
+        for option in ("daemon", "gitweb")
+    )
+
+
+def _read_state(path: str) -> dict[str, t.Any]:
+    try:
+        with open(os.path.join(path, STATE)) as fp:
+            state = json.load(fp)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    except ValueError:
+        _log.warning("Ignoring corrupt bundle list in %s", path)
+    else:
+        if state.get("version") == STATE_VERSION:
+            return state
+    return {"version": STATE_VERSION, "bundles": []}
+
+
+def _get_tips(git: str, git_dir: str) -> dict[str, str]:
+    output = _git(git, git_dir, "for-each-ref", "--format=%(objectname) %(refname)", "refs/heads", "refs/tags")
+    return {ref: object_id for object_id, ref in (line.split(" ", 1) for line in output.splitlines())}
+
+
+def _create(git: str, git_dir: str, path: str, filename: str, exclude: abc.Iterable[str] = ()) -> None:
+    tmp = os.path.join(path, f".{filename}.tmp")
+    try:
+        # everything reachable from the tips already bundled is left out
+        _git(
+            git,
+            git_dir,
+            "bundle",
+            "create",
+            "--quiet",
+            tmp,
+            *_REFS,
+            "--stdin",
+            stdin="".join(f"^{tip}\n" for tip in exclude),
+        )
+        os.rename(tmp, os.path.join(path, filename))
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+
+
+def _configure(git: str, git_dir: str, bundles: list[dict[str, t.Any]], base_uri: t.Optional[str]) -> None:
+    # bundle.* is gitosis' alone, so it's simply written anew
+    try:
+        keys = _git(git, git_dir, "config", "--name-only", "--get-regexp", r"^bundle\.").split()
+    except GitBundleError:
+        keys = []
+    for section in sorted({key.rsplit(".", 1)[0] for key in keys}):
+        _git(git, git_dir, "config", "--remove-section", section)
+    if not bundles or base_uri is None:
+        with contextlib.suppress(GitBundleError):
+            _git(git, git_dir, "config", "--unset", "uploadpack.advertiseBundleURIs")
+        return
+    settings = [("bundle.version", "1"), ("bundle.mode", "all"), ("bundle.heuristic", "creationToken")]
+    for entry in bundles:
+        settings.append((f"bundle.b{entry['token']}.uri", f"{base_uri}/{entry['file']}"))
+        settings.append((f"bundle.b{entry['token']}.creationToken", str(entry["token"])))
+    settings.append(("uploadpack.advertiseBundleURIs", "true"))
+    for key, value in settings:
+        _git(git, git_dir, "config", key, value)
+
+
+@contextlib.contextmanager
+def _locked(path: str) -> abc.Iterator[None]:
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ".lock"), "a") as fp:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            raise NoChangeError("already being bundled") from e
+        yield
+
+
+def _next_bundles(
+    git: str,
+    git_dir: str,
+    path: str,
+    state: dict[str, t.Any],
+    max_increments: int,
+    *,
+    full: bool,
+) -> list[dict[str, t.Any]]:
+    tips = _get_tips(git, git_dir)
+    if not tips:
+        return []
+    bundles = state["bundles"]
+    token = max((entry["token"] for entry in bundles), default=0) + 1
+    if bundles and not full and len(bundles) <= max_increments:
+        if tips == bundles[-1]["tips"]:
+            raise NoChangeError
+        filename = f"{token}.bundle"
+        try:
+            _create(git, git_dir, path, filename, exclude=set(bundles[-1]["tips"].values()))
+        except GitBundleError as e:
+            # the tips bundled last may have been pruned since, or
+            # nothing new is reachable from the current ones
+            _log.debug("Starting over, as an incremental bundle failed: %s", e)
+        else:
+            return [*bundles, {"token": token, "file": filename, "tips": tips}]
+    filename = f"{token}.bundle"
+    _create(git, git_dir, path, filename)
+    return [{"token": token, "file": filename, "tips": tips}]
+
+
+def update(
+    config: configparser.ConfigParser,
+    name: str,
+    git_dir: str,
+    *,
+    full: bool = False,
+    git: str = "git",
+) -> bool:
+    """Bring the bundles of repository ``name`` at ``git_dir`` up to date; returns whether any were written."""
+    path = os.path.join(get_bundle_dir(config), name)
+    base_uri = util.get(config, "gitosis", "bundle-uri")
+    max_increments = util.get_int(config, "gitosis", "bundle-max-increments", default=DEFAULT_MAX_INCREMENTS)
+    try:
+        with _locked(path):
+            state = _read_state(path)
+            bundles = _next_bundles(git, git_dir, path, state, max_increments, full=full)
+            state["bundles"] = bundles
+            util.write_file(os.path.join(path, STATE), json.dumps(state, sort_keys=True))
+            # clients are told about the new list before the bundles
+            # dropped from it disappear
+            _configure(git, git_dir, bundles, None if base_uri is None else f"{base_uri.rstrip('/')}/{quote(name)}")
+            keep = {entry["file"] for entry in bundles} | {STATE, ".lock"}
+            for filename in os.listdir(path):
+                if filename not in keep and not filename.startswith("."):
+                    os.unlink(os.path.join(path, filename))
+    except NoChangeError:
+        return False
+    return bool(bundles)
+
+
+def remove(git_dir: str, path: str, *, git: str = "git") -> None:
+    """Stop advertising the bundles of the repository at ``git_dir``, and remove them from ``path``."""
+    if os.path.isdir(git_dir):
+        _configure(git, git_dir, [], None)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def update_all(config: configparser.ConfigParser, names: abc.Collection[str] = (), *, full: bool = False) -> int:
+    """Update the bundles of every repository that gets them, or just ``names``; returns how many changed."""
+    git = util.find_git() or "git"
+    bundle_dir = get_bundle_dir(config)
+    index = stats.Index(stats.get_stats_dir(config))
+    repositories = dict(layout.find_repositories(util.get_repository_dir(config)))
+    changed = 0
+    for name, git_dir in sorted(repositories.items()):
+        if names and name not in names:
+            continue
+        if os.path.islink(git_dir) or not is_selected(config, name, index):
+            if os.path.exists(os.path.join(bundle_dir, name, STATE)):
+                _log.info("Removing the bundles of %s", name)
+                remove(git_dir, os.path.join(bundle_dir, name), git=git)
+            continue
+        try:
+            if update(config, name, git_dir, full=full, git=git):
+                _log.info("Updated the bundles of %s", name)
+                changed += 1
+        except GitBundleError as e:
+            _log.warning("%s", e)
+    return changed
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS] [REPOSITORY...]")
+        parser.set_description("Write bundles of repositories for clients to clone from")
+        parser.add_option(
+            "--full",
+            action="store_true",
+            default=False,
+            help="replace the bundles with a single new one rather than adding to them",
+        )
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        if util.get(cfg, "gitosis", "bundle-uri") is None:
+            _log.warning("No bundle-uri set, so bundles won't be advertised")
+        changed = update_all(cfg, args, full=options.full)
+        sys.stdout.write(f"Updated bundles of {changed} repositor{'y' if changed == 1 else 'ies'}\n")
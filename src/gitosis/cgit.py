@@ -0,0 +1,100 @@
+"""Generate a ``cgit`` repository list based on ``gitosis.conf``.
+
+Rather than having ``cgit`` use ``scan-path`` to find repositories,
+set ``generate-cgitrc = yes`` in the ``[gitosis]`` section and include
+the generated file from ``/etc/cgitrc``::
+
+    include=/path/to/your/cgitrc
+
+Repositories are listed if they're visible in ``gitweb``, unless
+overridden with a ``cgit`` setting either globally or in the
+repository's section: ``cgit`` in the repository's section wins, then
+``cgit`` in ``[gitosis]``, then ``gitweb`` in each of them. The file
+is only rewritten when its contents change, so ``cgit`` can cache it
+safely.
+"""
+
+import configparser
+import io
+import logging
+import os
+import typing as t
+
+from gitosis import layout, transaction, util
+
+_log = logging.getLogger(__name__)
+
+
+def _flatten(value: str) -> str:
+    # cgitrc values end at the end of the line
+    return " ".join(value.split())
+
+
+def _is_visible(config: configparser.ConfigParser, section: str) -> bool:
+    # a cgit setting anywhere beats a gitweb setting anywhere
+    for option in ("cgit", "gitweb"):
+        for where in (section, "gitosis"):
+            if config.has_option(where, option):
+                return util.get_boolean(config, where, option, default=False)
+    return False
+
+
+def generate_cgitrc_fp(config: configparser.ConfigParser, fp: t.IO) -> None:
+    """Generate ``repo.*`` entries for ``cgit``.
+
+    :param config: configuration to read projects from
+
+    :param fp: writable for the ``cgitrc`` include
+    :type fp: (file-like, anything with ``.write(data)``)
+    """
+    symlink_farm = util.get_symlink_farm_dir(config)
+    repositories = symlink_farm or util.get_repository_dir(config)
+
+    for section in config.sections():
+        parts = section.split(None, 1)
+        type_ = parts.pop(0)
+        if type_ != "repo" or not parts:
+            continue
+
+        if not _is_visible(config, section):
+            continue
+
+        (name,) = parts
+
+        path = layout.find(config, name, symlink_farm)
+        if path is None:
+            path = os.path.join(repositories, f"{name}.git")
+            _log.warning("Cannot find '%s' in '%s'", name, repositories)
+
+        print(f"repo.url={_flatten(name)}", file=fp)
+        print(f"repo.path={path}", file=fp)
+        description = util.get(config, section, "description")
+        if description:
+            print(f"repo.desc={_flatten(description)}", file=fp)
+        owner = util.get(config, section, "owner")
+        if owner:
+            print(f"repo.owner={_flatten(owner)}", file=fp)
+        print(file=fp)
+
+
+def generate_cgitrc(
+    config: configparser.ConfigParser,
+    path: str,
+    writes: t.Optional[transaction.WriteTransaction] = None,
+) -> bool:
+    """Generate a ``cgitrc`` include, if it has changed.
+
+    :param config: configuration to read projects from
+
+    :param path: path to write the include to
+
+    :param writes: transaction to stage the include in, rather than
+        writing it straight away
+
+    Returns whether the file was rewritten.
+    """
+    fp = io.StringIO()
+    generate_cgitrc_fp(config=config, fp=fp)
+    if writes is not None:
+        return writes.write_file_if_changed(path, fp.getvalue())
+    return util.write_file_if_changed(path, fp.getvalue())
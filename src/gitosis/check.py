@@ -0,0 +1,71 @@
+"""Answer batches of access queries from a precomputed permission matrix.
+
+Each line read from standard input is a query of the form ``USER MODE
+PATH``, where ``MODE`` is one of ``writable`` or ``readonly``; for each
+query, the query is echoed back followed by ``yes`` or ``no``, or
+``invalid`` if the line can't be parsed.
+"""
+
+import configparser
+import logging
+import optparse
+import sys
+import typing as t
+
+from gitosis import app, matrix
+
+_log = logging.getLogger(__name__)
+
+
+def answer(perms: matrix.PermissionMatrix, queries: t.IO, out: t.IO) -> None:
+    """Answer each query line in ``queries``, writing one line to ``out`` for each."""
+    for line in queries:
+        query = line.split()
+        if len(query) != 3 or query[1] not in matrix.MODES:
+            print(" ".join([*query, "invalid"]), file=out, flush=True)
+            continue
+        user, mode, path = query
+        result = "yes" if perms.allowed(user, mode, path) else "no"
+        print(f"{user} {mode} {path} {result}", file=out, flush=True)
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Answer access queries read from standard input")
+        parser.add_option(
+            "--matrix",
+            metavar="FILE",
+            help="answer from the matrix in FILE rather than the config",
+        )
+        parser.add_option(
+            "--export",
+            metavar="FILE",
+            help="write the permission matrix to FILE and exit",
+        )
+        parser.add_option(
+            "--format",
+            choices=["json", "binary"],
+            default="binary",
+            help="format to export the matrix in (json or binary)",
+        )
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+
+        perms = matrix.build(cfg) if options.matrix is None else matrix.load(options.matrix)
+
+        if options.export is not None:
+            matrix.save(perms, options.export, binary=options.format == "binary")
+            _log.info("Wrote matrix of %d users and %d repositories", len(perms.users), len(perms.repos))
+            return
+
+        answer(perms, sys.stdin, sys.stdout)
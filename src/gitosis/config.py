@@ -0,0 +1,237 @@
+"""Lazily parsed ``gitosis.conf``.
+
+A single ``gitosis-serve`` run only looks at ``[gitosis]`` and the
+``group`` sections, so parsing every ``[repo ...]`` section up front is
+wasted work on large configurations. :class:`LazyConfigParser` scans
+the file once for section headers, remembering the byte range of each
+section, and only parses a section body the first time it's accessed.
+
+The header index is kept next to the configuration file in
+``.FILENAME.idx`` and is keyed on the file's size and modification
+time, so an unchanged configuration doesn't even need to be scanned.
+It's written by :func:`write_index` while a generation is being built
+(see :mod:`gitosis.generation`), never by readers: a published
+generation is never modified. Without a usable index, the file is
+simply scanned.
+"""
+
+from collections import abc
+import configparser
+import contextlib
+import json
+import logging
+import os
+import typing as t
+
+from gitosis import util
+
+_log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+def index_path(path: str) -> str:
+    """Return the path of the header index cached for ``path``."""
+    dirname, basename = os.path.split(os.path.realpath(path))
+    return os.path.join(dirname, f".{basename}.idx")
+
+
+def scan_sections(fp: t.BinaryIO, sectcre: t.Pattern[str]) -> list[tuple[str, int, int]]:
+    """Find the sections in ``fp``.
+
+    Returns a list of ``(name, start, end)`` tuples, where ``start`` is
+    the offset of the section header and ``end`` is the offset just
+    past the last line of the section body.
+    """
+    sections: list[tuple[str, int, int]] = []
+    name = None
+    start = offset = 0
+    for line in fp:
+        # Only headers in the first column are unambiguous: indented
+        # lines may be value continuations.
+        if line[:1] == b"[":
+            mo = sectcre.match(line.decode("utf-8").strip())
+            if mo is not None:
+                if name is not None:
+                    sections.append((name, start, offset))
+                name = mo.group("header")
+                start = offset
+        offset += len(line)
+    if name is not None:
+        sections.append((name, start, offset))
+    return sections
+
+
+def _load_index(path: str, st: os.stat_result) -> t.Optional[list[tuple[str, int, int]]]:
+    try:
+        with open(index_path(path)) as fp:
+            cached = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if (
+        cached.get("version") != INDEX_VERSION
+        or cached.get("size") != st.st_size
+        or cached.get("mtime") != st.st_mtime_ns
+    ):
+        return None
+    return [(name, start, end) for name, start, end in cached["sections"]]
+
+
+def write_index(path: str, sectcre: t.Pattern[str] = configparser.ConfigParser.SECTCRE) -> None:
+    """Write the header index for the configuration file at ``path``."""
+    with open(path, "rb") as fp:
+        st = os.fstat(fp.fileno())
+        sections = scan_sections(fp, sectcre)
+    cached = {
+        "version": INDEX_VERSION,
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+        "sections": sections,
+    }
+    util.write_file(index_path(path), json.dumps(cached))
+
+
+class LazyConfigParser(configparser.ConfigParser):
+    """A :class:`configparser.ConfigParser` that parses sections on demand.
+
+    Files passed to :meth:`read` are indexed rather than parsed; the
+    section bodies are read from the still-open file the first time
+    they're needed, so a file replaced while the parser is in use
+    doesn't affect it. The files read are listed in :attr:`filenames`.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:  # noqa: ANN002, ANN003
+        super().__init__(*args, **kwargs)
+        self._pending: dict[str, list[tuple[int, int, int, t.Optional[str]]]] = {}
+        self._fds: list[int] = []
+        self.filenames: list[str] = []
+
+    def read(self, filenames, encoding=None) -> list[str]:  # noqa: ANN001
+        if isinstance(filenames, (str, bytes, os.PathLike)):
+            filenames = [filenames]
+        read_ok = []
+        for filename in filenames:
+            filename = os.fspath(filename)
+            try:
+                fd = os.open(filename, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                self._index(fd, filename, encoding)
+            except BaseException:
+                os.close(fd)
+                raise
+            read_ok.append(filename)
+        self.filenames.extend(read_ok)
+        return read_ok
+
+    def _index(self, fd: int, filename: str, encoding: t.Optional[str]) -> None:
+        st = os.fstat(fd)
+        sections = _load_index(filename, st)
+        if sections is None:
+            with os.fdopen(os.dup(fd), "rb") as fp:
+                sections = scan_sections(fp, self.SECTCRE)
+
+        seen: set[str] = set()
+        for name, start, end in sections:
+            if self._strict and name in seen:
+                raise configparser.DuplicateSectionError(name, filename)
+            seen.add(name)
+            if name == self.default_section:
+                # defaults affect every section, so there's no point
+                # in deferring them
+                self.read_string(self._read_range(fd, start, end, encoding), filename)
+                continue
+            if name not in self._sections:
+                self._sections[name] = self._dict()
+                self._proxies[name] = configparser.SectionProxy(self, name)
+            self._pending.setdefault(name, []).append((fd, start, end, encoding))
+        self._fds.append(fd)
+
+    @staticmethod
+    def _read_range(fd: int, start: int, end: int, encoding: t.Optional[str]) -> str:
+        return os.pread(fd, end - start, start).decode(encoding or "utf-8")
+
+    def _load(self, section: str) -> None:
+        ranges = self._pending.pop(section, None)
+        if ranges is None:
+            return
+        _log.debug("Parsing section %r", section)
+        parser = configparser.RawConfigParser(
+            delimiters=self._delimiters,
+            comment_prefixes=self._comment_prefixes,
+            inline_comment_prefixes=self._inline_comment_prefixes,
+            strict=self._strict,
+            empty_lines_in_values=self._empty_lines_in_values,
+            default_section=self.default_section,
+        )
+        parser.optionxform = self.optionxform  # type: ignore
+        for fd, start, end, encoding in ranges:
+            parser.read_string(self._read_range(fd, start, end, encoding), f"<section {section}>")
+            self._sections[section].update(parser._sections[section])  # type: ignore
+            parser.remove_section(section)
+
+    def load_all(self) -> None:
+        """Parse every section that hasn't been parsed yet."""
+        for section in list(self._pending):
+            self._load(section)
+
+    def close(self) -> None:
+        """Parse any remaining sections and release the indexed files."""
+        self.load_all()
+        self._release()
+
+    def _release(self) -> None:
+        for fd in self._fds:
+            with contextlib.suppress(OSError):
+                os.close(fd)
+        self._fds.clear()
+
+    def __del__(self) -> None:
+        self._release()
+
+    def pending_sections(self) -> abc.KeysView[str]:
+        """Return the names of sections that haven't been parsed yet."""
+        return self._pending.keys()
+
+    # Everything that looks at section contents needs to go through
+    # _load() first. Section names are already known, so sections(),
+    # has_section() and friends need no special treatment.
+
+    def _unify_values(self, section, vars):  # noqa: ANN001, ANN202, A002
+        self._load(section)
+        return super()._unify_values(section, vars)
+
+    def options(self, section):  # noqa: ANN001, ANN201
+        self._load(section)
+        return super().options(section)
+
+    def has_option(self, section, option):  # noqa: ANN001, ANN201
+        if section:
+            self._load(section)
+        return super().has_option(section, option)
+
+    def items(self, section=configparser._UNSET, raw=False, vars=None):  # noqa: ANN001, ANN201, A002, FBT002
+        if section is configparser._UNSET:
+            self.load_all()
+        else:
+            self._load(section)
+        return super().items(section, raw=raw, vars=vars)
+
+    def set(self, section, option, value=None):  # noqa: ANN001, ANN201
+        if section:
+            self._load(section)
+        return super().set(section, option, value)
+
+    def remove_option(self, section, option):  # noqa: ANN001, ANN201
+        if section:
+            self._load(section)
+        return super().remove_option(section, option)
+
+    def remove_section(self, section):  # noqa: ANN001, ANN201
+        self._pending.pop(section, None)
+        return super().remove_section(section)
+
+    def write(self, fp, space_around_delimiters=True):  # noqa: ANN001, ANN201, FBT002
+        self.load_all()
+        return super().write(fp, space_around_delimiters)
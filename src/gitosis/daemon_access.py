@@ -0,0 +1,119 @@
+"""Decide whether ``git daemon`` may export a repository.
+
+Use this as ``git daemon``'s access hook, together with
+``--export-all``, so ``git daemon`` doesn't depend on
+``git-daemon-export-ok`` files::
+
+    git daemon --export-all --access-hook=gitosis-daemon-access ...
+
+``git daemon`` runs the hook with the service name, the path to the
+repository, and some details of the client, and refuses the request
+if it exits with a non-zero status. The decision comes from a policy
+file, by default ``~/gitosis/daemon-access``, that gitosis writes
+whenever the configuration changes when ``daemon-access-hook`` is set
+in the ``[gitosis]`` section. Give the hook ``--policy FILE`` to use a
+different one.
+
+The policy file is a header line followed by ``PATH<TAB>allow`` or
+``PATH<TAB>deny`` lines, sorted by path, so it can be searched in
+place without being parsed. This module deliberately avoids importing
+the rest of gitosis, since it runs for every ``git daemon`` request.
+"""
+
+import mmap
+import os
+import sys
+import typing as t
+
+POLICY = "daemon-access"
+
+HEADER = "# gitosis daemon access policy 1"
+
+# git daemon never lets clients push unless told to, and neither do we
+SERVICES = ("upload-pack", "upload-archive")
+
+
+def write_policy(fp: t.IO, *, default: bool, entries: dict[str, bool]) -> None:
+    """Write a policy allowing ``entries``, and ``default`` for anything else."""
+    print(f"{HEADER} default={'allow' if default else 'deny'}", file=fp)
+    for path in sorted(entries, key=lambda p: p.encode("utf-8")):
+        print(f"{path}\t{'allow' if entries[path] else 'deny'}", file=fp)
+
+
+def _line_start(mm: mmap.mmap, pos: int, lower: int) -> int:
+    start = mm.rfind(b"\n", lower, pos)
+    return lower if start == -1 else start + 1
+
+
+def _lookup(mm: mmap.mmap, key: bytes) -> t.Optional[bool]:
+    # binary search over the lines following the header
+    lo = mm.find(b"\n") + 1
+    hi = len(mm)
+    while lo < hi:
+        mid = _line_start(mm, (lo + hi) // 2, lo)
+        end = mm.find(b"\n", mid, hi)
+        if end == -1:
+            end = hi
+        path, _, verdict = mm[mid:end].partition(b"\t")
+        if path == key:
+            return verdict == b"allow"
+        if path < key:
+            lo = end + 1
+        else:
+            hi = mid
+    return None
+
+
+def _candidates(path: str) -> list[str]:
+    path = os.path.normpath(path)
+    if path.endswith(f"{os.sep}.git"):
+        path = os.path.dirname(path)
+    candidates = [path]
+    if not path.endswith(".git"):
+        candidates.append(f"{path}.git")
+    return candidates
+
+
+def is_allowed(policy: str, service: str, path: str) -> bool:
+    """Check whether ``service`` may be run on the repository at ``path``."""
+    if service not in SERVICES:
+        return False
+    with open(policy, "rb") as f:
+        header = f.readline()
+        if not header.startswith(HEADER.encode("ascii")):
+            return False
+        default = header.rstrip().endswith(b"default=allow")
+        if f.readline() == b"":
+            # mmap can't map an empty remainder on all platforms, and
+            # there's nothing to search anyway
+            return default
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # first as given, so mapped names in the symlink farm get
+            # their own setting, then as the physical repository
+            for candidate in _candidates(path):
+                found = _lookup(mm, candidate.encode("utf-8"))
+                if found is not None:
+                    return found
+            for candidate in _candidates(os.path.realpath(path)):
+                found = _lookup(mm, candidate.encode("utf-8"))
+                if found is not None:
+                    return found
+    return default
+
+
+def main(argv: t.Optional[list[str]] = None) -> None:
+    args = sys.argv[1:] if argv is None else argv
+    policy = os.path.join(os.path.expanduser("~"), "gitosis", POLICY)
+    if len(args) >= 2 and args[0] == "--policy":
+        policy = args[1]
+        args = args[2:]
+    if len(args) < 2:
+        sys.stderr.write("Usage: gitosis-daemon-access [--policy FILE] SERVICE PATH [HOST ...]\n")
+        sys.exit(2)
+    service, path = args[:2]
+    try:
+        allowed = is_allowed(policy, service, path)
+    except OSError as e:
+        sys.stderr.write(f"Cannot read access policy: {e}\n")
+        allowed = False
+    sys.exit(0 if allowed else 1)
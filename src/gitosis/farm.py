@@ -0,0 +1,147 @@
+"""Maintain a tree of symlinks exposing logical repository names.
+
+``map`` rules let members of a group see a repository under a name
+other than the one it has on disk, but ``gitweb`` and ``git daemon``
+only know about the physical layout. If ``symlink-farm`` is set in the
+``[gitosis]`` section, gitosis keeps a directory there with a
+``NAME.git`` symlink for every repository name mentioned in the
+configuration, pointing at the physical repository. Point ``gitweb``'s
+``$projectroot`` or ``git daemon --base-path`` at it to make mapped
+repositories visible under their logical names.
+
+The farm is updated incrementally: the links made by the last run are
+recorded in a manifest inside the farm, and only the differences
+between that and the current configuration are applied to the
+filesystem.
+"""
+
+import configparser
+import errno
+import json
+import logging
+import os
+import re
+import typing as t
+
+from gitosis import access, group, layout, util
+
+_log = logging.getLogger(__name__)
+
+MANIFEST = ".gitosis-farm.json"
+
+_SAFE_NAME_RE = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9@._-]*(/[a-zA-Z0-9][a-zA-Z0-9@._-]*)*$")
+
+
+def _add(names: dict[str, str], logical: str, target: str) -> None:
+    if not _SAFE_NAME_RE.match(logical):
+        _log.warning("Ignoring unsafe repository name: %r", logical)
+        return
+    link = f"{logical}.git"
+    existing = names.setdefault(link, target)
+    if existing != target:
+        _log.warning("Conflicting mappings for '%s': using '%s', not '%s'", logical, existing, target)
+
+
+def get_logical_names(config: configparser.ConfigParser) -> dict[str, str]:
+    """Map farm entries to the physical repositories they should point at.
+
+    Keys are relative link paths ending in ``.git``, values are absolute
+    repository paths. Where the same logical name is given more than
+    one target, the first one in the configuration wins.
+    """
+    home = os.path.expanduser("~")
+    repositories = util.get_repository_dir(config)
+    names: dict[str, str] = {}
+    grants = access.get_grants(config)
+    for section in config.sections():
+        if section.startswith(group.GROUP_PREFIX):
+            groupname = section[len(group.GROUP_PREFIX) :]
+            topdir = os.path.join(home, access.get_prefix(config, groupname))
+            for paths in grants[groupname].values():
+                for path, mapping in paths.items():
+                    if not _SAFE_NAME_RE.match(mapping):
+                        _log.warning("Ignoring unsafe repository name: %r", mapping)
+                        continue
+                    _add(names, path, layout.get_path(config, mapping, topdir))
+        elif section.startswith("repo "):
+            name = section[len("repo ") :].strip()
+            _add(names, name, layout.get_path(config, name, repositories))
+    return names
+
+
+def _read_manifest(farm: str) -> t.Optional[dict[str, str]]:
+    try:
+        with open(os.path.join(farm, MANIFEST)) as fp:
+            return json.load(fp)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    except ValueError:
+        _log.warning("Ignoring corrupt symlink farm manifest in %s", farm)
+    return None
+
+
+def scan_farm(farm: str) -> dict[str, str]:
+    """Find the symlinks currently in the farm by walking it."""
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(farm):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                found[os.path.relpath(path, farm)] = os.readlink(path)
+    return found
+
+
+def _symlink(farm: str, link: str, target: str) -> None:
+    path = os.path.join(farm, link)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    util.replace_symlink(target, path)
+
+
+def _unlink(farm: str, link: str) -> None:
+    path = os.path.join(farm, link)
+    if not os.path.islink(path):
+        # never touch anything we didn't create
+        return
+    os.unlink(path)
+    # prune directories left empty
+    dirname = os.path.dirname(path)
+    while dirname != farm:
+        try:
+            os.rmdir(dirname)
+        except OSError:
+            break
+        dirname = os.path.dirname(dirname)
+
+
+def update_farm(config: configparser.ConfigParser) -> None:
+    """Bring the symlink farm in line with the configuration."""
+    farm = util.get_symlink_farm_dir(config)
+    if farm is None:
+        return
+    wanted = get_logical_names(config)
+
+    os.makedirs(farm, exist_ok=True)
+    current = _read_manifest(farm)
+    changed = current is None
+    if current is None:
+        current = scan_farm(farm)
+
+    for link in sorted(current.keys() - wanted.keys()):
+        _log.debug("Removing %s from symlink farm", link)
+        _unlink(farm, link)
+        changed = True
+    for link, target in list(wanted.items()):
+        if current.get(link) == target:
+            continue
+        _log.debug("Linking %s to %s", link, target)
+        try:
+            _symlink(farm, link, target)
+        except OSError as e:
+            _log.warning("Cannot link '%s' in symlink farm: %s", link, e)
+            del wanted[link]
+            continue
+        changed = True
+
+    if changed:
+        util.write_file(os.path.join(farm, MANIFEST), json.dumps(wanted, sort_keys=True))
@@ -0,0 +1,188 @@
+"""Split ``gitosis.conf`` into fragments.
+
+Besides ``gitosis.conf``, the admin repository can have any number of
+``gitosis.d/*.conf`` files, each in the same format. On every push to
+the admin repository, they're combined with ``gitosis.conf`` into the
+configuration everything else reads, so only the admin repository
+needs to know about them.
+
+Each file is parsed on its own, and the result is cached under
+``fragment-cache`` in the generated files directory by the file's blob
+id, so a push only parses the files it changed, however large the rest
+of the configuration is.
+
+Files are combined in a fixed order: ``gitosis.conf`` first, then the
+fragments sorted by filename. A section can be spread over several
+files, but an option can only be set once: when files disagree about
+an option, the first one to set it wins, and the conflict is reported.
+A file that can't be parsed fails the push's update, leaving the
+previous configuration in place.
+"""
+
+import configparser
+import errno
+import json
+import logging
+import os
+import typing as t
+
+from gitosis import objects, util
+
+_log = logging.getLogger(__name__)
+
+FRAGMENT_DIR = "gitosis.d"
+FRAGMENT_SUFFIX = ".conf"
+
+CACHE_VERSION = 1
+
+# so that [DEFAULT] is kept as a section of its own, rather than being
+# merged into every other section of the same file
+_NO_DEFAULT_SECTION = "\0"
+
+Sections = dict[str, dict[str, str]]
+
+
+class FragmentError(Exception):
+    """Cannot parse configuration file"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+class Conflict(t.NamedTuple):
+    section: str
+    option: str
+    winner: str
+    loser: str
+
+    def __str__(self) -> str:
+        return f"[{self.section}] {self.option} is set by both {self.winner} and {self.loser}; using {self.winner}"
+
+
+def parse(filename: str, text: str) -> Sections:
+    """Parse a single configuration file into its sections and options."""
+    parser = configparser.RawConfigParser(default_section=_NO_DEFAULT_SECTION)
+    try:
+        parser.read_string(text, filename)
+    except configparser.Error as e:
+        raise FragmentError(filename, str(e)) from e
+    return {section: dict(parser.items(section)) for section in parser.sections()}
+
+
+class Cache:
+    """Parsed files, in ``BLOB_ID.json`` under ``path``."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.used: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, blob_id: str) -> str:
+        return os.path.join(self.path, f"{blob_id}.json")
+
+    def _read(self, blob_id: str) -> t.Optional[Sections]:
+        try:
+            with open(self._entry_path(blob_id)) as fp:
+                cached = json.load(fp)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        except ValueError:
+            return None
+        if cached.get("version") != CACHE_VERSION:
+            return None
+        return cached["sections"]
+
+    def get(self, repo: objects.Repository, filename: str, blob_id: str) -> Sections:
+        """Return the parsed contents of ``filename``, which is blob ``blob_id`` in ``repo``."""
+        self.used.add(blob_id)
+        sections = self._read(blob_id)
+        if sections is not None:
+            self.hits += 1
+            return sections
+        self.misses += 1
+        _log.debug("Parsing %s", filename)
+        sections = parse(filename, repo.read_typed(blob_id, objects.OBJ_BLOB).decode("utf-8"))
+        os.makedirs(self.path, exist_ok=True)
+        util.write_file(self._entry_path(blob_id), json.dumps({"version": CACHE_VERSION, "sections": sections}))
+        return sections
+
+    def collect_garbage(self) -> None:
+        """Remove the entries that weren't used since the cache was opened."""
+        try:
+            filenames = os.listdir(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        for filename in filenames:
+            if filename.endswith(".json") and filename[: -len(".json")] not in self.used:
+                os.unlink(os.path.join(self.path, filename))
+
+
+def get_cache(config: configparser.ConfigParser) -> Cache:
+    return Cache(os.path.join(util.get_generated_files_dir(config), "fragment-cache"))
+
+
+def merge(files: list[tuple[str, Sections]]) -> tuple[Sections, list[Conflict]]:
+    """Combine parsed files, earlier files taking precedence.
+
+    Returns the combined sections, in the order they first appear, and
+    every option set to different values by more than one file.
+    """
+    merged: Sections = {}
+    origins: dict[tuple[str, str], str] = {}
+    conflicts = []
+    for filename, sections in files:
+        for section, options in sections.items():
+            target = merged.setdefault(section, {})
+            for option, value in options.items():
+                origin = origins.get((section, option))
+                if origin is None:
+                    target[option] = value
+                    origins[section, option] = filename
+                elif target[option] != value:
+                    conflicts.append(Conflict(section, option, origin, filename))
+    return merged, conflicts
+
+
+def _format_value(value: str) -> str:
+    # continuation lines are indented
+    return value.replace("\n", "\n\t")
+
+
+def format_sections(sections: Sections) -> str:
+    lines = [f"# combined from gitosis.conf and {FRAGMENT_DIR}/*{FRAGMENT_SUFFIX}; edit those instead"]
+    for section, options in sections.items():
+        lines.append(f"[{section}]")
+        lines.extend(f"{option} = {_format_value(value)}" for option, value in options.items())
+        lines.append("")
+    return "\n".join(lines)
+
+
+def combine(repo: objects.Repository, treeish: str, path: str, cache: Cache) -> list[Conflict]:
+    """Write the configuration combined from ``treeish`` to ``path``.
+
+    Nothing is written if ``treeish`` has no fragments, as
+    ``gitosis.conf`` is then the whole configuration. Returns the
+    conflicts found.
+    """
+    fragments = sorted(
+        (filename, blob_id)
+        for filename, blob_id in repo.get_blob_ids(treeish, FRAGMENT_DIR).items()
+        if filename.endswith(FRAGMENT_SUFFIX)
+    )
+    if not fragments:
+        return []
+    files = []
+    found = repo.lookup(treeish, "gitosis.conf")
+    if found is not None and found[0] != objects.MODE_TREE:
+        files.append(("gitosis.conf", cache.get(repo, "gitosis.conf", found[1])))
+    for filename, blob_id in fragments:
+        relpath = f"{FRAGMENT_DIR}/{filename}"
+        files.append((relpath, cache.get(repo, relpath, blob_id)))
+    merged, conflicts = merge(files)
+    util.write_file(path, format_sections(merged))
+    return conflicts
@@ -0,0 +1,230 @@
+"""Publish generated files as consistent snapshots.
+
+Everything gitosis generates from ``gitosis.conf`` -- the configuration
+and ``keydir`` exported from the admin repository, the project lists,
+the ``git daemon`` access policy, the repositories each group is
+granted and the ``authorized_keys`` lines -- is
+written to a new directory under ``generations`` in the generated files
+directory. Once that's complete, the ``current`` symlink is switched to
+it with a single rename. Readers that resolve ``current`` once see a
+complete generation, never a mix of old and new files, without taking
+any locks. The familiar paths, such as ``~/gitosis/projects.list`` and
+the admin repository's ``gitosis.conf``, are symlinks through
+``current``.
+
+Published generations are never modified, so ``current`` can be copied
+to other machines as it is, for instance with ``rsync``. Only the most
+recent ``keep-generations`` generations (default 3) are kept.
+"""
+
+from collections import abc
+import configparser
+import contextlib
+import errno
+import fcntl
+import logging
+import os
+import secrets
+import shutil
+import time
+import typing as t
+
+from gitosis import access, cgit, config, daemon_access, fragments, gitdaemon, gitweb, ssh, transaction, util
+
+_log = logging.getLogger(__name__)
+
+CURRENT = "current"
+GENERATIONS = "generations"
+DEFAULT_KEEP = 3
+
+# generated files that are also linked from the generated files
+# directory itself, where they were before there were generations
+LINKED = ["projects.list", "cgitrc", "user-projects", daemon_access.POLICY]
+
+# the admin repository commit gitosis.conf and keydir were exported from
+COMMIT = "commit"
+
+# what was exported from the admin repository
+EXPORTED = ["gitosis.conf", fragments.FRAGMENT_DIR, "keydir", COMMIT]
+
+# generated files copied from the current generation, so that they're
+# only replaced where they change: user project lists are updated
+# incrementally, and cgitrc keeps its inode and mtime for cgit's cache
+INCREMENTAL = ["user-projects", "cgitrc"]
+
+# copied from the current generation when regenerating without a new
+# export
+_CARRIED = [*EXPORTED, *INCREMENTAL]
+
+# parsed key files; working state, so kept outside the generations
+KEY_CACHE = "key-cache.json"
+
+# unpublished generations older than this are assumed to be abandoned
+_STALE = 3600
+
+
+def get_current(generated: str) -> t.Optional[str]:
+    """Return the path of the current generation, if there is one."""
+    try:
+        target = os.readlink(os.path.join(generated, CURRENT))
+    except OSError as e:
+        if e.errno not in (errno.ENOENT, errno.EINVAL):
+            raise
+        return None
+    return os.path.join(generated, target)
+
+
+def get_commit(generated: str) -> t.Optional[str]:
+    """Return the admin repository commit the current generation was exported from."""
+    try:
+        return util.read_file(os.path.join(generated, CURRENT, COMMIT)).strip()
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+
+@contextlib.contextmanager
+def locked(generated: str) -> abc.Iterator[None]:
+    """Serialize building generations, so they're published in order."""
+    generations = os.path.join(generated, GENERATIONS)
+    os.makedirs(generations, exist_ok=True)
+    with open(os.path.join(generations, ".lock"), "a") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _carry(src: str, dst: str) -> None:
+    # published generations are never written to, so hard links are
+    # safe: files are only ever replaced by renaming over them
+    if os.path.isdir(src) and not os.path.islink(src):
+        shutil.copytree(src, dst, symlinks=True, copy_function=os.link)
+    elif os.path.lexists(src):
+        os.link(src, dst)
+
+
+@contextlib.contextmanager
+def building(generated: str, carry: abc.Iterable[str] = ()) -> abc.Iterator[str]:
+    """Build a new generation, publishing it if the block succeeds.
+
+    Yields the directory to write the generation to. ``carry`` names
+    files to start from the current generation; they're hard linked, so
+    they must be replaced rather than written to. The section index of
+    the generation's ``gitosis.conf`` is written before it's published.
+    """
+    generations = os.path.join(generated, GENERATIONS)
+    os.makedirs(generations, exist_ok=True)
+    name = f"{time.time_ns():020d}-{secrets.token_hex(4)}"
+    tmp = os.path.join(generations, f".{name}.tmp")
+    os.mkdir(tmp)
+    try:
+        current = get_current(generated)
+        if current is not None:
+            for filename in carry:
+                _carry(os.path.join(current, filename), os.path.join(tmp, filename))
+        yield tmp
+        if os.path.exists(os.path.join(tmp, "gitosis.conf")):
+            # readers can't write it once the generation is published
+            config.write_index(os.path.join(tmp, "gitosis.conf"))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    path = os.path.join(generations, name)
+    os.rename(tmp, path)
+    publish(generated, path)
+
+
+def publish(generated: str, path: str) -> None:
+    """Make the generation at ``path`` the current one."""
+    util.replace_symlink(os.path.relpath(path, generated), os.path.join(generated, CURRENT))
+    _log.debug("Published generation %s", os.path.basename(path))
+    for filename in LINKED:
+        link = os.path.join(generated, filename)
+        target = os.path.join(CURRENT, filename)
+        if not os.path.lexists(os.path.join(path, filename)):
+            if os.path.islink(link) and os.readlink(link) == target:
+                os.unlink(link)
+            continue
+        if os.path.islink(link):
+            if os.readlink(link) == target:
+                continue
+        elif os.path.isdir(link):
+            # left over from before there were generations
+            shutil.rmtree(link)
+        util.replace_symlink(target, link)
+
+
+def collect_garbage(generated: str, keep: int = DEFAULT_KEEP) -> None:
+    """Remove all but the newest ``keep`` generations, and abandoned ones."""
+    generations = os.path.join(generated, GENERATIONS)
+    current = get_current(generated)
+    current_name = None if current is None else os.path.basename(current)
+    names = sorted(os.listdir(generations))
+    published = [name for name in names if not name.startswith(".")]
+    for name in published[: -max(keep, 1)]:
+        if name != current_name:
+            _log.debug("Removing generation %s", name)
+            shutil.rmtree(os.path.join(generations, name), ignore_errors=True)
+    now = time.time()
+    for name in names:
+        if name.startswith(".") and name.endswith(".tmp"):
+            path = os.path.join(generations, name)
+            with contextlib.suppress(OSError):
+                if now - os.stat(path).st_mtime > _STALE:
+                    shutil.rmtree(path, ignore_errors=True)
+
+
+def get_key_cache(config: configparser.ConfigParser) -> ssh.KeyCache:
+    return ssh.KeyCache(os.path.join(util.get_generated_files_dir(config=config), KEY_CACHE))
+
+
+def generate(
+    config: configparser.ConfigParser,
+    path: str,
+    cache: t.Optional[ssh.KeyCache] = None,
+    ids: t.Optional[dict[str, str]] = None,
+) -> None:
+    """Generate the files derived from the configuration into ``path``.
+
+    ``ids`` identifies the contents of the key files, as for
+    :meth:`gitosis.ssh.KeyCache.read_keys`. The files are written
+    through a single :class:`gitosis.transaction.WriteTransaction`, so
+    they're made durable together, before the generation is published.
+    """
+    keydir = os.path.join(path, "keydir")
+    with transaction.WriteTransaction() as writes:
+        gitweb.generate_project_list(config=config, path=os.path.join(path, "projects.list"), writes=writes)
+        access.write_grants(config, os.path.join(path, access.GRANTS), writes)
+        if util.get_boolean(config, "gitosis", "generate-cgitrc", default=False):
+            cgit.generate_cgitrc(config=config, path=os.path.join(path, "cgitrc"), writes=writes)
+        elif os.path.exists(os.path.join(path, "cgitrc")):
+            os.unlink(os.path.join(path, "cgitrc"))
+        if util.get_boolean(config, "gitosis", "user-project-lists", default=False):
+            gitweb.generate_user_project_lists(
+                config=config,
+                path=os.path.join(path, "user-projects"),
+                users=ssh.get_users(keydir) if os.path.isdir(keydir) else (),
+                writes=writes,
+            )
+        elif os.path.exists(os.path.join(path, "user-projects")):
+            shutil.rmtree(os.path.join(path, "user-projects"))
+        gitdaemon.update_daemon_access(config=config, directory=path, writes=writes)
+        if os.path.isdir(keydir):
+            if cache is None:
+                cache = get_key_cache(config)
+            lines = ssh.generate_authorized_keys(cache.read_keys(keydir, ids))
+            writes.write_file(os.path.join(path, "authorized_keys"), "".join(f"{line}\n" for line in lines))
+            _log.debug("Read %d of %d key files", cache.misses, cache.hits + cache.misses)
+            cache.save()
+
+
+def regenerate(config: configparser.ConfigParser) -> None:
+    """Publish a new generation with the current configuration and keys."""
+    generated = util.get_generated_files_dir(config=config)
+    with locked(generated):
+        with building(generated, carry=_CARRIED) as path:
+            generate(config, path)
+        collect_garbage(generated, util.get_int(config, "gitosis", "keep-generations", default=DEFAULT_KEEP))
@@ -2,8 +2,9 @@ import configparser
 import errno
 import logging
 import os
+import typing as t
 
-from gitosis import util
+from gitosis import daemon_access, farm, layout, transaction, util
 
 log = logging.getLogger(__name__)
 
@@ -61,9 +62,7 @@ def set_export_ok(config: configparser.ConfigParser) -> None:
         dirnames[:] = to_recurse
 
         for repo in repos:
-            name, _ = os.path.splitext(repo)
-            if reldir != os.path.curdir:
-                name = os.path.join(reldir, name)
+            name = layout.get_name_from_relpath(os.path.normpath(os.path.join(reldir, repo)))
 
             if util.get_boolean(config, f"repo {name}", "daemon", default=global_enable):
                 log.debug("Allow %s", name)
@@ -71,3 +70,63 @@ def set_export_ok(config: configparser.ConfigParser) -> None:
             else:
                 log.debug("Deny %s", name)
                 deny_export(os.path.join(dirpath, repo))
+
+
+def compile_access_policy(config: configparser.ConfigParser) -> tuple[bool, dict[str, bool]]:
+    """Decide which repositories ``git daemon`` may export, without walking them.
+
+    Returns the default for repositories not mentioned in the
+    configuration, and a mapping of repository paths to whether they
+    may be exported. Repositories are listed under their physical path,
+    and, if a symlink farm is configured, under their path in the farm,
+    so that mapped names get their own ``daemon`` setting.
+    """
+    repositories = util.get_repository_dir(config)
+    symlink_farm = util.get_symlink_farm_dir(config)
+    global_enable = util.get_boolean(config, "gitosis", "daemon", default=False)
+
+    def _allowed(name: str) -> bool:
+        return util.get_boolean(config, f"repo {name}", "daemon", default=global_enable)
+
+    entries = {}
+    for link, target in farm.get_logical_names(config).items():
+        target = os.path.normpath(target)
+        physical = os.path.relpath(target, repositories)
+        if not physical.startswith(os.pardir):
+            entries[target] = _allowed(t.cast("str", layout.get_name_from_relpath(physical)))
+        if symlink_farm is not None:
+            entries[os.path.normpath(os.path.join(symlink_farm, link))] = _allowed(link[: -len(".git")])
+    return global_enable, entries
+
+
+def write_access_policy(
+    config: configparser.ConfigParser,
+    path: str,
+    writes: t.Optional[transaction.WriteTransaction] = None,
+) -> None:
+    """Write the policy read by ``gitosis-daemon-access`` to ``path``, or stage it in ``writes``."""
+    default, entries = compile_access_policy(config)
+    open_write = util.safe_open_write if writes is None else writes.open_write
+    with open_write(path) as fp:
+        daemon_access.write_policy(fp, default=default, entries=entries)
+
+
+def update_daemon_access(
+    config: configparser.ConfigParser,
+    directory: t.Optional[str] = None,
+    writes: t.Optional[transaction.WriteTransaction] = None,
+) -> None:
+    """Update ``git daemon`` export permissions after a configuration change.
+
+    The policy for ``gitosis-daemon-access`` is written to ``directory``,
+    by default the generated files directory, if ``daemon-access-hook``
+    is set, staged in ``writes`` if that's given, and the
+    ``git-daemon-export-ok`` files are maintained unless
+    ``daemon-export-ok-files`` is turned off.
+    """
+    if util.get_boolean(config, "gitosis", "daemon-access-hook", default=False):
+        if directory is None:
+            directory = util.get_generated_files_dir(config=config)
+        write_access_policy(config, os.path.join(directory, daemon_access.POLICY), writes)
+    if util.get_boolean(config, "gitosis", "daemon-export-ok-files", default=True):
+        set_export_ok(config)
@@ -24,13 +24,16 @@ To plug this into ``gitweb``, you have two choices.
    isolates the changes a bit more nicely. Recommended.
 """
 
+from collections import abc
 import configparser
+import errno
+import hashlib
 import logging
 import os
 import typing as t
 from urllib.parse import quote_plus
 
-from gitosis import util
+from gitosis import access, group, layout, ssh, transaction, util
 
 _log = logging.getLogger(__name__)
 
@@ -42,8 +45,12 @@ def generate_project_list_fp(config: configparser.ConfigParser, fp: t.IO) -> Non
 
     :param fp: writable for ``projects.list``
     :type fp: (file-like, anything with ``.write(data)``)
+
+    If a symlink farm is configured, repositories are looked up in it
+    rather than in the physical repository directory, so ``map`` names
+    can be listed too.
     """
-    repositories = util.get_repository_dir(config)
+    symlink_farm = util.get_symlink_farm_dir(config)
 
     global_enable = util.get_boolean(config, "gitosis", "gitweb", default=False)
 
@@ -60,62 +67,155 @@ def generate_project_list_fp(config: configparser.ConfigParser, fp: t.IO) -> Non
             continue
 
         (name,) = parts
+        print(_project_line(config, symlink_farm, name), file=fp)
 
-        if not os.path.exists(os.path.join(repositories, name)):
-            namedotgit = f"{name}.git"
-            if os.path.exists(os.path.join(repositories, namedotgit)):
-                name = namedotgit
-            else:
-                _log.warning("Cannot find '%s' in '%s'", name, repositories)
 
-        response = [name]
-        owner = util.get(config, section, "owner")
-        if owner is not None:
-            response.append(owner)
+def _project_line(config: configparser.ConfigParser, symlink_farm: t.Optional[str], name: str) -> str:
+    response = [name]
+    path = layout.find(config, name, symlink_farm)
+    if path is None:
+        _log.warning("Cannot find '%s' in '%s'", name, symlink_farm or util.get_repository_dir(config))
+    elif path.endswith(".git") and not name.endswith(".git"):
+        response = [f"{name}.git"]
+
+    owner = util.get(config, f"repo {name}", "owner")
+    if owner is not None:
+        response.append(owner)
 
-        line = " ".join(quote_plus(s) for s in response)
-        print(line, file=fp)
+    return " ".join(quote_plus(s) for s in response)
 
 
-def generate_project_list(config: configparser.ConfigParser, path: str) -> None:
+def generate_project_list(
+    config: configparser.ConfigParser,
+    path: str,
+    writes: t.Optional[transaction.WriteTransaction] = None,
+) -> None:
     """Generate projects list for ``gitweb``.
 
     :param config: configuration to read projects from
 
     :param path: path to write projects list to
+
+    :param writes: transaction to stage the list in, rather than
+        writing it straight away
     """
-    with util.safe_open_write(path) as fp:
+    open_write = util.safe_open_write if writes is None else writes.open_write
+    with open_write(path) as fp:
         generate_project_list_fp(config=config, fp=fp)
 
 
+def generate_user_project_lists(
+    config: configparser.ConfigParser,
+    path: str,
+    users: abc.Iterable[str] = (),
+    writes: t.Optional[transaction.WriteTransaction] = None,
+) -> None:
+    """Generate a projects list for every user.
+
+    Each list names every repository the user can read, regardless of
+    ``gitweb`` visibility, for web frontends that do their own
+    authentication. Users with the same effective access share a list:
+    the lists themselves are stored under ``path/lists``, named after a
+    hash of their contents, and ``path/users/USER.list`` is a symlink
+    to the one for ``USER``. Only lists and links that changed are
+    written, and lists nobody uses any more are removed.
+
+    :param config: configuration to read projects from
+
+    :param path: directory to write the lists to
+
+    :param users: users to generate lists for, in addition to those
+        named in ``members`` lines
+
+    :param writes: transaction to stage new lists in; the links to them
+        are still replaced straight away
+    """
+    symlink_farm = util.get_symlink_farm_dir(config)
+    write_file = util.write_file if writes is None else writes.write_file
+    grants = access.get_grants(config)
+    closure = group.get_membership_closure(config, users)
+
+    lists_dir = os.path.join(path, "lists")
+    os.makedirs(lists_dir, exist_ok=True)
+    users_dir = os.path.join(path, "users")
+    os.makedirs(users_dir, exist_ok=True)
+
+    lines: dict[str, str] = {}
+    by_groups: dict[frozenset[str], str] = {}
+    wanted: dict[str, str] = {}
+    for user, groups in closure.items():
+        if not ssh.is_safe_username(user):
+            _log.warning("Not generating a projects list for unsafe username: %r", user)
+            continue
+        groups = frozenset(groups)
+        digest = by_groups.get(groups)
+        if digest is None:
+            names = set()
+            for groupname in groups:
+                for paths in grants.get(groupname, {}).values():
+                    names.update(paths)
+            for name in names.difference(lines):
+                lines[name] = _project_line(config, symlink_farm, name)
+            contents = "".join(f"{lines[name]}\n" for name in sorted(names))
+            digest = hashlib.sha256(contents.encode("utf-8")).hexdigest()
+            by_groups[groups] = digest
+            list_path = os.path.join(lists_dir, f"{digest}.list")
+            if not os.path.exists(list_path):
+                write_file(list_path, contents)
+        wanted[user] = digest
+
+    _link_user_project_lists(users_dir, wanted)
+
+    in_use = {f"{digest}.list" for digest in wanted.values()}
+    for filename in os.listdir(lists_dir):
+        if filename.endswith(".list") and filename not in in_use:
+            os.unlink(os.path.join(lists_dir, filename))
+
+
+def _link_user_project_lists(users_dir: str, wanted: dict[str, str]) -> None:
+    for user, digest in wanted.items():
+        link = os.path.join(users_dir, f"{user}.list")
+        target = os.path.join(os.path.pardir, "lists", f"{digest}.list")
+        try:
+            current = os.readlink(link)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            current = None
+        if current != target:
+            _log.debug("Updating projects list for %s", user)
+            util.replace_symlink(target, link)
+
+    for filename in os.listdir(users_dir):
+        user, ext = os.path.splitext(filename)
+        if ext == ".list" and user not in wanted:
+            os.unlink(os.path.join(users_dir, filename))
+
+
 def set_descriptions(config: configparser.ConfigParser) -> None:
-    """Set descriptions for gitweb use."""
+    """Set descriptions for gitweb use.
+
+    Only descriptions that changed are written, and they're made durable
+    together rather than one at a time.
+    """
     repositories = util.get_repository_dir(config)
 
-    for section in config.sections():
-        parts = section.split(None, 1)
-        type_ = parts.pop(0)
-        if type_ != "repo" or not parts:
-            continue
+    with transaction.WriteTransaction() as writes:
+        for section in config.sections():
+            parts = section.split(None, 1)
+            type_ = parts.pop(0)
+            if type_ != "repo" or not parts:
+                continue
 
-        description = util.get(config, section, "description")
-        if not description:
-            continue
+            description = util.get(config, section, "description")
+            if not description:
+                continue
 
-        (name,) = parts
+            (name,) = parts
 
-        if not os.path.exists(os.path.join(repositories, name)):
-            namedotgit = f"{name}.git"
-            if os.path.exists(os.path.join(repositories, namedotgit)):
-                name = namedotgit
-            else:
+            git_dir = layout.find(config, name)
+            if git_dir is None:
                 _log.warning("Cannot find '%s' in '%s'", name, repositories)
                 continue
 
-        path = os.path.join(
-            repositories,
-            name,
-            "description",
-        )
-        with util.safe_open_write(path) as fp:
-            print(description, file=fp)
+            writes.write_file_if_changed(os.path.join(git_dir, "description"), f"{description}\n")
@@ -2,23 +2,34 @@ from collections import abc
 import configparser
 import logging
 
-from gitosis import util
+from gitosis import provider, util
 
 _log = logging.getLogger(__name__)
 
 GROUP_PREFIX = "group "
 
 
-def _get_membership(config: configparser.ConfigParser, user: str, seen: set[str]) -> abc.Iterator[str]:
+def _get_groups(config: configparser.ConfigParser) -> dict[str, frozenset[str]]:
+    """Return the members of every group, including those from the group provider.
+
+    Groups in the configuration come first, in order, followed by any
+    only known to the provider, by name.
+    """
+    groups = {}
     for section in config.sections():
-        if not section.startswith(GROUP_PREFIX):
-            continue
-        group = section[len(GROUP_PREFIX) :]
+        if section.startswith(GROUP_PREFIX):
+            members = frozenset(util.get(config, section, "members", default="").split())  # type: ignore
+            groups[section[len(GROUP_PREFIX) :]] = members
+    for group, members in sorted(provider.get_groups(config).items()):
+        groups[group] = groups.get(group, frozenset()).union(members)
+    return groups
+
+
+def _get_membership(groups: dict[str, frozenset[str]], user: str, seen: set[str]) -> abc.Iterator[str]:
+    for group, members in groups.items():
         if group in seen:
             continue
 
-        members = frozenset(util.get(config, section, "members", default="").split())  # type: ignore
-
         # @all is the only group where membership needs to be
         # bootstrapped like this, anything else gets started from the
         # username itself
@@ -28,7 +39,7 @@ def _get_membership(config: configparser.ConfigParser, user: str, seen: set[str]
             yield group
 
             yield from _get_membership(
-                config,
+                groups,
                 f"@{group}",
                 seen,
             )
@@ -37,6 +48,46 @@ def _get_membership(config: configparser.ConfigParser, user: str, seen: set[str]
 def get_membership(config: configparser.ConfigParser, user: str) -> abc.Iterator[str]:
     """Generate groups ``user`` is member of, according to ``config``."""
     seen: set[str] = set()
-    yield from _get_membership(config, user, seen)
+    yield from _get_membership(_get_groups(config), user, seen)
     # everyone is always a member of group "all"
     yield "all"
+
+
+def get_membership_closure(
+    config: configparser.ConfigParser,
+    users: abc.Iterable[str] = (),
+) -> dict[str, tuple[str, ...]]:
+    """Compute group membership for many users at once.
+
+    Gives the same groups, in the same order, as :func:`get_membership`
+    for every user in ``users`` and every user named in a ``members``
+    line, but only reads the configuration once.
+    """
+    # for every member, the groups listing it, in configuration order
+    parents: dict[str, list[str]] = {}
+    order: dict[str, int] = {}
+    for group, members in _get_groups(config).items():
+        order[group] = len(order)
+        for member in members:
+            parents.setdefault(member, []).append(group)
+    everyone = parents.get("@all", [])
+
+    def _walk(name: str, seen: set[str], found: list[str]) -> None:
+        candidates = parents.get(name, [])
+        if everyone:
+            candidates = sorted(set(candidates).union(everyone), key=order.__getitem__)
+        for group in candidates:
+            if group in seen:
+                continue
+            seen.add(group)
+            found.append(group)
+            _walk(f"@{group}", seen, found)
+
+    names = set(users).union(member for member in parents if not member.startswith("@"))
+    closure = {}
+    for user in names:
+        found: list[str] = []
+        _walk(user, set(), found)
+        found.append("all")
+        closure[user] = tuple(found)
+    return closure
@@ -0,0 +1,330 @@
+"""Run gitosis' work in repository hooks as plugins.
+
+Whatever gitosis does when a repository is pushed to is done by a
+plugin of ``gitosis-run-hook``, which runs every plugin enabled for the
+repository in a single process, reading the ref updates from ``stdin``
+just once for all of them. The ``stats``, ``replicate``, ``readme`` and
+``refs`` plugins are enabled by ``repository-stats``, ``replicas``,
+``readme-html`` and ref rules; any others are enabled by listing them
+in ``hooks`` in a ``[repo NAME]`` section, or in ``[gitosis]`` for every
+repository. Other packages can provide plugins through the
+``gitosis.hooks`` entry point group. In ``pre-receive`` and ``update``,
+a plugin can refuse a push by raising :exc:`HookRejectedError`. Any
+other exception is logged, and refuses the push there too; after a
+push, the remaining plugins still run.
+
+By default, the hooks that enabled plugins need are installed in each
+repository, except where a repository has a hook of its own by that
+name, which is left alone, with a warning. With ``shared-hooks = yes``,
+every hook any plugin needs is installed once, in ``hooks`` in the
+generated files directory, and repositories point at it with
+``core.hooksPath``, so that enabling a plugin doesn't mean touching any
+repository. Existing repositories are switched over, or back, in bulk on
+the next push to ``gitosis-admin``.
+``core.hooksPath`` hides any hooks a repository has of its own.
+"""
+
+from collections import abc
+import configparser
+import functools
+import importlib.metadata
+import logging
+import os
+import subprocess
+import typing as t
+
+from gitosis import access, group, layout, readme, refs, replicate, repository, stats, util
+
+_log = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "gitosis.hooks"
+
+PRE_RECEIVE = "pre-receive"
+UPDATE = "update"
+POST_RECEIVE = "post-receive"
+POST_UPDATE = "post-update"
+
+# the admin repository has a post-update hook of its own, which
+# core.hooksPath would hide
+ADMIN = "gitosis-admin"
+
+
+class HookRejectedError(Exception):
+    """Push rejected"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+class RefUpdate(t.NamedTuple):
+    old: str
+    new: str
+    ref: str
+
+
+class Context:
+    """What a hook is being run for.
+
+    ``name`` is ``None`` for a repository outside the repositories
+    directory, which only the ``refs`` plugin is run for.
+    """
+
+    def __init__(
+        self,
+        config: configparser.ConfigParser,
+        config_path: str,
+        hook: str,
+        git_dir: str,
+        name: t.Optional[str],
+        args: list[str],
+        updates: list[RefUpdate],
+    ) -> None:
+        self.config = config
+        self.config_path = config_path
+        self.hook = hook
+        self.git_dir = git_dir
+        self.name = name
+        self.args = args
+        self.updates = updates
+
+
+class Plugin:
+    """Something to do in one or more hooks.
+
+    ``name`` is what ``hooks`` settings refer to the plugin by, and
+    ``hooks`` are the hooks it's run in.
+    """
+
+    name = ""
+    hooks: abc.Set[str] = frozenset()
+
+    def is_enabled(self, config: configparser.ConfigParser, name: str) -> bool:  # noqa: ARG002
+        """Check whether the plugin is enabled for repository ``name`` without being listed in ``hooks``."""
+        return False
+
+    def run(self, context: Context) -> None:
+        raise NotImplementedError
+
+
+class StatsPlugin(Plugin):
+    name = "stats"
+    hooks = frozenset([POST_RECEIVE])
+
+    def is_enabled(self, config: configparser.ConfigParser, name: str) -> bool:  # noqa: ARG002
+        return stats.is_enabled(config)
+
+    def run(self, context: Context) -> None:
+        stats.record_push(context.config, context.git_dir)
+
+
+class ReplicatePlugin(Plugin):
+    name = "replicate"
+    hooks = frozenset([POST_RECEIVE])
+
+    def is_enabled(self, config: configparser.ConfigParser, name: str) -> bool:
+        return bool(replicate.get_replicas(config, name))
+
+    def run(self, context: Context) -> None:
+        if replicate.queue_updates(context.config, context.git_dir, [update.ref for update in context.updates]):
+            replicate.start_worker(context.config_path)
+
+
+class ReadmePlugin(Plugin):
+    name = "readme"
+    hooks = frozenset([POST_RECEIVE])
+
+    def is_enabled(self, config: configparser.ConfigParser, name: str) -> bool:
+        return readme.is_enabled(config, name)
+
+    def run(self, context: Context) -> None:
+        readme.update(context.git_dir)
+
+
+class RefsPlugin(Plugin):
+    name = "refs"
+    hooks = frozenset([PRE_RECEIVE])
+
+    def is_enabled(self, config: configparser.ConfigParser, name: str) -> bool:  # noqa: ARG002
+        return refs.has_rules(config)
+
+    def run(self, context: Context) -> None:
+        user = os.environ.get("GITOSIS_USER")
+        if user is None:
+            _log.debug("Not checking ref rules for a push without GITOSIS_USER")
+            return
+        try:
+            denied = refs.check(context.config, user, context.git_dir, [update.ref for update in context.updates])
+        except refs.UnknownRepositoryError as e:
+            raise HookRejectedError(str(e)) from e
+        if denied:
+            raise HookRejectedError(f"{user} may not push to {', '.join(denied)}")
+
+
+BUILTIN_PLUGINS: list[type[Plugin]] = [StatsPlugin, ReplicatePlugin, ReadmePlugin, RefsPlugin]
+
+
+@functools.cache
+def get_plugins() -> dict[str, Plugin]:
+    """Return every available plugin, by name, built-in plugins first."""
+    plugins = {cls.name: cls() for cls in BUILTIN_PLUGINS}
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        group = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        group = entry_points.get(ENTRY_POINT_GROUP, [])
+    for entry_point in group:
+        if entry_point.name in plugins:
+            _log.warning("Ignoring hook plugin with a name already in use: %s", entry_point.name)
+            continue
+        try:
+            plugins[entry_point.name] = entry_point.load()()
+        except Exception:
+            _log.exception("Cannot load hook plugin %s", entry_point.name)
+    return plugins
+
+
+def get_enabled(config: configparser.ConfigParser, name: t.Optional[str]) -> list[Plugin]:
+    """Return the plugins enabled for repository ``name``.
+
+    A repository without a name, such as one under a group's own
+    ``repositories`` directory, only gets the ``refs`` plugin, which
+    finds the repository by its path, if there are ref rules.
+    """
+    if name is None:
+        return [get_plugins()[RefsPlugin.name]] if refs.has_rules(config) else []
+    listed = util.get(config, f"repo {name}", "hooks")
+    if listed is None:
+        listed = util.get(config, "gitosis", "hooks", default="")
+    plugins = get_plugins()
+    for unknown in sorted(set(listed.split()) - plugins.keys()):
+        _log.warning("Ignoring unknown hook plugin for %s: %s", name, unknown)
+    return [plugin for plugin in plugins.values() if plugin.name in listed.split() or plugin.is_enabled(config, name)]
+
+
+def read_updates(hook: str, args: list[str], lines: abc.Iterable[str]) -> list[RefUpdate]:
+    """Collect the ref updates a hook was given, on ``stdin`` or as arguments."""
+    if hook == UPDATE:
+        if len(args) != 3:
+            return []
+        ref, old, new = args
+        return [RefUpdate(old, new, ref)]
+    if hook not in (PRE_RECEIVE, POST_RECEIVE):
+        return []
+    updates = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3:
+            updates.append(RefUpdate(*parts))
+    return updates
+
+
+def dispatch(
+    config: configparser.ConfigParser,
+    config_path: str,
+    hook: str,
+    git_dir: str,
+    args: list[str],
+    stdin: abc.Iterable[str],
+) -> None:
+    """Run the plugins enabled for the repository at ``git_dir`` that ``hook`` concerns."""
+    name = layout.get_name(config, git_dir)
+    plugins = [plugin for plugin in get_enabled(config, name) if hook in plugin.hooks]
+    if not plugins:
+        if name is None:
+            _log.warning("Not running hooks for repository outside the repository directory: %s", git_dir)
+        return
+    context = Context(config, config_path, hook, git_dir, name, args, read_updates(hook, args, stdin))
+    for plugin in plugins:
+        _log.debug("Running %s for %s", plugin.name, hook)
+        _run_plugin(plugin, context)
+
+
+def _run_plugin(plugin: Plugin, context: Context) -> None:
+    # one plugin failing mustn't keep the others from running after a
+    # push, but before one, a failure has to refuse the push
+    try:
+        plugin.run(context)
+    except HookRejectedError:
+        raise
+    except Exception as e:
+        _log.exception("Hook plugin %s failed in %s for %s", plugin.name, context.hook, context.name)
+        if context.hook in (PRE_RECEIVE, UPDATE):
+            raise HookRejectedError(f"{plugin.name} failed") from e
+
+
+def is_shared(config: configparser.ConfigParser) -> bool:
+    return util.get_boolean(config, "gitosis", "shared-hooks", default=False)
+
+
+def get_shared_dir(config: configparser.ConfigParser) -> str:
+    return os.path.abspath(os.path.join(util.get_generated_files_dir(config), "hooks"))
+
+
+def install_shared(config: configparser.ConfigParser) -> str:
+    """Install every hook any plugin needs in the shared hooks directory."""
+    path = get_shared_dir(config)
+    for hook in sorted({hook for plugin in get_plugins().values() for hook in plugin.hooks}):
+        repository.write_hook(os.path.join(path, hook), hook)
+    return path
+
+
+def _get_hooks_path(git_dir: str) -> t.Optional[str]:
+    # anything unusual just means running "git config" anyway
+    parser = repository.read_config(git_dir)
+    if parser is None:
+        return None
+    return parser.get("core", "hookspath", fallback=None)
+
+
+def _set_hooks_path(git_dir: str, path: t.Optional[str], git: str) -> None:
+    args = ["core.hooksPath", path] if path is not None else ["--unset", "core.hooksPath"]
+    subprocess.run([git, f"--git-dir={git_dir}", "config", *args], check=True)  # noqa: S603
+
+
+def install(config: configparser.ConfigParser, name: t.Optional[str], git_dir: str, *, git: str = "git") -> None:
+    """Make the hooks plugins need run in repository ``name`` at ``git_dir``.
+
+    ``name`` is ``None`` for a repository outside the repository
+    directory, as :func:`get_enabled` has it.
+    """
+    shared_dir = get_shared_dir(config)
+    hooks_path = _get_hooks_path(git_dir)
+    if is_shared(config) and name != ADMIN:
+        if not os.path.isdir(shared_dir):
+            install_shared(config)
+        if hooks_path != shared_dir:
+            _set_hooks_path(git_dir, shared_dir, git)
+        return
+    if hooks_path == shared_dir:
+        _set_hooks_path(git_dir, None, git)
+    for hook in sorted({hook for plugin in get_enabled(config, name) for hook in plugin.hooks}):
+        repository.install_hook(git_dir=git_dir, hook=hook)
+
+
+def install_all(config: configparser.ConfigParser, *, git: str = "git") -> None:
+    """Install hooks in every repository, switching them to or from the shared hooks.
+
+    Repositories under a group's own ``repositories`` directory are
+    included, so that ref rules apply to them too.
+    """
+    if is_shared(config):
+        install_shared(config)
+    for name, git_dir in _find_repositories(config):
+        if not os.path.islink(git_dir):
+            install(config, name, git_dir, git=git)
+
+
+def _find_repositories(config: configparser.ConfigParser) -> abc.Iterator[tuple[t.Optional[str], str]]:
+    # the repository directory first, then any groups have of their own
+    seen = set()
+    topdirs = [util.get_repository_dir(config)]
+    for section in config.sections():
+        if section.startswith(group.GROUP_PREFIX) and config.has_option(section, "repositories"):
+            groupname = section[len(group.GROUP_PREFIX) :]
+            topdirs.append(os.path.join(os.path.expanduser("~"), access.get_prefix(config, groupname)))
+    for topdir in topdirs:
+        for _, git_dir in layout.find_repositories(topdir):
+            path = os.path.realpath(git_dir)
+            if path not in seen:
+                seen.add(path)
+                yield layout.get_name(config, git_dir), git_dir
@@ -0,0 +1,452 @@
+"""Serve repositories over git's smart HTTP protocol.
+
+This is a WSGI application that authenticates users, applies the same
+access control as ``gitosis-serve``, and hands authorized requests to
+``git http-backend``. Run it in any WSGI server, for instance::
+
+    gunicorn 'gitosis.http:make_app()'
+
+Users are identified by an authenticator, which is any callable taking
+the WSGI environment and returning a username, or ``None`` if the
+request isn't authenticated. By default, :class:`RemoteUserAuthenticator`
+trusts ``REMOTE_USER`` as set by a frontend web server. If
+``GITOSIS_HTPASSWD`` is set, :class:`HtpasswdAuthenticator` checks HTTP
+basic credentials against that file instead.
+
+The configuration is read once and only reread when the file changes,
+so a long-running server doesn't pay for parsing it on every request.
+
+:class:`SnapshotApplication` serves ``gitweb``-style snapshot links from
+the archive cache; see :mod:`gitosis.archive`. Route requests with
+``a=snapshot`` to ``gitosis.http:make_snapshot_app()``.
+"""
+
+import base64
+from collections import abc
+import configparser
+import contextlib
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import shutil
+import subprocess
+import threading
+import typing as t
+
+from gitosis import archive, config, layout, replicate, serve, ssh, transfer, util
+
+_log = logging.getLogger(__name__)
+
+_PATH_RE = re.compile(r"^/+(?P<path>.+?)/(?P<action>info/refs|git-upload-pack|git-receive-pack)$")
+
+SERVICES = ("git-upload-pack", "git-receive-pack")
+
+CHUNK_SIZE = 64 * 1024
+
+# snapshot formats as named by gitweb's ``sf`` parameter, mapped to the
+# ``git archive`` format and the content type to serve them with
+SNAPSHOT_FORMATS = {
+    "tgz": ("tgz", "application/x-gzip"),
+    "tar": ("tar", "application/x-tar"),
+    "zip": ("zip", "application/x-zip"),
+}
+
+_FULL_HASH_RE = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+# what may go into snapshot filenames, and so into Content-Disposition
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+Authenticator = abc.Callable[[dict], t.Optional[str]]
+StartResponse = abc.Callable[..., t.Any]
+
+
+class PolicyCache:
+    """Holds the parsed configuration, rereading it when the file changes."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._key: t.Optional[tuple[int, int, int]] = None
+        self._cfg = config.LazyConfigParser(interpolation=None)
+        self._lock = threading.Lock()
+
+    def get(self) -> configparser.ConfigParser:
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            _log.warning("Cannot stat %s: %s", self.path, e)
+            return self._cfg
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if key != self._key:
+            with self._lock:
+                if key != self._key:
+                    _log.info("Reloading %s", self.path)
+                    cfg = config.LazyConfigParser(interpolation=None)
+                    cfg.read(self.path)
+                    self._cfg = cfg
+                    self._key = key
+        return self._cfg
+
+
+class RemoteUserAuthenticator:
+    """Trust the user authenticated by the web server."""
+
+    def __call__(self, environ: dict) -> t.Optional[str]:
+        return environ.get("REMOTE_USER") or None
+
+
+def hash_password(password: str, *, iterations: int = 100_000) -> str:
+    """Hash ``password`` for use in a file read by :class:`HtpasswdAuthenticator`."""
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("ascii"), iterations)
+    return f"{{PBKDF2-SHA256}}{iterations}${salt}${digest.hex()}"
+
+
+def check_password(password: str, hashed: str) -> bool:
+    """Check ``password`` against a hash in an htpasswd-style file.
+
+    Supports Apache's ``{SHA}`` hashes and those made by
+    :func:`hash_password`.
+    """
+    if hashed.startswith("{SHA}"):
+        digest = base64.b64encode(hashlib.sha1(password.encode("utf-8")).digest()).decode("ascii")  # noqa: S324
+        return hmac.compare_digest(digest, hashed[len("{SHA}") :])
+    if hashed.startswith("{PBKDF2-SHA256}"):
+        try:
+            iterations, salt, expected = hashed[len("{PBKDF2-SHA256}") :].split("$")
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("ascii"), int(iterations))
+        except ValueError:
+            return False
+        return hmac.compare_digest(digest.hex(), expected)
+    return False
+
+
+class HtpasswdAuthenticator:
+    """Check HTTP basic credentials against an htpasswd-style file.
+
+    Each line of the file is ``USER:HASH``; see :func:`check_password`
+    for the supported hashes. The file is reread when it changes, and
+    credentials that have been checked once are remembered until then,
+    so clients reusing a connection don't pay for hashing each time.
+    While the file can't be read, every request is refused.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._key: t.Optional[tuple[int, int, int]] = None
+        self._hashes: dict[str, str] = {}
+        self._verified: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._error: t.Optional[str] = None
+
+    def _reload(self) -> bool:
+        # returns whether credentials can be checked
+        try:
+            st = os.stat(self.path)
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if key == self._key:
+                return True
+            hashes = {}
+            with open(self.path) as fp:
+                for line in fp:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    user, _, hashed = line.partition(":")
+                    hashes[user] = hashed
+        except OSError as e:
+            with self._lock:
+                # only log each new problem once, not on every request
+                if self._error != str(e):
+                    _log.error("Cannot read %s: %s", self.path, e)
+                self._error = str(e)
+                self._hashes = {}
+                self._verified = {}
+                self._key = None
+            return False
+        with self._lock:
+            self._hashes = hashes
+            self._verified = {}
+            self._key = key
+            self._error = None
+        return True
+
+    def __call__(self, environ: dict) -> t.Optional[str]:
+        header = environ.get("HTTP_AUTHORIZATION", "")
+        scheme, _, credentials = header.partition(" ")
+        if scheme.lower() != "basic":
+            return None
+        if not self._reload():
+            return None
+        user = self._verified.get(credentials)
+        if user is not None:
+            return user
+        try:
+            user, _, password = base64.b64decode(credentials).decode("utf-8").partition(":")
+        except ValueError:
+            return None
+        hashed = self._hashes.get(user)
+        if hashed is None or not check_password(password, hashed):
+            return None
+        with self._lock:
+            self._verified[credentials] = user
+        return user
+
+
+def _respond(start_response: StartResponse, status: str, headers: t.Optional[list] = None) -> list[bytes]:
+    body = f"{status}\n".encode()
+    start_response(
+        status,
+        [("Content-Type", "text/plain"), ("Content-Length", str(len(body))), *(headers or [])],
+    )
+    return [body]
+
+
+class Application:
+    """WSGI application serving repositories with ``git http-backend``."""
+
+    def __init__(
+        self,
+        config_path: str,
+        authenticator: t.Optional[Authenticator] = None,
+        git: t.Optional[str] = None,
+    ) -> None:
+        self.policy = PolicyCache(config_path)
+        self.authenticator = authenticator or RemoteUserAuthenticator()
+        self.git = git or util.find_git() or "git"
+
+    def __call__(self, environ: dict, start_response: StartResponse) -> abc.Iterable[bytes]:
+        user = self.authenticator(environ)
+        if user is None or not ssh.is_safe_username(user):
+            return _respond(start_response, "401 Unauthorized", [("WWW-Authenticate", 'Basic realm="gitosis"')])
+
+        match = _PATH_RE.match(environ.get("PATH_INFO", ""))
+        if match is None:
+            # only the smart protocol is supported
+            return _respond(start_response, "404 Not Found")
+        path, action = match.group("path", "action")
+        if action == "info/refs":
+            query = dict(part.partition("=")[::2] for part in environ.get("QUERY_STRING", "").split("&"))
+            verb = query.get("service", "")
+        else:
+            verb = action
+        if verb not in SERVICES or serve.ALLOW_RE.match(f"'{path}'") is None:
+            return _respond(start_response, "404 Not Found")
+
+        cfg = self.policy.get()
+        try:
+            fullpath = serve.get_repository_path(cfg=cfg, user=user, verb=verb, path=path)
+        except serve.ReadAccessDeniedError:
+            # don't reveal whether the repository exists
+            return _respond(start_response, "404 Not Found")
+        except serve.WriteAccessDeniedError:
+            return _respond(start_response, "403 Forbidden")
+
+        _log.debug("Serving %s %s for %s", verb, fullpath, user)
+        protocol = transfer.get_protocol(cfg, replicate.get_name(cfg, fullpath), environ.get("HTTP_GIT_PROTOCOL"))
+        return self._run_backend(environ, start_response, user, f"{os.path.abspath(fullpath)}/{action}", protocol)
+
+    def _run_backend(
+        self,
+        environ: dict,
+        start_response: StartResponse,
+        user: str,
+        path_info: str,
+        protocol: t.Optional[str] = None,
+    ) -> abc.Iterable[bytes]:
+        env = {
+            "PATH": os.environ.get("PATH", os.defpath),
+            "GIT_PROJECT_ROOT": "/",
+            "GIT_HTTP_EXPORT_ALL": "1",
+            "PATH_INFO": path_info,
+            "REMOTE_USER": user,
+            "GITOSIS_USER": user,
+            "REQUEST_METHOD": environ.get("REQUEST_METHOD", "GET"),
+            "QUERY_STRING": environ.get("QUERY_STRING", ""),
+            "CONTENT_TYPE": environ.get("CONTENT_TYPE", ""),
+            "REMOTE_ADDR": environ.get("REMOTE_ADDR", ""),
+        }
+        for cgi_name, wsgi_name in [
+            ("CONTENT_LENGTH", "CONTENT_LENGTH"),
+            ("HTTP_CONTENT_ENCODING", "HTTP_CONTENT_ENCODING"),
+        ]:
+            if environ.get(wsgi_name):
+                env[cgi_name] = environ[wsgi_name]
+        if protocol is not None:
+            env["GIT_PROTOCOL"] = protocol
+
+        child = subprocess.Popen(  # noqa: S603
+            [self.git, "http-backend"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+            close_fds=True,
+        )
+        length = environ.get("CONTENT_LENGTH")
+        feeder = threading.Thread(
+            target=_feed,
+            args=(environ["wsgi.input"], child.stdin, int(length) if length else None),
+            daemon=True,
+        )
+        feeder.start()
+
+        status = "200 OK"
+        headers = []
+        for line in iter(child.stdout.readline, b""):  # type: ignore
+            line = line.rstrip(b"\r\n")
+            if not line:
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "status":
+                status = value.strip()
+            else:
+                headers.append((name, value.strip()))
+        start_response(status, headers)
+        return _stream(child, feeder)
+
+
+def _feed(src: t.BinaryIO, dst: t.BinaryIO, length: t.Optional[int]) -> None:
+    try:
+        if length is None:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        else:
+            while length > 0:
+                chunk = src.read(min(length, CHUNK_SIZE))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                length -= len(chunk)
+    except BrokenPipeError:
+        _log.debug("git http-backend exited before reading the whole request")
+    finally:
+        with contextlib.suppress(BrokenPipeError):
+            dst.close()
+
+
+def _stream(child: subprocess.Popen, feeder: threading.Thread) -> abc.Iterator[bytes]:
+    try:
+        while True:
+            chunk = child.stdout.read1(CHUNK_SIZE)  # type: ignore
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        child.stdout.close()  # type: ignore
+        returncode = child.wait()
+        feeder.join()
+        if returncode != 0:
+            _log.warning("git http-backend exited with status %d", returncode)
+
+
+def _parse_query(query: str) -> dict[str, str]:
+    # gitweb separates parameters with ";"
+    return dict(part.partition("=")[::2] for part in re.split("[;&]", query) if part)
+
+
+class SnapshotApplication:
+    """WSGI application serving ``gitweb`` snapshots from the archive cache.
+
+    Only repositories ``gitweb`` is allowed to show can be snapshotted,
+    and archives are named the way ``gitweb`` names them.
+    """
+
+    def __init__(self, config_path: str, git: t.Optional[str] = None) -> None:
+        self.policy = PolicyCache(config_path)
+        self.git = git or util.find_git() or "git"
+
+    def _find_repository(self, cfg: configparser.ConfigParser, project: str) -> t.Optional[str]:
+        name = project.removesuffix(".git")
+        if serve.ALLOW_RE.match(f"'{name}'") is None:
+            return None
+        global_enable = util.get_boolean(cfg, "gitosis", "gitweb", default=False)
+        if not util.get_boolean(cfg, f"repo {name}", "gitweb", default=global_enable):
+            return None
+        path = layout.find(cfg, project, util.get_symlink_farm_dir(cfg))
+        return path if path is not None and os.path.isdir(path) else None
+
+    def __call__(self, environ: dict, start_response: StartResponse) -> abc.Iterable[bytes]:
+        query = _parse_query(environ.get("QUERY_STRING", ""))
+        project = query.get("p", "")
+        treeish = query.get("h") or "HEAD"
+        snapshot_format = SNAPSHOT_FORMATS.get(query.get("sf", "tgz"))
+        if snapshot_format is None:
+            return _respond(start_response, "400 Bad Request")
+        fmt, content_type = snapshot_format
+
+        cfg = self.policy.get()
+        cache = archive.get_cache(cfg, git=self.git)
+        if cache is None:
+            _log.error("No archive-cache configured")
+            return _respond(start_response, "500 Internal Server Error")
+        git_dir = self._find_repository(cfg, project)
+        resolved = None if git_dir is None else archive.resolve(git_dir, treeish, refs_only=False, git=self.git)
+        # gitweb links to commits by id, but only those the repository's
+        # refs lead to may be snapshotted, not whatever objects it has
+        if (
+            git_dir is None
+            or resolved is None
+            or not resolved[0]
+            or not archive.is_reachable(git_dir, resolved[0], git=self.git)
+        ):
+            return _respond(start_response, "404 Not Found")
+
+        name = os.path.basename(project.removesuffix(".git"))
+        version = treeish[:7] if _FULL_HASH_RE.match(treeish) else _UNSAFE_RE.sub("-", treeish)
+        basename = f"{name}-{version}"
+        request = archive.Archive(treeish, fmt, prefix=f"{basename}/")
+        try:
+            fp = cache.open(git_dir, request, *resolved)
+        except archive.ArchiveError as e:
+            _log.warning("%s", e)
+            return _respond(start_response, "500 Internal Server Error")
+
+        start_response(
+            "200 OK",
+            [
+                ("Content-Type", content_type),
+                ("Content-Length", str(os.fstat(fp.fileno()).st_size)),
+                ("Content-Disposition", f'attachment; filename="{basename}.{request.extension}"'),
+            ],
+        )
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if file_wrapper is not None:
+            return file_wrapper(fp, CHUNK_SIZE)
+        return _read_chunks(fp)
+
+
+def _read_chunks(fp: t.BinaryIO) -> abc.Iterator[bytes]:
+    with fp:
+        yield from iter(lambda: fp.read(CHUNK_SIZE), b"")
+
+
+def make_app(
+    config_path: t.Optional[str] = None,
+    htpasswd: t.Optional[str] = None,
+) -> Application:
+    """Create the application, by default configured from the environment.
+
+    :param config_path: path to ``gitosis.conf``; defaults to
+        ``GITOSIS_CONFIG``, or ``~/.gitosis.conf``
+
+    :param htpasswd: path to an htpasswd-style file to authenticate
+        users against; defaults to ``GITOSIS_HTPASSWD``, and if neither
+        is set, ``REMOTE_USER`` is trusted
+    """
+    if config_path is None:
+        config_path = os.environ.get("GITOSIS_CONFIG", os.path.expanduser("~/.gitosis.conf"))
+    if htpasswd is None:
+        htpasswd = os.environ.get("GITOSIS_HTPASSWD")
+    authenticator = HtpasswdAuthenticator(htpasswd) if htpasswd else RemoteUserAuthenticator()
+    return Application(config_path, authenticator)
+
+
+def make_snapshot_app(config_path: t.Optional[str] = None) -> SnapshotApplication:
+    """Create the snapshot application, by default configured from the environment.
+
+    :param config_path: path to ``gitosis.conf``; defaults to
+        ``GITOSIS_CONFIG``, or ``~/.gitosis.conf``
+    """
+    if config_path is None:
+        config_path = os.environ.get("GITOSIS_CONFIG", os.path.expanduser("~/.gitosis.conf"))
+    return SnapshotApplication(config_path)
@@ -11,7 +11,7 @@ import secrets
 import sys
 import typing as t
 
-from gitosis import app, repository, run_hook, ssh, util
+from gitosis import app, layout, repository, run_hook, ssh, util
 
 _log = logging.getLogger(__name__)
 
@@ -136,7 +136,7 @@ class Main(app.App):
         _log.info("Creating repository structure...")
         repositories = util.get_repository_dir(cfg)
         os.makedirs(repositories, exist_ok=True)
-        admin_repository = os.path.join(repositories, "gitosis-admin.git")
+        admin_repository = layout.get_path(cfg, "gitosis-admin")
         init_admin_repository(
             git_dir=admin_repository,
             pubkey=pubkey,
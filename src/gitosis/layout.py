@@ -0,0 +1,134 @@
+"""Where repositories are kept on disk.
+
+With the default ``repository-layout = flat``, repository ``NAME`` lives
+at ``NAME.git`` in the repositories directory. With ``repository-layout
+= sharded``, it lives at ``AB/CD/NAME.git`` instead, where ``ABCD``
+starts the SHA-1 of ``NAME``, so that tens of thousands of repositories
+don't all end up in a single directory. Names don't change: access
+checks, ``gitweb``, ``cgit`` and ``git daemon`` still see ``NAME``,
+although the web frontends and ``git daemon`` then need to be pointed
+at a symlink farm.
+
+A repository still at its old path is used from there until
+``gitosis-migrate-layout`` moves it, so the layout can be switched
+before migrating.
+"""
+
+import configparser
+import hashlib
+import os
+import re
+import typing as t
+
+from gitosis import util
+
+FLAT = "flat"
+SHARDED = "sharded"
+LAYOUTS = [FLAT, SHARDED]
+
+_SHARD_RE = re.compile(r"^[0-9a-f]{2}$")
+
+
+class UnknownLayoutError(Exception):
+    """Unknown repository layout"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+def get_layout(config: configparser.ConfigParser) -> str:
+    layout = util.get(config, "gitosis", "repository-layout", default=FLAT)
+    if layout not in LAYOUTS:
+        raise UnknownLayoutError(layout)
+    return layout
+
+
+def get_shard(name: str) -> str:
+    """Return the directory repository ``name`` is kept in, in the sharded layout."""
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()  # noqa: S324
+    return os.path.join(digest[:2], digest[2:4])
+
+
+def get_relpath(layout: str, name: str) -> str:
+    """Return where repository ``name`` is kept in ``layout``, relative to the repositories directory."""
+    if layout == SHARDED:
+        return os.path.join(get_shard(name), f"{name}.git")
+    return f"{name}.git"
+
+
+def get_path(config: configparser.ConfigParser, name: str, topdir: t.Optional[str] = None) -> str:
+    """Return the path of repository ``name`` in ``topdir``.
+
+    ``topdir`` defaults to the repositories directory. A repository that
+    hasn't been moved to the configured layout yet is found where it is;
+    repositories that don't exist yet go where the layout says.
+    """
+    if topdir is None:
+        topdir = util.get_repository_dir(config)
+    layout = get_layout(config)
+    path = os.path.join(topdir, get_relpath(layout, name))
+    if not os.path.exists(path):
+        for other in LAYOUTS:
+            candidate = os.path.join(topdir, get_relpath(other, name))
+            if other != layout and os.path.exists(candidate):
+                return candidate
+    return path
+
+
+def find(config: configparser.ConfigParser, name: str, topdir: t.Optional[str] = None) -> t.Optional[str]:
+    """Find repository ``name``, which may or may not end in ``.git``.
+
+    If ``topdir`` is given, such as a symlink farm, ``name`` is looked
+    up directly in it instead of in the repositories directory.
+    """
+    if topdir is not None:
+        candidates = [os.path.join(topdir, name), os.path.join(topdir, f"{name}.git")]
+    else:
+        repositories = util.get_repository_dir(config)
+        candidates = [os.path.join(repositories, name), get_path(config, name.removesuffix(".git"))]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def get_name_from_relpath(relpath: str) -> t.Optional[str]:
+    """Return the name of the repository at ``relpath`` in the repositories directory.
+
+    Works for both layouts. Returns None if ``relpath`` isn't a
+    repository path.
+    """
+    if relpath.startswith(os.pardir) or not relpath.endswith(".git"):
+        return None
+    parts = relpath.split(os.sep)
+    if len(parts) > 2 and _SHARD_RE.match(parts[0]) and _SHARD_RE.match(parts[1]):
+        name = os.path.join(*parts[2:])[: -len(".git")]
+        # a flat repository could have a name that looks like a shard
+        if get_shard(name) == os.path.join(parts[0], parts[1]):
+            return name
+    return relpath[: -len(".git")]
+
+
+def get_name(config: configparser.ConfigParser, git_dir: str) -> t.Optional[str]:
+    """Find the name of the repository at ``git_dir``.
+
+    Returns ``None`` if it's not in the repository directory.
+    """
+    repositories = os.path.realpath(util.get_repository_dir(config))
+    return get_name_from_relpath(os.path.relpath(os.path.realpath(git_dir), repositories))
+
+
+def find_repositories(repositories: str) -> t.Iterator[tuple[str, str]]:
+    """Find the repositories under ``repositories``, in either layout.
+
+    Yields ``(name, path)`` pairs. Repositories aren't looked into, so
+    their names must end in ``.git``.
+    """
+    for dirpath, dirnames, _ in os.walk(repositories):
+        repos = [dirname for dirname in dirnames if dirname.endswith(".git")]
+        dirnames[:] = sorted(dirname for dirname in dirnames if not dirname.endswith(".git"))
+        for repo in sorted(repos):
+            path = os.path.join(dirpath, repo)
+            name = get_name_from_relpath(os.path.relpath(path, repositories))
+            if name is not None:
+                yield name, path
@@ -0,0 +1,391 @@
+"""Put ``gitosis-serve`` under concurrent load.
+
+``gitosis-load`` sets up a throwaway installation (configuration, an
+admin repository with a key for every user, and bare repositories), and
+then runs ``gitosis-serve USER`` for a stream of ``SSH_ORIGINAL_COMMAND``
+values, with a number of them running at once. The stream is either
+generated from a mix of operations:
+
+``read``
+    ``git-upload-pack`` for an existing repository
+
+``write``
+    ``git-receive-pack`` for an existing repository
+
+``create``
+    ``git-receive-pack`` for a repository that doesn't exist yet, so
+    that ``gitosis-serve`` has to create it
+
+or replayed from a trace, with a ``USER COMMAND`` line for each request,
+such as ``jdoe git-upload-pack 'foo.git'``. Every repository a trace
+names is created beforehand, and every user is given access to all of
+them.
+
+By default, ``GITOSIS_GIT`` points at ``true``, so each request ends
+where ``gitosis-serve`` would exec ``git shell``, and its latency is
+everything gitosis does for it, process startup included. With
+``--end-to-end``, requests are made by running ``git clone`` or
+``git push`` over a stand-in for ``ssh`` that runs ``gitosis-serve``,
+so that the transfers themselves are included as well.
+"""
+
+import concurrent.futures
+import configparser
+import contextlib
+import math
+import optparse
+import os
+import random
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+
+from gitosis import app, hooks, init, layout, repository, run_hook, serve, ssh, util
+
+READ = "read"
+WRITE = "write"
+CREATE = "create"
+OPERATIONS = (READ, WRITE, CREATE)
+
+DEFAULT_MIX = {READ: 90, WRITE: 9, CREATE: 1}
+PERCENTILES = (50, 95, 99)
+
+COMMITTER = "Load Generator <load@example.com>"
+
+# not a usable key, but gitosis doesn't care
+FAKE_KEY = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIEZha2VGYWtlRmFrZUZha2VGYWtlRmFrZUZha2VGYWtl"
+
+
+class LoadError(Exception):
+    """Cannot generate load"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+class Request(t.NamedTuple):
+    user: str
+    command: str
+    operation: str
+
+
+class Result(t.NamedTuple):
+    operation: str
+    seconds: float
+    ok: bool
+
+
+class Fixture(t.NamedTuple):
+    path: str
+    config_path: str
+    seed: str
+    ssh: str
+
+
+def parse_mix(text: str) -> dict[str, int]:
+    """Parse a mix like ``read=90,write=9,create=1``."""
+    mix = {}
+    for item in text.split(","):
+        operation, _, weight = item.partition("=")
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise LoadError("unknown operation", operation)
+        try:
+            mix[operation] = int(weight)
+        except ValueError:
+            raise LoadError("bad weight", item) from None
+    if sum(mix.values()) <= 0:
+        raise LoadError("mix has no operations", text)
+    return mix
+
+
+def generate(mix: dict[str, int], count: int, users: int, repositories: int, rng: random.Random) -> list[Request]:
+    """Generate ``count`` requests, operations picked at random according to ``mix``."""
+    operations = list(mix)
+    weights = [mix[operation] for operation in operations]
+    created = 0
+    requests = []
+    for operation in rng.choices(operations, weights, k=count):
+        user = f"user{rng.randrange(users)}"
+        if operation == CREATE:
+            name = f"new-{created}"
+            created += 1
+        else:
+            name = f"repo{rng.randrange(repositories)}"
+        verb = "git-upload-pack" if operation == READ else "git-receive-pack"
+        requests.append(Request(user, f"{verb} '{name}.git'", operation))
+    return requests
+
+
+def read_trace(lines: t.Iterable[str]) -> list[Request]:
+    """Read a trace of ``USER COMMAND`` lines; blank lines and ``#`` comments are skipped."""
+    requests = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        user, _, command = line.partition(" ")
+        try:
+            verb, _ = serve.parse_command(command)
+        except serve.ServingError:
+            # replayed as is, as refusing them is part of the load too
+            verb = None
+        requests.append(Request(user, command, WRITE if verb in serve.COMMANDS_WRITE else READ))
+    return requests
+
+
+def get_name(request: Request) -> t.Optional[str]:
+    try:
+        _, path = serve.parse_command(request.command)
+    except serve.ServingError:
+        return None
+    return path.removesuffix(".git")
+
+
+def _format_config(path: str, requests: list[Request]) -> str:
+    names = sorted({name for name in map(get_name, requests) if name is not None})
+    users = sorted({request.user for request in requests})
+    return "\n".join(
+        [
+            "[gitosis]",
+            f"repositories = {os.path.join(path, 'repositories')}",
+            f"generate-files-in = {os.path.join(path, 'generated')}",
+            f"ssh-authorized-keys-path = {os.path.join(path, '.ssh', 'authorized_keys')}",
+            "",
+            "[group load]",
+            f"members = {' '.join(users)}",
+            f"writable = {' '.join(names)}",
+            "",
+        ],
+    )
+
+
+def _write_ssh(path: str, config_path: str) -> str:
+    # git runs this as "ssh USER COMMAND" with GIT_SSH_VARIANT=simple
+    script = os.path.join(path, "ssh")
+    serve_command = " ".join(map(shlex.quote, get_serve_command()))
+    util.write_file(
+        script,
+        f'#!/bin/sh\nSSH_ORIGINAL_COMMAND="$2" exec {serve_command} --config {shlex.quote(config_path)} "$1"\n',
+    )
+    os.chmod(script, 0o755)  # noqa: S103
+    return script
+
+
+def setup_fixture(path: str, requests: list[Request]) -> Fixture:
+    """Set up an installation at ``path`` able to serve ``requests``."""
+    users = sorted({request.user for request in requests if ssh.is_safe_username(request.user)})
+    admin = os.path.join(path, "repositories", "gitosis-admin.git")
+    os.makedirs(os.path.dirname(admin))
+    repository.init(admin, template=os.path.join(os.path.dirname(init.__file__), "templates", "admin"))
+    repository.fast_import(
+        git_dir=admin,
+        commit_msg="Load generator fixture",
+        committer=COMMITTER,
+        files=[
+            ("gitosis.conf", _format_config(path, requests)),
+            *[(f"keydir/{user}.pub", f"{FAKE_KEY} {user}\n") for user in users],
+        ],
+    )
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.read_string(_format_config(path, requests))
+    os.makedirs(os.path.join(path, ".ssh"), mode=0o700)
+    run_hook.post_update(cfg, admin)
+    config_path = os.path.join(admin, "gitosis.conf")
+
+    seed = os.path.join(path, "seed.git")
+    repository.init(seed)
+    repository.fast_import(
+        git_dir=seed,
+        commit_msg="Seed",
+        committer=COMMITTER,
+        files=[("README", "Pushed by gitosis-load.\n")],
+    )
+    # repositories that are only ever created by requests are left alone
+    created = {get_name(request) for request in requests if request.operation == CREATE}
+    existing = {get_name(request) for request in requests if request.operation != CREATE}
+    for name in sorted(existing - created - {None, "gitosis-admin"}):
+        git_dir = layout.get_path(cfg, name)
+        os.makedirs(os.path.dirname(git_dir), exist_ok=True)
+        repository.init(git_dir)
+        hooks.install(cfg, name, git_dir)
+        subprocess.run(  # noqa: S603
+            ["git", f"--git-dir={seed}", "push", "-q", git_dir, "HEAD:refs/heads/master"],  # noqa: S607
+            check=True,
+        )
+    return Fixture(path, config_path, seed, _write_ssh(path, config_path))
+
+
+def get_serve_command() -> list[str]:
+    path = shutil.which("gitosis-serve")
+    if path is not None:
+        return [path]
+    return [sys.executable, "-c", "from gitosis.serve import Main; Main.run()"]
+
+
+def _run(args: list[str], env: dict[str, str]) -> tuple[float, bool]:
+    start = time.perf_counter()
+    result = subprocess.run(  # noqa: S603
+        args,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=False,
+    )
+    return time.perf_counter() - start, result.returncode == 0
+
+
+def run_request(fixture: Fixture, request: Request, index: int, *, end_to_end: bool = False) -> Result:
+    env = dict(os.environ, HOME=fixture.path)
+    if not end_to_end:
+        env["SSH_ORIGINAL_COMMAND"] = request.command
+        env["GITOSIS_GIT"] = shutil.which("true") or "/bin/true"
+        seconds, ok = _run([*get_serve_command(), "--config", fixture.config_path, request.user], env)
+        return Result(request.operation, seconds, ok=ok)
+
+    env.pop("GITOSIS_GIT", None)
+    env["GIT_SSH_COMMAND"] = fixture.ssh
+    env["GIT_SSH_VARIANT"] = "simple"
+    name = get_name(request)
+    if name is None:
+        return Result(request.operation, 0.0, ok=False)
+    url = f"{request.user}:{name}.git"
+    if request.operation == READ:
+        clone = os.path.join(fixture.path, "clones", str(index))
+        try:
+            seconds, ok = _run(["git", "clone", "-q", "--bare", url, clone], env)
+        finally:
+            shutil.rmtree(clone, ignore_errors=True)
+    else:
+        seconds, ok = _run(
+            ["git", f"--git-dir={fixture.seed}", "push", "-q", url, f"HEAD:refs/heads/load/{index}"], env
+        )
+    return Result(request.operation, seconds, ok=ok)
+
+
+def run(
+    fixture: Fixture,
+    requests: list[Request],
+    *,
+    concurrency: int,
+    end_to_end: bool = False,
+) -> tuple[list[Result], float]:
+    """Run ``requests``, ``concurrency`` at a time; returns the results and the time taken."""
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max(1, concurrency)) as pool:
+        results = list(
+            pool.map(
+                lambda item: run_request(fixture, item[1], item[0], end_to_end=end_to_end),
+                enumerate(requests),
+            ),
+        )
+    return results, time.perf_counter() - start
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of the sorted ``values``."""
+    if not values:
+        return math.nan
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(results: list[Result], elapsed: float) -> dict[str, dict[str, float]]:
+    """Summarize ``results`` per operation, and for all of them as ``all``."""
+    groups: dict[str, list[Result]] = {operation: [] for operation in OPERATIONS}
+    for result in results:
+        groups[result.operation].append(result)
+    groups = {operation: group for operation, group in groups.items() if group}
+    groups["all"] = results
+    summary = {}
+    for operation, group in groups.items():
+        seconds = sorted(result.seconds for result in group)
+        summary[operation] = {
+            "requests": len(group),
+            "failed": sum(not result.ok for result in group),
+            "throughput": len(group) / elapsed if elapsed > 0 else math.nan,
+            **{f"p{p}": percentile(seconds, p) for p in PERCENTILES},
+            "max": seconds[-1] if seconds else math.nan,
+        }
+    return summary
+
+
+def format_summary(summary: dict[str, dict[str, float]]) -> str:
+    columns = ["requests", "failed", "req/s", *(f"p{p} ms" for p in PERCENTILES), "max ms"]
+    lines = [f"{'':8}" + "".join(f"{column:>10}" for column in columns)]
+    for operation, row in summary.items():
+        values = [
+            f"{row['requests']:>10}",
+            f"{row['failed']:>10}",
+            f"{row['throughput']:>10.1f}",
+            *(f"{row[f'p{p}'] * 1000:>10.1f}" for p in PERCENTILES),
+            f"{row['max'] * 1000:>10.1f}",
+        ]
+        lines.append(f"{operation:8}" + "".join(values))
+    return "\n".join(lines) + "\n"
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Run gitosis-serve under concurrent load against a throwaway installation")
+        parser.set_defaults(concurrency=8, requests=1000, users=10, repositories=20, seed=0)
+        parser.add_option("-c", "--concurrency", type="int", help="run N requests at once [%default]", metavar="N")
+        parser.add_option("-n", "--requests", type="int", help="generate N requests [%default]", metavar="N")
+        parser.add_option("--users", type="int", help="generate requests from N users [%default]", metavar="N")
+        parser.add_option("--repositories", type="int", help="generate requests for N repos [%default]", metavar="N")
+        parser.add_option("--mix", help="weights of generated operations [read=90,write=9,create=1]", metavar="MIX")
+        parser.add_option("--seed", type="int", help="seed for generating requests [%default]", metavar="N")
+        parser.add_option("--trace", help="replay the requests in FILE instead", metavar="FILE")
+        parser.add_option(
+            "--end-to-end",
+            action="store_true",
+            default=False,
+            help="run the git transfers too, rather than stopping at exec",
+        )
+        parser.add_option("--dir", help="set up the installation in DIR, and keep it", metavar="DIR")
+        return parser
+
+    def read_config(self, *a, **kw) -> None:  # noqa: ANN002, ANN003
+        # the installation under load has a configuration of its own
+        with contextlib.suppress(app.ConfigFileDoesNotExistError):
+            super().read_config(*a, **kw)
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        if args:
+            parser.error("Unexpected arguments.")
+        try:
+            if options.trace is not None:
+                with open(options.trace) as fp:
+                    requests = read_trace(fp)
+            else:
+                mix = DEFAULT_MIX if options.mix is None else parse_mix(options.mix)
+                rng = random.Random(options.seed)  # noqa: S311
+                requests = generate(mix, options.requests, options.users, options.repositories, rng)
+        except (OSError, LoadError) as e:
+            parser.error(str(e))
+        if options.dir is not None:
+            os.makedirs(options.dir)
+            path = os.path.abspath(options.dir)
+        else:
+            path = tempfile.mkdtemp(prefix="gitosis-load.")
+        try:
+            fixture = setup_fixture(path, requests)
+            results, elapsed = run(fixture, requests, concurrency=options.concurrency, end_to_end=options.end_to_end)
+        finally:
+            if options.dir is None:
+                shutil.rmtree(path, ignore_errors=True)
+        sys.stdout.write(format_summary(summarize(results, elapsed)))
+        sys.stdout.write(f"{len(results)} requests in {elapsed:.2f}s, {options.concurrency} at a time\n")
@@ -0,0 +1,231 @@
+"""Precomputed user by repository permission matrix.
+
+Answering "who can write to this repository?" or "what can this user
+read?" with :func:`gitosis.access.have_access` means walking the group
+memberships again for every question. :func:`build` does that once for
+every user, storing each user's access as an integer bitset over the
+repositories, and the transpose of that for each repository, so
+individual questions become a bit test.
+
+Any user that isn't named in a ``members`` line gets the same access,
+which is stored under the pseudo-user ``@all``.
+"""
+
+from collections import abc
+import configparser
+import json
+import struct
+import typing as t
+
+from gitosis import access, group, util
+
+ANYONE = "@all"
+
+# Modes as spelled in gitosis.conf, mapped to the table answering them.
+# Write access implies read access, as in gitosis-serve.
+WRITE = "write"
+READ = "read"
+MODES = {
+    "writable": WRITE,
+    "writeable": WRITE,
+    "readonly": READ,
+}
+
+MAGIC = b"GTPM"
+_VERSION = 1
+_HEADER = struct.Struct("!4sBII")
+
+
+class MatrixFormatError(Exception):
+    """Not a permission matrix file"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+def _bits(n: int) -> abc.Iterator[int]:
+    while n:
+        low = n & -n
+        yield low.bit_length() - 1
+        n ^= low
+
+
+def _normalize(path: str) -> str:
+    if path.endswith(".git"):
+        return path[: -len(".git")]
+    return path
+
+
+class PermissionMatrix:
+    def __init__(self, users: list[str], repos: list[str], rows: dict[str, list[int]]) -> None:
+        """Create a matrix from per-user rows.
+
+        :param users: user names, which must include :data:`ANYONE`
+
+        :param repos: repository names
+
+        :param rows: for each of :data:`WRITE` and :data:`READ`, a bitset
+            over ``repos`` for each user
+        """
+        self.users = users
+        self.repos = repos
+        self._user_index = {user: i for i, user in enumerate(users)}
+        self._repo_index = {repo: i for i, repo in enumerate(repos)}
+        self._rows = rows
+        self._columns: dict[str, list[int]] = {}
+        for mode, mode_rows in rows.items():
+            columns = [0] * len(repos)
+            for u, row in enumerate(mode_rows):
+                for r in _bits(row):
+                    columns[r] |= 1 << u
+            self._columns[mode] = columns
+
+    def _row(self, user: str, mode: str) -> int:
+        u = self._user_index.get(user)
+        if u is None:
+            u = self._user_index[ANYONE]
+        return self._rows[MODES[mode]][u]
+
+    def allowed(self, user: str, mode: str, path: str) -> bool:
+        """Check whether ``user`` may access ``path`` as ``mode``.
+
+        Unlike :func:`gitosis.access.have_access`, ``readonly`` is also
+        allowed for users with write access.
+        """
+        r = self._repo_index.get(_normalize(path))
+        if r is None:
+            return False
+        return bool(self._row(user, mode) >> r & 1)
+
+    def repos_for(self, user: str, mode: str) -> list[str]:
+        """Return the repositories ``user`` may access as ``mode``."""
+        return [self.repos[r] for r in _bits(self._row(user, mode))]
+
+    def users_with(self, mode: str, path: str) -> list[str]:
+        """Return the users who may access ``path`` as ``mode``.
+
+        :data:`ANYONE` is included if every user has access.
+        """
+        r = self._repo_index.get(_normalize(path))
+        if r is None:
+            return []
+        return [self.users[u] for u in _bits(self._columns[MODES[mode]][r])]
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "users": self.users,
+                "repos": self.repos,
+                "rows": {mode: [format(row, "x") for row in rows] for mode, rows in self._rows.items()},
+            }
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "PermissionMatrix":
+        parsed = json.loads(data)
+        rows = {mode: [int(row, 16) for row in mode_rows] for mode, mode_rows in parsed["rows"].items()}
+        return cls(parsed["users"], parsed["repos"], rows)
+
+    def write_binary(self, fp: t.BinaryIO) -> None:
+        """Write the matrix in a compact binary form.
+
+        The header is followed by the NUL separated user and repository
+        names, then one fixed-width little-endian bitset per user for
+        each of :data:`WRITE` and :data:`READ`.
+        """
+        fp.write(_HEADER.pack(MAGIC, _VERSION, len(self.users), len(self.repos)))
+        fp.write("\0".join(self.users + self.repos).encode("utf-8"))
+        fp.write(b"\0")
+        width = (len(self.repos) + 7) // 8
+        for mode in (WRITE, READ):
+            fp.writelines(row.to_bytes(width, "little") for row in self._rows[mode])
+
+    @classmethod
+    def read_binary(cls, fp: t.BinaryIO) -> "PermissionMatrix":
+        header = fp.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise MatrixFormatError("truncated header")
+        magic, version, nusers, nrepos = _HEADER.unpack(header)
+        if magic != MAGIC or version != _VERSION:
+            raise MatrixFormatError("bad magic or version")
+        data = fp.read()
+        names = data.split(b"\0", nusers + nrepos)
+        if len(names) != nusers + nrepos + 1:
+            raise MatrixFormatError("truncated names")
+        bitsets = names.pop()
+        names = [name.decode("utf-8") for name in names]
+        width = (nrepos + 7) // 8
+        if len(bitsets) != 2 * nusers * width:
+            raise MatrixFormatError("truncated bitsets")
+        rows = {}
+        for m, mode in enumerate((WRITE, READ)):
+            offset = m * nusers * width
+            rows[mode] = [
+                int.from_bytes(bitsets[offset + u * width : offset + (u + 1) * width], "little") for u in range(nusers)
+            ]
+        return cls(names[:nusers], names[nusers:], rows)
+
+
+def build(config: configparser.ConfigParser, users: abc.Iterable[str] = ()) -> PermissionMatrix:
+    """Compute the permission matrix for every user.
+
+    :param config: configuration to read groups and repositories from
+
+    :param users: users to include in addition to those named in
+        ``members`` lines
+    """
+    grants = access.get_grants(config)
+    closure = group.get_membership_closure(config, [*users, ANYONE])
+
+    repos = sorted({path for modes in grants.values() for paths in modes.values() for path in paths})
+    repo_index = {repo: i for i, repo in enumerate(repos)}
+
+    # per group, bitsets of the repositories it grants access to
+    group_bits = {}
+    for groupname, modes in grants.items():
+        write = 0
+        for mode, paths in modes.items():
+            if MODES[mode] == WRITE:
+                for path in paths:
+                    write |= 1 << repo_index[path]
+        read = write
+        for path in modes["readonly"]:
+            read |= 1 << repo_index[path]
+        group_bits[groupname] = (write, read)
+
+    user_list = sorted(closure)
+    by_groups: dict[tuple[str, ...], tuple[int, int]] = {}
+    rows: dict[str, list[int]] = {WRITE: [], READ: []}
+    for user in user_list:
+        groups = closure[user]
+        bits = by_groups.get(groups)
+        if bits is None:
+            write = read = 0
+            for groupname in groups:
+                group_write, group_read = group_bits.get(groupname, (0, 0))
+                write |= group_write
+                read |= group_read
+            bits = by_groups[groups] = (write, read)
+        rows[WRITE].append(bits[0])
+        rows[READ].append(bits[1])
+
+    return PermissionMatrix(user_list, repos, rows)
+
+
+def load(path: str) -> PermissionMatrix:
+    """Load a matrix from ``path``, in either format."""
+    with open(path, "rb") as fp:
+        if fp.read(len(MAGIC)) == MAGIC:
+            fp.seek(0)
+            return PermissionMatrix.read_binary(fp)
+        fp.seek(0)
+        return PermissionMatrix.from_json(fp.read().decode("utf-8"))
+
+
+def save(perms: PermissionMatrix, path: str, *, binary: bool = True) -> None:
+    """Atomically write ``perms`` to ``path``."""
+    if binary:
+        with util.safe_open_write(path, "wb") as fp:
+            perms.write_binary(fp)
+    else:
+        util.write_file(path, perms.to_json())
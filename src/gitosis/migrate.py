@@ -0,0 +1,130 @@
+"""Move repositories to where the configured layout keeps them.
+
+Moving is done online: each repository is renamed into place, with a
+symlink left at its old path so that anything that looked it up just
+before still finds it. After every batch, the symlink farm and the
+generated files are updated to point at the new paths, and the symlinks
+are removed.
+"""
+
+import configparser
+import logging
+import optparse
+import os
+import sys
+import time
+
+from gitosis import app, farm, generation, layout, util
+
+_log = logging.getLogger(__name__)
+
+
+def _remove_empty_parents(path: str, stop: str) -> None:
+    parent = os.path.dirname(path)
+    while parent != stop and parent.startswith(stop + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            return
+        parent = os.path.dirname(parent)
+
+
+def move(src: str, dst: str) -> None:
+    """Move a repository, leaving a symlink behind until :func:`cleanup`."""
+    os.makedirs(os.path.dirname(dst), mode=0o750, exist_ok=True)
+    os.rename(src, dst)
+    os.symlink(os.path.relpath(dst, os.path.dirname(src)), src)
+
+
+def cleanup(links: list[str], repositories: str) -> None:
+    """Remove the symlinks left behind by :func:`move`."""
+    for link in links:
+        if os.path.islink(link):
+            os.unlink(link)
+            _remove_empty_parents(link, repositories)
+
+
+def migrate(
+    config: configparser.ConfigParser,
+    *,
+    batch_size: int = 100,
+    pause: float = 0.0,
+    dry_run: bool = False,
+) -> int:
+    """Move repositories to where the configured layout keeps them, ``batch_size`` at a time.
+
+    Returns the number of repositories moved.
+    """
+    repositories = util.get_repository_dir(config)
+    wanted_layout = layout.get_layout(config)
+    moves = []
+    for name, path in layout.find_repositories(repositories):
+        if os.path.islink(path):
+            continue
+        wanted = os.path.join(repositories, layout.get_relpath(wanted_layout, name))
+        if os.path.normpath(path) != os.path.normpath(wanted):
+            moves.append((path, wanted))
+    moved = 0
+    for start in range(0, len(moves), max(batch_size, 1)):
+        if start and pause:
+            time.sleep(pause)
+        batch = moves[start : start + max(batch_size, 1)]
+        links = []
+        for src, dst in batch:
+            if os.path.lexists(dst):
+                _log.warning("Not moving %s: %s already exists", src, dst)
+                continue
+            _log.info("Moving %s to %s", src, dst)
+            if not dry_run:
+                move(src, dst)
+                links.append(src)
+            moved += 1
+        if links:
+            farm.update_farm(config)
+            generation.regenerate(config)
+            cleanup(links, repositories)
+    return moved
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Move repositories to the configured repository-layout")
+        parser.add_option(
+            "--batch-size",
+            type="int",
+            default=100,
+            metavar="N",
+            help="move N repositories between updates of the generated files",
+        )
+        parser.add_option(
+            "--pause",
+            type="float",
+            default=0.0,
+            metavar="SECONDS",
+            help="wait SECONDS between batches",
+        )
+        parser.add_option(
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="only show what would be moved",
+        )
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        os.umask(0o022)
+        try:
+            moved = migrate(cfg, batch_size=options.batch_size, pause=options.pause, dry_run=options.dry_run)
+        except layout.UnknownLayoutError as e:
+            _log.error("%s", e)
+            sys.exit(1)
+        _log.info("%s %d repositories", "Would move" if options.dry_run else "Moved", moved)
@@ -0,0 +1,493 @@
+"""Read objects from a git repository without running git.
+
+Only what gitosis needs to get files out of the admin repository is
+supported: refs (loose and packed), loose objects, and version 2 pack
+indexes with their packs, including both kinds of deltas. Packs are
+mapped into memory rather than read, so looking up a handful of objects
+in a large repository is cheap. Repositories using SHA-256 object names
+aren't supported.
+"""
+
+import errno
+import mmap
+import os
+import re
+import typing as t
+import zlib
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {OBJ_COMMIT: "commit", OBJ_TREE: "tree", OBJ_BLOB: "blob", OBJ_TAG: "tag"}
+_TYPES = {name: kind for kind, name in TYPE_NAMES.items()}
+
+MODE_TREE = "40000"
+MODE_SYMLINK = "120000"
+MODE_GITLINK = "160000"
+MODE_EXECUTABLE = "100755"
+
+_HEX_RE = re.compile(r"^[0-9a-f]{40}$")
+_IDX_MAGIC = b"\377tOc"
+_MAX_CHUNK = 1 << 16
+# how many symbolic refs to follow before giving up
+_MAX_SYMREFS = 5
+
+
+class ObjectError(Exception):
+    """Cannot read git object"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+class ObjectNotFoundError(ObjectError):
+    """No such git object"""
+
+
+class CorruptObjectError(ObjectError):
+    """Corrupt git object"""
+
+
+def _inflate(data: mmap.mmap, pos: int, size: int) -> bytes:
+    # fed in chunks, as decompressobj() would copy everything following
+    # the object in the pack into unused_data
+    d = zlib.decompressobj()
+    out = []
+    chunk_size = min(size + 64, _MAX_CHUNK)
+    while not d.eof:
+        chunk = data[pos : pos + chunk_size]
+        if not chunk:
+            break
+        out.append(d.decompress(chunk))
+        pos += chunk_size
+        chunk_size = _MAX_CHUNK
+    result = b"".join(out)
+    if not d.eof or len(result) != size:
+        msg = "truncated object data"
+        raise CorruptObjectError(msg)
+    return result
+
+
+def _delta_size(delta: bytes, pos: int) -> tuple[int, int]:
+    size = shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        size |= (c & 0x7F) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Apply a pack ``delta`` to ``base``."""
+    src_size, pos = _delta_size(delta, 0)
+    dst_size, pos = _delta_size(delta, pos)
+    if src_size != len(base):
+        msg = "delta base size mismatch"
+        raise CorruptObjectError(msg)
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # copy from the base
+            offset = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[offset : offset + (size or 0x10000)]
+        elif op:
+            # insert literal data
+            out += delta[pos : pos + op]
+            pos += op
+        else:
+            msg = "invalid delta opcode"
+            raise CorruptObjectError(msg)
+    if len(out) != dst_size:
+        msg = "delta result size mismatch"
+        raise CorruptObjectError(msg)
+    return bytes(out)
+
+
+def _map(path: str) -> mmap.mmap:
+    with open(path, "rb") as fp:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Pack:
+    """A pack and its index, mapped into memory."""
+
+    def __init__(self, idx_path: str) -> None:
+        self.idx_path = idx_path
+        self.idx = _map(idx_path)
+        if self.idx[:8] != _IDX_MAGIC + b"\0\0\0\2":
+            self.idx.close()
+            msg = "unsupported pack index version"
+            raise ObjectError(msg, idx_path)
+        try:
+            self.pack = _map(f"{idx_path.removesuffix('.idx')}.pack")
+        except BaseException:
+            self.idx.close()
+            raise
+        self.count = int.from_bytes(self.idx[8 + 255 * 4 : 8 + 256 * 4], "big")
+        self._names = 8 + 256 * 4
+        self._offsets = self._names + self.count * 24
+        self._large_offsets = self._offsets + self.count * 4
+
+    def close(self) -> None:
+        self.idx.close()
+        self.pack.close()
+
+    def find(self, binsha: bytes) -> t.Optional[int]:
+        """Return the offset of object ``binsha`` in the pack, if it's there."""
+        first = binsha[0]
+        lo = 0 if first == 0 else int.from_bytes(self.idx[8 + (first - 1) * 4 : 8 + first * 4], "big")
+        hi = int.from_bytes(self.idx[8 + first * 4 : 12 + first * 4], "big")
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = self.idx[self._names + mid * 20 : self._names + mid * 20 + 20]
+            if name < binsha:
+                lo = mid + 1
+            elif name > binsha:
+                hi = mid
+            else:
+                return self._offset(mid)
+        return None
+
+    def _offset(self, index: int) -> int:
+        pos = self._offsets + index * 4
+        offset = int.from_bytes(self.idx[pos : pos + 4], "big")
+        if offset & 0x80000000:
+            pos = self._large_offsets + (offset & 0x7FFFFFFF) * 8
+            offset = int.from_bytes(self.idx[pos : pos + 8], "big")
+        return offset
+
+    def read_raw(self, offset: int) -> tuple[int, bytes, t.Union[int, bytes, None]]:
+        """Read the entry at ``offset``.
+
+        Returns ``(type, data, base)``, where ``base`` is the offset or
+        object name of the delta base for delta entries.
+        """
+        pack = self.pack
+        pos = offset
+        c = pack[pos]
+        pos += 1
+        kind = (c >> 4) & 7
+        size = c & 0x0F
+        shift = 4
+        while c & 0x80:
+            c = pack[pos]
+            pos += 1
+            size |= (c & 0x7F) << shift
+            shift += 7
+        base: t.Union[int, bytes, None] = None
+        if kind == OBJ_OFS_DELTA:
+            c = pack[pos]
+            pos += 1
+            distance = c & 0x7F
+            while c & 0x80:
+                c = pack[pos]
+                pos += 1
+                distance = ((distance + 1) << 7) | (c & 0x7F)
+            base = offset - distance
+        elif kind == OBJ_REF_DELTA:
+            base = pack[pos : pos + 20]
+            pos += 20
+        elif kind not in TYPE_NAMES:
+            msg = f"unknown pack entry type {kind} at {offset}"
+            raise CorruptObjectError(msg, self.idx_path)
+        return kind, _inflate(pack, pos, size), base
+
+
+def _read_alternates(objects: str) -> list[str]:
+    try:
+        with open(os.path.join(objects, "info", "alternates")) as fp:
+            lines = [line.strip() for line in fp]
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return []
+    return [os.path.normpath(os.path.join(objects, line)) for line in lines if line and not line.startswith("#")]
+
+
+class Repository:
+    """Read-only access to the objects and refs of the repository at ``git_dir``."""
+
+    def __init__(self, git_dir: str) -> None:
+        self.git_dir = git_dir
+        self._packs: dict[str, Pack] = {}
+        self._object_dirs: t.Optional[list[str]] = None
+
+    def close(self) -> None:
+        for pack in self._packs.values():
+            pack.close()
+        self._packs.clear()
+
+    def __enter__(self) -> "Repository":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    # refs
+
+    def _read_ref_file(self, name: str) -> t.Optional[str]:
+        try:
+            with open(os.path.join(self.git_dir, name)) as fp:
+                return fp.read().strip()
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EISDIR):
+                raise
+            return None
+
+    def _packed_refs(self) -> dict[str, str]:
+        refs = {}
+        try:
+            with open(os.path.join(self.git_dir, "packed-refs")) as fp:
+                for line in fp:
+                    if line.startswith(("#", "^")):
+                        continue
+                    object_id, _, name = line.rstrip("\n").partition(" ")
+                    refs[name] = object_id
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return refs
+
+    def _read_ref(self, name: str, depth: int = 0) -> t.Optional[str]:
+        value = self._read_ref_file(name)
+        if value is None:
+            value = self._packed_refs().get(name)
+            if value is None:
+                return None
+        if value.startswith("ref: "):
+            if depth >= _MAX_SYMREFS:
+                msg = "too many levels of symbolic refs"
+                raise ObjectError(msg, name)
+            return self._read_ref(value[5:], depth + 1)
+        if not _HEX_RE.match(value):
+            msg = "unsupported ref value"
+            raise ObjectError(msg, name, value)
+        return value
+
+    def resolve(self, name: str) -> t.Optional[str]:
+        """Return the object name ``name`` refers to.
+
+        ``name`` is an object name, or a ref name as ``git rev-parse``
+        would accept it. Returns None for unborn branches and refs that
+        don't exist.
+        """
+        if _HEX_RE.match(name):
+            return name
+        if ".." in name.split("/"):
+            return None
+        for candidate in [name, f"refs/{name}", f"refs/tags/{name}", f"refs/heads/{name}"]:
+            object_id = self._read_ref(candidate)
+            if object_id is not None:
+                return object_id
+        return None
+
+    # objects
+
+    def _get_object_dirs(self) -> list[str]:
+        if self._object_dirs is None:
+            dirs = [os.path.join(self.git_dir, "objects")]
+            for objects in dirs:
+                dirs.extend(alternate for alternate in _read_alternates(objects) if alternate not in dirs)
+            self._object_dirs = dirs
+        return self._object_dirs
+
+    def _scan_packs(self) -> None:
+        for objects in self._get_object_dirs():
+            pack_dir = os.path.join(objects, "pack")
+            try:
+                filenames = os.listdir(pack_dir)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            for filename in sorted(filenames):
+                path = os.path.join(pack_dir, filename)
+                if filename.endswith(".idx") and path not in self._packs:
+                    try:
+                        self._packs[path] = Pack(path)
+                    except OSError as e:
+                        # removed by a concurrent repack
+                        if e.errno != errno.ENOENT:
+                            raise
+
+    def _find_packed(self, binsha: bytes) -> t.Optional[tuple[Pack, int]]:
+        for pack in self._packs.values():
+            offset = pack.find(binsha)
+            if offset is not None:
+                return pack, offset
+        return None
+
+    def _read_loose(self, object_id: str) -> t.Optional[tuple[int, bytes]]:
+        for objects in self._get_object_dirs():
+            try:
+                with open(os.path.join(objects, object_id[:2], object_id[2:]), "rb") as fp:
+                    raw = zlib.decompress(fp.read())
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            except zlib.error as e:
+                raise CorruptObjectError(object_id, str(e)) from e
+            header, _, data = raw.partition(b"\0")
+            type_name, _, size = header.decode("ascii").partition(" ")
+            if type_name not in _TYPES or int(size) != len(data):
+                raise CorruptObjectError(object_id, "bad header")
+            return _TYPES[type_name], data
+        return None
+
+    def _read_packed(self, pack: Pack, offset: int) -> tuple[int, bytes]:
+        # deltas are applied from the bottom of the chain up
+        chain = []
+        while True:
+            kind, data, base = pack.read_raw(offset)
+            if kind == OBJ_OFS_DELTA:
+                chain.append(data)
+                offset = t.cast("int", base)
+            elif kind == OBJ_REF_DELTA:
+                chain.append(data)
+                kind, data = self.read(t.cast("bytes", base).hex())
+                break
+            else:
+                break
+        for delta in reversed(chain):
+            data = apply_delta(data, delta)
+        return kind, data
+
+    def read(self, object_id: str) -> tuple[int, bytes]:
+        """Return the type and contents of object ``object_id``."""
+        binsha = bytes.fromhex(object_id)
+        found = self._find_packed(binsha)
+        if found is None:
+            loose = self._read_loose(object_id)
+            if loose is not None:
+                return loose
+            # packed since we last looked
+            self._scan_packs()
+            found = self._find_packed(binsha)
+            if found is None:
+                raise ObjectNotFoundError(object_id)
+        return self._read_packed(*found)
+
+    def read_typed(self, object_id: str, kind: int) -> bytes:
+        actual, data = self.read(object_id)
+        if actual != kind:
+            msg = f"expected {TYPE_NAMES[kind]}, got {TYPE_NAMES[actual]}"
+            raise ObjectError(msg, object_id)
+        return data
+
+    # trees
+
+    def peel_to_tree(self, object_id: str) -> str:
+        """Return the tree of the commit, tag or tree ``object_id``.
+
+        ``object_id`` may also be a ref name.
+        """
+        current = self.resolve(object_id)
+        if current is None:
+            raise ObjectNotFoundError(object_id)
+        for _ in range(_MAX_SYMREFS + 1):
+            kind, data = self.read(current)
+            if kind == OBJ_TREE:
+                return current
+            if kind == OBJ_BLOB:
+                break
+            # both commits and tags start with the object they refer to
+            header = data.split(b"\n", 1)[0].decode("ascii")
+            field, _, target = header.partition(" ")
+            if field not in ("tree", "object") or not _HEX_RE.match(target):
+                raise CorruptObjectError(current, "bad header")
+            current = target
+        msg = "not a tree-ish"
+        raise ObjectError(msg, object_id)
+
+    def read_tree(self, tree_id: str) -> list[tuple[str, str, str]]:
+        """Return the entries in tree ``tree_id`` as ``(mode, name, object_id)`` tuples."""
+        data = self.read_typed(tree_id, OBJ_TREE)
+        entries = []
+        pos = 0
+        while pos < len(data):
+            space = data.index(b" ", pos)
+            nul = data.index(b"\0", space)
+            mode = data[pos:space].decode("ascii")
+            name = os.fsdecode(data[space + 1 : nul])
+            entries.append((mode, name, data[nul + 1 : nul + 21].hex()))
+            pos = nul + 21
+        return entries
+
+    def lookup(self, treeish: str, path: str) -> t.Optional[tuple[str, str]]:
+        """Return the ``(mode, object_id)`` of ``path`` in ``treeish``, if it's there."""
+        mode, object_id = MODE_TREE, self.peel_to_tree(treeish)
+        for component in path.strip("/").split("/"):
+            if not component:
+                continue
+            if mode != MODE_TREE:
+                return None
+            for mode, name, entry_id in self.read_tree(object_id):  # noqa: B007
+                if name == component:
+                    object_id = entry_id
+                    break
+            else:
+                return None
+        return mode, object_id
+
+    def get_blob_ids(self, treeish: str, path: str) -> dict[str, str]:
+        """Return the object names of the files in directory ``path`` of ``treeish``, by filename."""
+        found = self.lookup(treeish, path)
+        if found is None or found[0] != MODE_TREE:
+            return {}
+        return {
+            name: object_id
+            for mode, name, object_id in self.read_tree(found[1])
+            if mode not in (MODE_TREE, MODE_GITLINK)
+        }
+
+    def read_file(self, treeish: str, path: str) -> t.Optional[bytes]:
+        """Return the contents of the file at ``path`` in ``treeish``, if it's there."""
+        found = self.lookup(treeish, path)
+        if found is None or found[0] in (MODE_TREE, MODE_GITLINK):
+            return None
+        return self.read_typed(found[1], OBJ_BLOB)
+
+    def export(self, treeish: str, path: str) -> None:
+        """Write the files in ``treeish`` to the directory ``path``.
+
+        Like ``git checkout-index -a``, files already there are
+        overwritten, and files that aren't in ``treeish`` are left.
+        """
+        os.makedirs(path, exist_ok=True)
+        for mode, name, object_id in self.read_tree(self.peel_to_tree(treeish)):
+            if name in ("", ".", "..", ".git") or "/" in name:
+                raise CorruptObjectError(object_id, f"unsafe path {name!r}")
+            dst = os.path.join(path, name)
+            if mode == MODE_TREE:
+                self.export(object_id, dst)
+                continue
+            if mode == MODE_GITLINK:
+                os.makedirs(dst, exist_ok=True)
+                continue
+            data = self.read_typed(object_id, OBJ_BLOB)
+            if os.path.lexists(dst) and not os.path.isdir(dst):
+                os.unlink(dst)
+            if mode == MODE_SYMLINK:
+                os.symlink(os.fsdecode(data), dst)
+                continue
+            with open(dst, "wb") as fp:
+                fp.write(data)
+            if mode == MODE_EXECUTABLE:
+                os.chmod(dst, 0o755)  # noqa: S103
@@ -0,0 +1,321 @@
+"""Share object storage between forks.
+
+``fork-of = PARENT`` in a ``[repo NAME]`` section makes ``NAME`` a fork
+of ``PARENT``. A repository, its forks, their forks and so on make up a
+network, and every network gets an object pool: a bare repository under
+``object-pools`` (``~/pools`` by default) that its members borrow
+objects from through ``objects/info/alternates``. When
+``gitosis-serve`` creates a fork, it starts out with its parent's
+branches and tags, but without copying any objects, and pushes to it
+only send what the pool doesn't already have.
+
+The pool fetches the refs of each member under ``refs/virtual/ID/``,
+and uses them as delta islands, so that objects of one member are never
+stored as deltas against objects only another member has, and serving a
+fork doesn't mean computing deltas all over again.
+
+Members only ever borrow objects from the pool, never from each other,
+so ``git gc`` in a parent can't lose anything its forks need, and
+members' own ``git gc`` drops their copies of objects the pool has. The
+pool has ``gc.auto = 0`` and ``gc.pruneExpire = never``, so it's only
+ever pruned by ``gitosis-pool``, which first fetches the refs of every
+member, and keeps unreachable objects for two more weeks in case a push
+still needs them.
+"""
+
+from collections import abc
+import configparser
+import contextlib
+import errno
+import fcntl
+import functools
+import json
+import logging
+import optparse
+import os
+import sys
+import typing as t
+
+from gitosis import app, layout, repository, util
+
+_log = logging.getLogger(__name__)
+
+MEMBERS = "gitosis-members.json"
+
+PRUNE_EXPIRE = "2.weeks.ago"
+
+_POOL_CONFIG = [
+    ("gc.auto", "0"),
+    ("gc.pruneExpire", "never"),
+    ("repack.useDeltaIslands", "true"),
+    ("repack.writeBitmaps", "true"),
+    ("pack.island", "refs/virtual/([0-9]+)/heads/"),
+    ("pack.island", "refs/virtual/([0-9]+)/tags/"),
+]
+
+
+class ForkCycleError(Exception):
+    """Repository is a fork of itself"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+class GitPoolError(repository.GitError):
+    """git failed on object pool"""
+
+
+def get_parent(config: configparser.ConfigParser, name: str) -> t.Optional[str]:
+    parent = util.get(config, f"repo {name}", "fork-of")
+    if not parent:
+        return None
+    return parent.strip().removesuffix(".git")
+
+
+def get_ancestors(config: configparser.ConfigParser, name: str) -> list[str]:
+    """Return the parent of repository ``name``, its parent, and so on."""
+    ancestors: list[str] = []
+    parent = get_parent(config, name)
+    while parent is not None:
+        if parent == name or parent in ancestors:
+            raise ForkCycleError(name)
+        ancestors.append(parent)
+        parent = get_parent(config, parent)
+    return ancestors
+
+
+def get_root(config: configparser.ConfigParser, name: str) -> str:
+    """Return the repository at the root of the network ``name`` is in."""
+    ancestors = get_ancestors(config, name)
+    return ancestors[-1] if ancestors else name
+
+
+def get_networks(config: configparser.ConfigParser) -> dict[str, list[str]]:
+    """Map the root of every network to its members, root first."""
+    networks: dict[str, set[str]] = {}
+    for section in config.sections():
+        if not section.startswith("repo "):
+            continue
+        name = section[len("repo ") :].strip()
+        if get_parent(config, name) is None:
+            continue
+        try:
+            ancestors = get_ancestors(config, name)
+        except ForkCycleError as e:
+            _log.warning("%s", e)
+            continue
+        networks.setdefault(ancestors[-1], set()).update([name, *ancestors])
+    return {root: [root, *sorted(members - {root})] for root, members in networks.items()}
+
+
+def get_pool_dir(config: configparser.ConfigParser) -> str:
+    path = util.get(config, "gitosis", "object-pools", default="pools")
+    return os.path.join(os.path.expanduser("~"), path)
+
+
+def get_pool_path(config: configparser.ConfigParser, root: str) -> str:
+    return layout.get_path(config, root, get_pool_dir(config))
+
+
+_git = functools.partial(repository.run_git, error=GitPoolError)
+
+
+@contextlib.contextmanager
+def _locked(pool: str) -> abc.Iterator[None]:
+    os.makedirs(os.path.dirname(pool), mode=0o750, exist_ok=True)
+    with open(f"{pool}.lock", "a") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _create_pool(pool: str, git: str) -> None:
+    repository.init(path=pool, _git=git)
+    _git(git, pool, "config", "core.bare", "true")
+    for key, value in _POOL_CONFIG:
+        _git(git, pool, "config", "--add", key, value)
+
+
+def _read_members(pool: str) -> dict[str, int]:
+    try:
+        with open(os.path.join(pool, MEMBERS)) as fp:
+            return json.load(fp)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return {}
+
+
+def _add_alternate(git_dir: str, pool: str) -> None:
+    path = os.path.join(git_dir, "objects", "info", "alternates")
+    objects = os.path.join(os.path.abspath(pool), "objects")
+    try:
+        alternates = util.read_file(path).splitlines()
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        alternates = []
+    if objects not in alternates:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        util.write_file(path, "".join(f"{line}\n" for line in [*alternates, objects]))
+
+
+def _write_members(pool: str, members: dict[str, int]) -> None:
+    util.write_file(os.path.join(pool, MEMBERS), json.dumps(members, sort_keys=True))
+
+
+def _add_member(pool: str, members: dict[str, int], name: str, git_dir: str, git: str) -> None:
+    member_id = members.get(name)
+    if member_id is None:
+        member_id = max(members.values(), default=0) + 1
+        members[name] = member_id
+        _write_members(pool, members)
+    _git(git, pool, "fetch", "--quiet", "--no-tags", "--prune", git_dir, f"+refs/*:refs/virtual/{member_id}/*")
+    _add_alternate(git_dir, pool)
+
+
+def _drop_member(pool: str, members: dict[str, int], name: str, git: str) -> None:
+    prefix = f"refs/virtual/{members.pop(name)}/"
+    refs = _git(git, pool, "for-each-ref", "--format=%(refname)", prefix).split()
+    if refs:
+        _git(git, pool, "update-ref", "--stdin", stdin="".join(f"delete {ref}\n" for ref in refs))
+    _write_members(pool, members)
+
+
+def join(config: configparser.ConfigParser, name: str, git_dir: str, *, git: str = "git") -> str:
+    """Make repository ``name`` at ``git_dir`` borrow objects from its network's pool.
+
+    The pool is created if need be, and fetches the refs of ``name``.
+    Returns the path to the pool.
+    """
+    root = get_root(config, name)
+    pool = get_pool_path(config, root)
+    with _locked(pool):
+        if not os.path.exists(pool):
+            _log.info("Creating object pool for %s", root)
+            _create_pool(pool, git)
+        members = _read_members(pool)
+        _add_member(pool, members, name, git_dir, git)
+        if name == root:
+            _git(git, pool, "config", "pack.islandCore", str(members[name]))
+    return pool
+
+
+def fork(config: configparser.ConfigParser, name: str, git_dir: str, *, git: str = "git") -> bool:
+    """Set up the newly created repository ``name`` at ``git_dir`` as a fork.
+
+    Its ancestors are added to the pool of their network, and it gets
+    its parent's branches and tags and ``HEAD``. Returns whether there
+    was a parent to fork.
+    """
+    parent = get_parent(config, name)
+    if parent is None:
+        return False
+    parent_dir = layout.get_path(config, parent)
+    if not os.path.isdir(parent_dir):
+        _log.warning("Not forking %s from %s, which doesn't exist", name, parent)
+        return False
+    for ancestor in reversed(get_ancestors(config, name)):
+        ancestor_dir = layout.get_path(config, ancestor)
+        if os.path.isdir(ancestor_dir):
+            join(config, ancestor, ancestor_dir, git=git)
+    join(config, name, git_dir, git=git)
+    # the pool has every object the parent has, so nothing is copied
+    _git(
+        git,
+        git_dir,
+        "fetch",
+        "--quiet",
+        "--no-tags",
+        "--update-head-ok",
+        parent_dir,
+        "+refs/heads/*:refs/heads/*",
+        "+refs/tags/*:refs/tags/*",
+    )
+    with contextlib.suppress(GitPoolError):
+        # a detached HEAD is left alone
+        head = _git(git, parent_dir, "symbolic-ref", "--quiet", "HEAD").strip()
+        _git(git, git_dir, "symbolic-ref", "HEAD", head)
+    return True
+
+
+def sync(config: configparser.ConfigParser, root: str, names: list[str], *, git: str = "git") -> str:
+    """Fetch the refs of every member of the network of ``root`` into its pool.
+
+    ``names`` are the members according to the configuration; members
+    that no longer exist are dropped, but members that still borrow
+    objects from the pool are kept, even if they're no longer forks.
+    Returns the path to the pool.
+    """
+    pool = get_pool_path(config, root)
+    with _locked(pool):
+        if not os.path.exists(pool):
+            _create_pool(pool, git)
+        members = _read_members(pool)
+        for name in sorted(set(names) | members.keys(), key=lambda name: (name != root, name)):
+            git_dir = layout.get_path(config, name)
+            if os.path.isdir(git_dir):
+                _add_member(pool, members, name, git_dir, git)
+            elif name in members:
+                _log.info("Dropping %s from the object pool of %s", name, root)
+                _drop_member(pool, members, name, git)
+        if root in members:
+            _git(git, pool, "config", "pack.islandCore", str(members[root]))
+    return pool
+
+
+def gc(config: configparser.ConfigParser, root: str, names: list[str], *, git: str = "git") -> None:
+    """Bring the pool of the network of ``root`` up to date and repack it.
+
+    Objects no member can reach any more are loosened, and only pruned
+    once they're older than :data:`PRUNE_EXPIRE`.
+    """
+    pool = sync(config, root, names, git=git)
+    with _locked(pool):
+        _git(git, pool, "repack", "-A", "-d", "-q", "--delta-islands")
+        _git(git, pool, "prune", f"--expire={PRUNE_EXPIRE}")
+
+
+def _maintain(config: configparser.ConfigParser, root: str, names: list[str], *, repack: bool, git: str) -> bool:
+    try:
+        if repack:
+            gc(config, root, names, git=git)
+        else:
+            sync(config, root, names, git=git)
+    except GitPoolError as e:
+        _log.error("%s", e)
+        return False
+    return True
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Update and repack the object pools of fork networks")
+        parser.add_option(
+            "--no-repack",
+            dest="repack",
+            action="store_false",
+            default=True,
+            help="only fetch the refs of every member into the pools",
+        )
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        git = util.find_git() or "git"
+        results = [
+            _maintain(cfg, root, names, repack=options.repack, git=git)
+            for root, names in sorted(get_networks(cfg).items())
+        ]
+        if not all(results):
+            sys.exit(1)
@@ -0,0 +1,285 @@
+"""Group membership from outside ``gitosis.conf``.
+
+With ``group-provider`` set in ``[gitosis]``, groups are also read from
+an external source, and their members are added to any ``members``
+given in ``gitosis.conf``. The source is one of:
+
+``json:PATH``
+    a JSON object mapping group names to lists of members
+
+``dbm:PATH``
+    a ``dbm`` database mapping group names to space-separated members
+
+``command:COMMAND``
+    a command that prints a JSON object like the one above
+
+Members can be ``@group``, as in ``gitosis.conf``.
+
+The source is never consulted while serving. Instead, its groups are
+kept in a snapshot, ``groups.json`` in the generated files directory,
+which is only read. Once the snapshot is older than
+``group-provider-ttl`` seconds (default 300), the next lookup runs
+``gitosis-groups --refresh`` in the background, and keeps using the old
+snapshot until the refresh replaces it. Failed refreshes are retried no more often than
+every ``group-provider-retry`` seconds (default 60), and until the first
+refresh succeeds, there are no external groups at all, so run
+``gitosis-groups --refresh`` when setting it up.
+"""
+
+import configparser
+import dbm
+import errno
+import fcntl
+import json
+import logging
+import optparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+import typing as t
+
+from gitosis import app, config, util
+
+_log = logging.getLogger(__name__)
+
+SNAPSHOT = "groups.json"
+SNAPSHOT_VERSION = 1
+
+DEFAULT_TTL = 300
+DEFAULT_RETRY = 60
+DEFAULT_TIMEOUT = 30
+
+Groups = dict[str, list[str]]
+
+# snapshots already read by this process, by path
+_snapshots: dict[str, tuple[tuple[int, int, int], dict[str, t.Any]]] = {}
+
+
+class ProviderError(Exception):
+    """Cannot read groups from provider"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+class Provider:
+    """A source of group memberships."""
+
+    def __init__(self, arg: str) -> None:
+        self.arg = arg
+
+    def fetch(self) -> Groups:
+        raise NotImplementedError
+
+
+def _validate(groups: t.Any) -> Groups:  # noqa: ANN401
+    if not isinstance(groups, dict):
+        raise ProviderError("not a JSON object")
+    for name, members in groups.items():
+        if not isinstance(members, list) or not all(isinstance(member, str) for member in members):
+            raise ProviderError(f"members of {name} aren't a list of strings")
+    return groups
+
+
+class JSONProvider(Provider):
+    def fetch(self) -> Groups:
+        try:
+            with open(os.path.expanduser(self.arg)) as fp:
+                return _validate(json.load(fp))
+        except (OSError, ValueError) as e:
+            raise ProviderError(self.arg, str(e)) from e
+
+
+class DBMProvider(Provider):
+    def fetch(self) -> Groups:
+        try:
+            with dbm.open(os.path.expanduser(self.arg), "r") as db:
+                return {key.decode("utf-8"): db[key].decode("utf-8").split() for key in db.keys()}  # noqa: SIM118
+        except (OSError, *dbm.error) as e:
+            raise ProviderError(self.arg, str(e)) from e
+
+
+class CommandProvider(Provider):
+    def fetch(self) -> Groups:
+        try:
+            result = subprocess.run(  # noqa: S603
+                shlex.split(self.arg),
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                timeout=DEFAULT_TIMEOUT,
+                check=False,
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise ProviderError(self.arg, str(e)) from e
+        if result.returncode != 0:
+            raise ProviderError(self.arg, result.stderr.strip() or f"exit status {result.returncode}")
+        try:
+            return _validate(json.loads(result.stdout))
+        except ValueError as e:
+            raise ProviderError(self.arg, str(e)) from e
+
+
+PROVIDERS: dict[str, type[Provider]] = {
+    "json": JSONProvider,
+    "dbm": DBMProvider,
+    "command": CommandProvider,
+}
+
+
+def get_provider(config: configparser.ConfigParser) -> t.Optional[Provider]:
+    spec = util.get(config, "gitosis", "group-provider")
+    if not spec:
+        return None
+    kind, _, arg = spec.partition(":")
+    cls = PROVIDERS.get(kind.strip())
+    if cls is None:
+        _log.warning("Ignoring unknown group provider: %s", spec)
+        return None
+    return cls(arg.strip())
+
+
+def get_snapshot_path(config: configparser.ConfigParser) -> str:
+    return os.path.join(util.get_generated_files_dir(config), SNAPSHOT)
+
+
+def _read_snapshot(path: str) -> t.Optional[dict[str, t.Any]]:
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    key = (st.st_ino, st.st_size, st.st_mtime_ns)
+    cached = _snapshots.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path) as fp:
+            snapshot = json.load(fp)
+    except (OSError, ValueError) as e:
+        _log.warning("Ignoring unreadable group snapshot %s: %s", path, e)
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    _snapshots[path] = (key, snapshot)
+    return snapshot
+
+
+def refresh(config: configparser.ConfigParser) -> bool:
+    """Replace the snapshot with the provider's current groups.
+
+    Returns whether it was replaced. Concurrent refreshes are skipped.
+    """
+    provider = get_provider(config)
+    if provider is None:
+        return False
+    path = get_snapshot_path(config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "a") as fp:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            _log.debug("Groups are already being refreshed")
+            return False
+        try:
+            groups = provider.fetch()
+        except ProviderError as e:
+            _log.warning("%s", e)
+            return False
+        snapshot = {"version": SNAPSHOT_VERSION, "fetched": time.time(), "groups": groups}
+        util.write_file(path, json.dumps(snapshot, sort_keys=True))
+    _log.debug("Refreshed %d groups", len(groups))
+    return True
+
+
+def _start_refresh(cfg: configparser.ConfigParser) -> None:
+    """Run ``gitosis-groups --refresh`` in the background."""
+    # nothing is left open on the caller's stdio, so that an ssh
+    # session waiting for its output doesn't wait for the refresh too
+    args = ["gitosis-groups", "--refresh"]
+    if isinstance(cfg, config.LazyConfigParser) and cfg.filenames:
+        args.append(f"--config={os.path.abspath(cfg.filenames[0])}")
+    try:
+        subprocess.Popen(  # noqa: S603
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            close_fds=True,
+            start_new_session=True,
+        )
+    except OSError as e:
+        _log.warning("Cannot refresh groups: %s", e)
+
+
+def _maybe_refresh(config: configparser.ConfigParser, snapshot: t.Optional[dict[str, t.Any]]) -> None:
+    ttl = util.get_int(config, "gitosis", "group-provider-ttl", default=DEFAULT_TTL)
+    now = time.time()
+    if snapshot is not None and now - snapshot["fetched"] < ttl:
+        return
+    lock = f"{get_snapshot_path(config)}.lock"
+    retry = util.get_int(config, "gitosis", "group-provider-retry", default=DEFAULT_RETRY)
+    try:
+        if now - os.stat(lock).st_mtime < retry:
+            return
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    try:
+        os.makedirs(os.path.dirname(lock), exist_ok=True)
+        with open(lock, "a"):
+            os.utime(lock)
+    except OSError as e:
+        _log.warning("Cannot refresh groups: %s", e)
+        return
+    _start_refresh(config)
+
+
+def get_groups(config: configparser.ConfigParser) -> Groups:
+    """Return the external groups, as last refreshed, refreshing them if they're stale."""
+    if get_provider(config) is None:
+        return {}
+    snapshot = _read_snapshot(get_snapshot_path(config))
+    _maybe_refresh(config, snapshot)
+    if snapshot is None:
+        return {}
+    return snapshot["groups"]
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Show or refresh the groups read from the group provider")
+        parser.add_option(
+            "--refresh",
+            action="store_true",
+            default=False,
+            help="read the groups from the provider now",
+        )
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        if get_provider(cfg) is None:
+            _log.error("No group-provider configured")
+            sys.exit(1)
+        if options.refresh and not refresh(cfg):
+            sys.exit(1)
+        snapshot = _read_snapshot(get_snapshot_path(cfg))
+        if snapshot is None:
+            _log.error("No groups have been read yet")
+            sys.exit(1)
+        for name, members in sorted(snapshot["groups"].items()):
+            sys.stdout.write(f"{name} = {' '.join(members)}\n")
@@ -0,0 +1,253 @@
+"""Render each repository's README for ``gitweb``.
+
+``gitweb`` shows ``README.html`` from a repository's directory on its
+summary page, but doesn't render anything itself. With
+``readme-html = yes`` in ``[gitosis]``, or in a ``[repo NAME]`` section,
+the README at the top of the repository's ``HEAD`` is rendered to
+``README.html`` whenever the repository is pushed to:
+``README.rst`` with ``docutils``, ``README.md`` or ``README.markdown``
+with ``markdown``, and anything else, or either of those when the
+package isn't installed, as plain text. Raw HTML in the README is never
+passed through, and what ``docutils`` and ``markdown`` produce is
+cleaned up with ``nh3``, leaving only links to ``http``, ``https`` and
+``mailto`` URLs and relative ones, as ``gitweb`` serves it from its own
+origin. Without ``nh3``, everything is shown as plain text. Install
+``gititis[readme]`` for all three.
+
+Which README was rendered, and how, is kept in ``gitosis-readme.json``
+in the repository, so that pushes that leave the README alone don't
+render it again. ``gitosis-readme`` renders every repository's README
+that needs it, using up to ``readme-workers`` processes (by default, one
+for each CPU).
+"""
+
+import concurrent.futures
+import configparser
+import errno
+import html
+import importlib.util
+import json
+import logging
+import optparse
+import os
+import sys
+import typing as t
+
+from gitosis import app, layout, objects, util
+
+_log = logging.getLogger(__name__)
+
+OUTPUT = "README.html"
+STAMP = "gitosis-readme.json"
+
+# bump when rendered output changes, to render everything again
+RENDER_VERSION = 2
+
+# in order of preference
+CANDIDATES = ["README.rst", "README.md", "README.markdown", "README.txt", "README"]
+
+
+class Job(t.NamedTuple):
+    git_dir: str
+    filename: str
+    blob_id: str
+    renderer: str
+
+
+# anything else, such as javascript: links, is dropped
+URL_SCHEMES = frozenset(["http", "https", "mailto"])
+
+
+def _clean(rendered: str) -> str:
+    import nh3  # noqa: PLC0415
+
+    return nh3.clean(rendered, url_schemes=set(URL_SCHEMES))
+
+
+def _render_plain(text: str) -> str:
+    return f"<pre>{html.escape(text)}</pre>\n"
+
+
+def _render_rst(text: str) -> str:
+    import docutils.core  # noqa: PLC0415
+
+    parts = docutils.core.publish_parts(
+        text,
+        writer_name="html",
+        settings_overrides={
+            "raw_enabled": False,
+            "file_insertion_enabled": False,
+            "report_level": 5,
+            "halt_level": 5,
+        },
+    )
+    return _clean(parts["html_body"])
+
+
+def _render_markdown(text: str) -> str:
+    import markdown  # noqa: PLC0415
+
+    md = markdown.Markdown()
+    # raw HTML is escaped rather than passed through
+    md.preprocessors.deregister("html_block")
+    md.inlinePatterns.deregister("html")
+    return _clean(md.convert(text)) + "\n"
+
+
+def _is_available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+RENDERERS: dict[str, t.Callable[[str], str]] = {
+    "plain": _render_plain,
+    "rst": _render_rst,
+    "markdown": _render_markdown,
+}
+
+_EXTENSIONS = {".rst": ("rst", "docutils"), ".md": ("markdown", "markdown"), ".markdown": ("markdown", "markdown")}
+
+
+def get_renderer(filename: str) -> str:
+    """Return the name of the renderer to use for ``filename``."""
+    found = _EXTENSIONS.get(os.path.splitext(filename)[1])
+    if found is None or not _is_available(found[1]) or not _is_available("nh3"):
+        return "plain"
+    return found[0]
+
+
+def is_enabled(config: configparser.ConfigParser, name: str) -> bool:
+    default = util.get_boolean(config, "gitosis", "readme-html", default=False)
+    return util.get_boolean(config, f"repo {name}", "readme-html", default=default)
+
+
+def find_readme(repo: objects.Repository) -> t.Optional[tuple[str, str]]:
+    """Return the filename and blob id of the README at the top of ``HEAD``, if any."""
+    if repo.resolve("HEAD") is None:
+        return None
+    files = repo.get_blob_ids("HEAD", "")
+    for filename in CANDIDATES:
+        if filename in files:
+            return filename, files[filename]
+    return None
+
+
+def _read_stamp(git_dir: str) -> t.Optional[dict[str, t.Any]]:
+    try:
+        with open(os.path.join(git_dir, STAMP)) as fp:
+            return json.load(fp)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    except ValueError:
+        pass
+    return None
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def check(git_dir: str, *, force: bool = False) -> t.Optional[Job]:
+    """Return what needs rendering for the repository at ``git_dir``, if anything.
+
+    A README that has gone away takes the ``README.html`` rendered from
+    it with it.
+    """
+    stamp = _read_stamp(git_dir)
+    with objects.Repository(git_dir) as repo:
+        found = find_readme(repo)
+    if found is None:
+        if stamp is not None:
+            _unlink(os.path.join(git_dir, OUTPUT))
+            _unlink(os.path.join(git_dir, STAMP))
+        return None
+    filename, blob_id = found
+    job = Job(git_dir, filename, blob_id, get_renderer(filename))
+    current = {"version": RENDER_VERSION, "filename": filename, "blob": blob_id, "renderer": job.renderer}
+    if not force and stamp == current and os.path.exists(os.path.join(git_dir, OUTPUT)):
+        return None
+    return job
+
+
+def render(job: Job) -> None:
+    """Render the README ``job`` is for."""
+    with objects.Repository(job.git_dir) as repo:
+        text = repo.read_typed(job.blob_id, objects.OBJ_BLOB).decode("utf-8", errors="replace")
+    try:
+        rendered = RENDERERS[job.renderer](text)
+    except Exception:
+        _log.exception("Cannot render %s in %s, showing it as plain text", job.filename, job.git_dir)
+        rendered = _render_plain(text)
+    util.write_file(os.path.join(job.git_dir, OUTPUT), rendered)
+    stamp = {"version": RENDER_VERSION, "filename": job.filename, "blob": job.blob_id, "renderer": job.renderer}
+    util.write_file(os.path.join(job.git_dir, STAMP), json.dumps(stamp, sort_keys=True))
+
+
+def update(git_dir: str, *, force: bool = False) -> bool:
+    """Render the README of the repository at ``git_dir`` if it changed; returns whether it was."""
+    job = check(git_dir, force=force)
+    if job is None:
+        return False
+    render(job)
+    return True
+
+
+def update_all(config: configparser.ConfigParser, *, force: bool = False) -> int:
+    """Render every README that needs it; returns how many were rendered.
+
+    Checking is cheap, so it's done here; only rendering is spread over
+    the worker processes.
+    """
+    jobs = []
+    for name, git_dir in layout.find_repositories(util.get_repository_dir(config)):
+        if os.path.islink(git_dir) or not is_enabled(config, name):
+            continue
+        try:
+            job = check(git_dir, force=force)
+        except objects.ObjectError as e:
+            _log.warning("Cannot read README of %s: %s", name, e)
+            continue
+        if job is not None:
+            jobs.append(job)
+    if not jobs:
+        return 0
+    workers = util.get_int(config, "gitosis", "readme-workers", default=os.cpu_count() or 1)
+    if workers <= 1 or len(jobs) == 1:
+        for job in jobs:
+            render(job)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+            for _ in pool.map(render, jobs, chunksize=8):
+                pass
+    return len(jobs)
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Render README.html for every repository that needs it")
+        parser.add_option(
+            "--force",
+            action="store_true",
+            default=False,
+            help="render every README, even if it hasn't changed",
+        )
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        if args:
+            parser.error("Unexpected arguments.")
+        count = update_all(cfg, force=options.force)
+        sys.stdout.write(f"Rendered {count} README{'' if count == 1 else 's'}\n")
@@ -0,0 +1,130 @@
+"""Restrict which refs a group may push to.
+
+Write access to a repository normally covers all of its refs. A group
+can narrow down what its own write access covers with glob patterns::
+
+    [group devs]
+    members = jdoe
+    writable = foo
+    refs writable = refs/heads/feature/* refs/heads/fix/*
+    refs deny = refs/tags/*
+
+A ref can be pushed to by way of a group if it matches one of the
+group's ``refs writable`` patterns (or the group has none), and none of
+its ``refs deny`` patterns. Groups add up: a push is accepted if every
+ref it updates can be pushed to by way of at least one of the groups
+giving the user write access to the repository. As with ``fnmatch``,
+``*`` matches ``/`` too.
+
+The rules are enforced by the ``refs`` hook plugin in ``pre-receive``,
+so a push is accepted or rejected as a whole. It's enabled for every
+repository as soon as any group has rules. The user is taken from
+``GITOSIS_USER``, as set by ``gitosis-serve``; pushes made without it,
+such as those made directly on the server, aren't restricted. The
+repository is matched against each group's repositories by path, as
+``gitosis-serve`` finds them, so a group's own ``repositories``
+directory is covered too; a push to a repository none of the user's
+groups can be matched to is rejected.
+"""
+
+from collections import abc
+import configparser
+import fnmatch
+import os
+import re
+import typing as t
+
+from gitosis import access, group, layout
+
+RULE_WRITABLE = "refs writable"
+RULE_DENY = "refs deny"
+
+WRITE_MODES = ("writable", "writeable")
+
+
+class UnknownRepositoryError(Exception):
+    """Cannot tell which repository is pushed to"""
+
+    def __str__(self) -> str:
+        return f"{self.__doc__}: {': '.join(self.args)}"
+
+
+def _compile(patterns: list[str]) -> t.Optional[t.Pattern[str]]:
+    # one alternation per rule, so each ref is matched once per rule,
+    # however many patterns there are
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns))
+
+
+class Rule:
+    """A group's ref rules, compiled."""
+
+    def __init__(self, writable: list[str], deny: list[str]) -> None:
+        self.writable = _compile(writable)
+        self.deny = _compile(deny)
+
+    def permits(self, ref: str) -> bool:
+        if self.deny is not None and self.deny.match(ref):
+            return False
+        return self.writable is None or self.writable.match(ref) is not None
+
+
+def _get_patterns(config: configparser.ConfigParser, section: str, option: str) -> list[str]:
+    try:
+        return config.get(section, option).split()
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        return []
+
+
+def has_rules(config: configparser.ConfigParser) -> bool:
+    """Check whether any group has ref rules."""
+    return any(
+        config.has_option(section, option)
+        for section in config.sections()
+        if section.startswith(group.GROUP_PREFIX)
+        for option in (RULE_WRITABLE, RULE_DENY)
+    )
+
+
+def _get_path(config: configparser.ConfigParser, groupname: str, mapping: str) -> str:
+    # as gitosis-serve finds it
+    topdir = os.path.join(os.path.expanduser("~"), access.get_prefix(config, groupname))
+    return os.path.realpath(layout.get_path(config, mapping.removesuffix(".git"), topdir))
+
+
+def get_rules(config: configparser.ConfigParser, user: str, git_dir: str) -> t.Optional[list[Rule]]:
+    """Compile the rules for ``user`` pushing to the repository at ``git_dir``.
+
+    Returns ``None`` if ``user`` can push to any ref, because one of the
+    groups giving them write access has no rules. Raises
+    :exc:`UnknownRepositoryError` if none of their groups gives them
+    write access to ``git_dir``, as the rules can't be told then.
+    """
+    path = os.path.realpath(git_dir)
+    grants = access.get_grants(config)
+    rules = []
+    for groupname in group.get_membership(config=config, user=user):
+        modes = grants.get(groupname)
+        if modes is None:
+            continue
+        mappings = {mapping for mode in WRITE_MODES for mapping in modes[mode].values()}
+        if not any(_get_path(config, groupname, mapping) == path for mapping in mappings):
+            continue
+        section = f"{group.GROUP_PREFIX}{groupname}"
+        writable = _get_patterns(config, section, RULE_WRITABLE)
+        deny = _get_patterns(config, section, RULE_DENY)
+        if not writable and not deny:
+            return None
+        rules.append(Rule(writable, deny))
+    if not rules:
+        raise UnknownRepositoryError(git_dir)
+    return rules
+
+
+def check(config: configparser.ConfigParser, user: str, git_dir: str, refs: abc.Iterable[str]) -> list[str]:
+    """Return those of ``refs`` that ``user`` may not push to in the repository at ``git_dir``."""
+    rules = get_rules(config, user, git_dir)
+    if rules is None:
+        return []
+    return [ref for ref in refs if not any(rule.permits(ref) for rule in rules)]
@@ -0,0 +1,431 @@
+"""Replicate pushes to read-only copies of repositories.
+
+``replicas`` in the ``[gitosis]`` section lists locations, either local
+directories or remote git URLs, under which every repository is copied
+at the same relative path. Setting ``replicas`` in a ``[repo NAME]``
+section overrides it for that repository; an empty value turns
+replication off.
+
+Repositories with replicas get a ``post-receive`` hook, which queues the
+refs that were updated and starts ``gitosis-replicate`` in the
+background. That pushes the queued updates to the replicas, running up
+to ``replicate-workers`` pushes in parallel, and combining everything
+queued for a repository into a single push to each replica. Failed
+pushes are retried ``replicate-retries`` times with exponential backoff
+starting at ``replicate-backoff`` seconds, and stay queued for the next
+run if they still fail. ``gitosis-replicate --status`` shows how far
+behind each replica is.
+
+If ``replica-reads`` is set, ``gitosis-serve`` spreads reads across the
+primary and those local replicas that have every queued update.
+"""
+
+from collections import abc
+import concurrent.futures
+import configparser
+import contextlib
+import errno
+import fcntl
+import json
+import logging
+import optparse
+import os
+import re
+import secrets
+import subprocess
+import sys
+import time
+import typing as t
+from urllib.parse import quote, unquote
+
+from gitosis import app, layout, repository, util
+
+_log = logging.getLogger(__name__)
+
+HOOK = "post-receive"
+
+_ENTRY_SUFFIX = ".refs"
+
+# "host:path", as opposed to a local path that happens to contain a colon
+_SCP_RE = re.compile(r"^[^/]+:")
+
+
+def is_local(location: str) -> bool:
+    """Check whether ``location`` is a local path rather than a URL."""
+    return "://" not in location and not _SCP_RE.match(location)
+
+
+def get_replicas(config: configparser.ConfigParser, name: str) -> list[str]:
+    """Return the locations of the replicas of repository ``name``."""
+    roots = util.get(config, f"repo {name}", "replicas")
+    if roots is None:
+        roots = util.get(config, "gitosis", "replicas", default="")
+    home = os.path.expanduser("~")
+    replicas = []
+    for root in roots.split():
+        if is_local(root):
+            replicas.append(os.path.join(home, root, f"{name}.git"))
+        else:
+            replicas.append(f"{root.rstrip('/')}/{name}.git")
+    return replicas
+
+
+def get_name(config: configparser.ConfigParser, git_dir: str) -> t.Optional[str]:
+    """Find the name of the repository at ``git_dir``.
+
+    Returns ``None`` if it's not in the repository directory.
+    """
+    return layout.get_name(config, git_dir)
+
+
+def get_spool_dir(config: configparser.ConfigParser) -> str:
+    return os.path.join(util.get_generated_files_dir(config), "replication")
+
+
+def _entry_time(entry: str) -> float:
+    return int(entry.split("-", 1)[0]) / 1e9
+
+
+class Spool:
+    """Queued ref updates, and how far each replica has got through them.
+
+    Each update is a file in ``queue/NAME``, named so that they sort in
+    the order they were queued. For each replica, ``state/NAME.json``
+    records the last update pushed to it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _queue_dir(self, name: str) -> str:
+        return os.path.join(self.path, "queue", quote(name, safe=""))
+
+    def _state_path(self, name: str) -> str:
+        return os.path.join(self.path, "state", f"{quote(name, safe='')}.json")
+
+    def enqueue(self, name: str, refs: abc.Iterable[str]) -> str:
+        """Queue updates of ``refs`` in repository ``name``."""
+        queue = self._queue_dir(name)
+        os.makedirs(queue, exist_ok=True)
+        entry = f"{time.time_ns():020d}-{secrets.token_hex(4)}"
+        util.write_file(os.path.join(queue, f"{entry}{_ENTRY_SUFFIX}"), "".join(f"{ref}\n" for ref in refs))
+        return entry
+
+    def names(self) -> list[str]:
+        """Return the names of repositories with queued updates."""
+        try:
+            return sorted(unquote(name) for name in os.listdir(os.path.join(self.path, "queue")))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+
+    def entries(self, name: str) -> list[str]:
+        """Return the updates queued for repository ``name``, oldest first."""
+        try:
+            filenames = os.listdir(self._queue_dir(name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+        return sorted(f[: -len(_ENTRY_SUFFIX)] for f in filenames if f.endswith(_ENTRY_SUFFIX))
+
+    def refs(self, name: str, entries: abc.Iterable[str]) -> list[str]:
+        """Return the refs updated by ``entries``, without duplicates."""
+        refs: dict[str, None] = {}
+        for entry in entries:
+            try:
+                contents = util.read_file(os.path.join(self._queue_dir(name), f"{entry}{_ENTRY_SUFFIX}"))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            refs.update(dict.fromkeys(contents.split()))
+        return list(refs)
+
+    def remove(self, name: str, entries: abc.Iterable[str]) -> None:
+        queue = self._queue_dir(name)
+        for entry in entries:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(queue, f"{entry}{_ENTRY_SUFFIX}"))
+        with contextlib.suppress(OSError):
+            # only succeeds once it's empty
+            os.rmdir(queue)
+
+    def read_state(self, name: str) -> dict[str, dict[str, t.Any]]:
+        try:
+            with open(self._state_path(name)) as fp:
+                return json.load(fp)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            _log.warning("Ignoring corrupt replication state for %s", name)
+        return {}
+
+    def write_state(self, name: str, state: dict[str, dict[str, t.Any]]) -> None:
+        os.makedirs(os.path.join(self.path, "state"), exist_ok=True)
+        util.write_file(self._state_path(name), json.dumps(state, sort_keys=True))
+
+    def lag(self, name: str, location: str, now: t.Optional[float] = None) -> float:
+        """Return how long the oldest update not yet pushed to ``location`` has waited."""
+        done = self.read_state(name).get(location, {}).get("done", "")
+        for entry in self.entries(name):
+            if entry > done:
+                return max(0.0, (now or time.time()) - _entry_time(entry))
+        return 0.0
+
+    @contextlib.contextmanager
+    def locked(self) -> abc.Iterator[bool]:
+        """Try to become the only process pushing updates.
+
+        Yields whether that succeeded.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "a") as fp:
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def queue_updates(config: configparser.ConfigParser, git_dir: str, refs: abc.Iterable[str]) -> bool:
+    """Queue the refs a ``post-receive`` hook was told were updated.
+
+    Returns whether anything was queued.
+    """
+    name = get_name(config, git_dir)
+    if name is None:
+        _log.warning("Not replicating repository outside the repository directory: %s", git_dir)
+        return False
+    if not get_replicas(config, name):
+        return False
+    refs = list(refs)
+    if not refs:
+        return False
+    Spool(get_spool_dir(config)).enqueue(name, refs)
+    return True
+
+
+def start_worker(config_path: str) -> None:
+    """Run ``gitosis-replicate`` in the background."""
+    subprocess.Popen(  # noqa: S603
+        ["gitosis-replicate", f"--config={config_path}"],  # noqa: S607
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=True,
+        start_new_session=True,
+    )
+
+
+def _refspecs(git: str, git_dir: str, refs: list[str]) -> list[str]:
+    result = subprocess.run(  # noqa: S603
+        [git, f"--git-dir={git_dir}", "for-each-ref", "--format=%(refname)", *refs],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    existing = set(result.stdout.split())
+    return [f"+{ref}:{ref}" if ref in existing else f":{ref}" for ref in refs]
+
+
+def push(
+    git_dir: str,
+    location: str,
+    refs: list[str],
+    *,
+    retries: int = 3,
+    backoff: float = 1.0,
+    git: str = "git",
+) -> t.Optional[str]:
+    """Push the current state of ``refs`` in ``git_dir`` to ``location``.
+
+    Refs that no longer exist are deleted from ``location``. Local
+    replicas are created if they don't exist yet. Returns ``None`` on
+    success, or the error from the last attempt.
+    """
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            if is_local(location) and not os.path.exists(location):
+                os.makedirs(os.path.dirname(location), exist_ok=True)
+                repository.init(path=location, _git=git)
+            result = subprocess.run(  # noqa: S603
+                [
+                    git,
+                    f"--git-dir={git_dir}",
+                    "push",
+                    "--porcelain",
+                    "--force",
+                    location,
+                    *_refspecs(git, git_dir, refs),
+                ],
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+        except (OSError, subprocess.CalledProcessError, repository.GitInitError) as e:
+            error = str(e)
+        else:
+            if result.returncode == 0:
+                return None
+            error = result.stderr.strip() or f"exit status {result.returncode}"
+        _log.warning("Push of %s to %s failed (attempt %d): %s", git_dir, location, attempt + 1, error)
+    return error
+
+
+def replicate(config: configparser.ConfigParser, git: str = "git") -> bool:
+    """Push queued updates to the replicas.
+
+    Returns whether every replica is now up to date.
+    """
+    spool = Spool(get_spool_dir(config))
+    workers = util.get_int(config, "gitosis", "replicate-workers", default=4)
+    retries = util.get_int(config, "gitosis", "replicate-retries", default=3)
+    backoff = util.get_float(config, "gitosis", "replicate-backoff", default=1.0)
+
+    jobs = []
+    entries = {}
+    for name in spool.names():
+        entries[name] = spool.entries(name)
+        state = spool.read_state(name)
+        for location in get_replicas(config, name):
+            done = state.get(location, {}).get("done", "")
+            todo = tuple(entry for entry in entries[name] if entry > done)
+            if todo:
+                jobs.append((name, location, todo))
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as pool:
+        futures = {
+            pool.submit(
+                push,
+                layout.get_path(config, name),
+                location,
+                spool.refs(name, todo),
+                retries=retries,
+                backoff=backoff,
+                git=git,
+            ): (name, location, todo)
+            for name, location, todo in jobs
+        }
+        results = {job: future.result() for future, job in futures.items()}
+
+    ok = True
+    for name, name_entries in entries.items():
+        state = spool.read_state(name)
+        replicas = get_replicas(config, name)
+        # forget replicas that were removed from the configuration
+        state = {location: state.get(location, {}) for location in replicas}
+        for (job_name, location, todo), error in results.items():
+            if job_name != name:
+                continue
+            replica = state[location]
+            if error is None:
+                replica.update(done=todo[-1], failures=0, last_success=time.time())
+                replica.pop("last_error", None)
+            else:
+                ok = False
+                replica.update(failures=replica.get("failures", 0) + 1, last_error=error)
+        spool.write_state(name, state)
+        # updates every replica has are no longer needed
+        if replicas:
+            done = min(replica.get("done", "") for replica in state.values())
+            spool.remove(name, [entry for entry in name_entries if entry <= done])
+        else:
+            spool.remove(name, name_entries)
+    return ok
+
+
+def _pending(spool: Spool) -> set[tuple[str, str]]:
+    return {(name, entry) for name in spool.names() for entry in spool.entries(name)}
+
+
+def run(config: configparser.ConfigParser, git: str = "git") -> bool:
+    """Push queued updates, unless another process is already doing so.
+
+    Updates queued while this runs are pushed too, even if another
+    process was turned away in the meantime.
+    """
+    spool = Spool(get_spool_dir(config))
+    ok = True
+    seen: set[tuple[str, str]] = set()
+    while True:
+        with spool.locked() as locked:
+            if not locked:
+                _log.debug("Replication already running")
+                return ok
+            seen |= _pending(spool)
+            ok = replicate(config, git=git)
+        # catch updates queued by processes turned away while we held the lock
+        if _pending(spool) <= seen:
+            return ok
+
+
+def choose_read_path(config: configparser.ConfigParser, fullpath: str) -> str:
+    """Pick where to serve a read of the repository at ``fullpath`` from.
+
+    If ``replica-reads`` is set, this is either ``fullpath`` or one of
+    its local replicas that has every queued update.
+    """
+    if not util.get_boolean(config, "gitosis", "replica-reads", default=False):
+        return fullpath
+    name = get_name(config, fullpath)
+    if name is None:
+        return fullpath
+    replicas = [location for location in get_replicas(config, name) if is_local(location)]
+    if not replicas:
+        return fullpath
+    spool = Spool(get_spool_dir(config))
+    latest = (spool.entries(name) or [""])[-1]
+    state = spool.read_state(name)
+    candidates = [fullpath]
+    candidates.extend(
+        location
+        for location in replicas
+        if location in state and state[location].get("done", "") >= latest and os.path.isdir(location)
+    )
+    return candidates[os.getpid() % len(candidates)]
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Push queued updates to replica repositories")
+        parser.add_option(
+            "--status",
+            action="store_true",
+            default=False,
+            help="show how far behind each replica is",
+        )
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        git = util.find_git() or "git"
+        if options.status:
+            spool = Spool(get_spool_dir(cfg))
+            now = time.time()
+            for name in spool.names():
+                state = spool.read_state(name)
+                for location in get_replicas(cfg, name):
+                    replica = state.get(location, {})
+                    lag = spool.lag(name, location, now)
+                    sys.stdout.write(f"{name} {location} lag={lag:.1f}s failures={replica.get('failures', 0)}\n")
+            return
+        if not run(cfg, git=git):
+            sys.exit(1)
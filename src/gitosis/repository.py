@@ -1,10 +1,17 @@
+from collections import abc
+import configparser
 import errno
+import logging
 import os
 import re
 import subprocess
 import sys
 import typing as t
 
+from gitosis import util
+
+_log = logging.getLogger(__name__)
+
 
 class GitError(Exception):
     """git failed"""
@@ -13,14 +20,51 @@ class GitError(Exception):
         return f"{self.__doc__}: {': '.join(self.args)}"
 
 
+def run_git(
+    git: str,
+    git_dir: str,
+    *args: str,
+    stdin: t.Optional[str] = None,
+    error: type[GitError] = GitError,
+) -> str:
+    """Run C{git} on C{git_dir} and return what it outputs.
+
+    Raises C{error} with whatever git had to say if it fails.
+    """
+    try:
+        result = subprocess.run(  # noqa: S603
+            [git, f"--git-dir={git_dir}", *args],
+            input=stdin,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+    except OSError as e:
+        raise error(git_dir, str(e)) from e
+    if result.returncode != 0:
+        raise error(git_dir, result.stderr.strip() or f"exit status {result.returncode}")
+    return result.stdout
+
+
 class GitInitError(Exception):
     """git init failed"""
 
 
+HOOK_SCRIPT = """\
+#!/bin/sh
+exec gitosis-run-hook {hook} "$@"
+"""
+
+# any hook script gitosis has written, including those from before
+# arguments were passed on
+_HOOK_SCRIPT_RE = re.compile(r'\A#!/bin/sh\nexec gitosis-run-hook [\w-]+(?: "\$@")?\n\Z')
+
+
 def init(
     path: str,
     template: t.Optional[str] = None,
     _git: str = "git",
+    hooks: abc.Iterable[str] = (),
 ) -> None:
     """Create a git repository at C{path} (if missing).
 
@@ -33,6 +77,10 @@ def init(
     @param template: Template directory, to pass to C{git init}.
 
     @type template: str
+
+    @param hooks: Hooks to install that run C{gitosis-run-hook}.
+
+    @type hooks: iterable of str
     """
     os.makedirs(path, mode=0o750, exist_ok=True)
     args = [
@@ -51,6 +99,62 @@ def init(
     )
     if returncode != 0:
         raise GitInitError(f"exit status {returncode}")
+    for hook in hooks:
+        install_hook(git_dir=path, hook=hook)
+
+
+def read_config(git_dir: str) -> t.Optional[configparser.ConfigParser]:
+    """Read the config file of the repository at ``git_dir`` without running git.
+
+    Section and option names are lowercased, as configparser does.
+    Returns ``None`` for a file configparser can't make sense of, in
+    which case ask ``git config`` instead.
+    """
+    # reading the file is much cheaper than running "git config" in
+    # every repository
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read(os.path.join(git_dir, "config"))
+    except configparser.Error:
+        return None
+    return parser
+
+
+def is_own_hook(path: str) -> bool:
+    """Check whether the hook script at C{path} is missing or was written by gitosis."""
+    try:
+        with open(path, "rb") as fp:
+            contents = fp.read()
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return True
+    return _HOOK_SCRIPT_RE.match(contents.decode("utf-8", errors="replace")) is not None
+
+
+def write_hook(path: str, hook: str) -> bool:
+    """Make the hook script at C{path} run C{gitosis-run-hook}, if it doesn't already.
+
+    A hook gitosis didn't write is left alone, with a warning.
+    Returns whether the hook runs C{gitosis-run-hook}.
+    """
+    if not is_own_hook(path):
+        _log.warning("Not replacing hook gitosis didn't write: %s", path)
+        return False
+    contents = HOOK_SCRIPT.format(hook=hook)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if util.write_file_if_changed(path, contents):
+        os.chmod(path, 0o755)  # noqa: S103
+    return True
+
+
+def install_hook(git_dir: str, hook: str) -> bool:
+    """Make C{hook} in C{git_dir} run C{gitosis-run-hook}, if it doesn't already.
+
+    Returns whether it does, which it doesn't if the repository has a
+    hook of its own.
+    """
+    return write_hook(os.path.join(git_dir, "hooks", hook), hook)
 
 
 class GitFastImportError(GitError):
@@ -8,45 +8,62 @@ import os
 import shutil
 import sys
 
-from gitosis import app, gitdaemon, gitweb, repository, ssh, util
+from gitosis import app, farm, fragments, generation, gitweb, hooks, layout, objects, ssh, transfer, util
 
 _log = logging.getLogger(__name__)
 
 
 def post_update(cfg: configparser.ConfigParser, git_dir: str) -> None:
-    export = os.path.join(git_dir, "gitosis-export")
+    # exports used to be made inside the admin repository
     try:
-        shutil.rmtree(export)
+        shutil.rmtree(os.path.join(git_dir, "gitosis-export"))
     except OSError as e:
-        if e.errno == errno.ENOENT:
-            pass
-        else:
+        if e.errno != errno.ENOENT:
             raise
-    repository.export(git_dir=git_dir, path=export)
-    os.rename(
-        os.path.join(export, "gitosis.conf"),
-        os.path.join(export, os.path.pardir, "gitosis.conf"),
-    )
-    # re-read config to get up-to-date settings
-    cfg.read(os.path.join(export, os.path.pardir, "gitosis.conf"))
-    gitweb.set_descriptions(config=cfg)
-    generated = util.get_generated_files_dir(config=cfg)
-    gitweb.generate_project_list(
-        config=cfg,
-        path=os.path.join(generated, "projects.list"),
-    )
-    gitdaemon.set_export_ok(config=cfg)
-    authorized_keys = util.get_ssh_authorized_keys_path(config=cfg)
-    ssh.write_authorized_keys(
-        path=authorized_keys,
-        keydir=os.path.join(export, "keydir"),
-    )
+    generated = os.path.abspath(util.get_generated_files_dir(config=cfg))
+    with generation.locked(generated), objects.Repository(git_dir) as admin:
+        commit = admin.resolve("HEAD")
+        if commit is None:
+            raise objects.ObjectNotFoundError("HEAD")
+        # pushes that don't move HEAD needn't export again
+        unchanged = generation.get_commit(generated) == commit
+        carry = [*generation.EXPORTED, *generation.INCREMENTAL] if unchanged else generation.INCREMENTAL
+        cache = generation.get_key_cache(cfg)
+        with generation.building(generated, carry=carry) as path:
+            if not unchanged:
+                admin.export(commit, path)
+                util.write_file(os.path.join(path, generation.COMMIT), f"{commit}\n")
+                fragment_cache = fragments.get_cache(cfg)
+                for conflict in fragments.combine(admin, commit, os.path.join(path, "gitosis.conf"), fragment_cache):
+                    _log.warning("%s", conflict)
+                fragment_cache.collect_garbage()
+            # re-read config to get up-to-date settings
+            cfg.read(os.path.join(path, "gitosis.conf"))
+            gitweb.set_descriptions(config=cfg)
+            farm.update_farm(config=cfg)
+            generation.generate(cfg, path, cache=cache, ids=admin.get_blob_ids(commit, "keydir"))
+        # ~/.gitosis.conf links to this, so it follows the current generation
+        util.replace_symlink(
+            os.path.join(generated, generation.CURRENT, "gitosis.conf"),
+            os.path.join(git_dir, "gitosis.conf"),
+        )
+        git = util.find_git() or "git"
+        hooks.install_all(config=cfg, git=git)
+        transfer.apply_all(config=cfg, git=git)
+        authorized_keys = util.get_ssh_authorized_keys_path(config=cfg)
+        ssh.write_authorized_keys(
+            path=authorized_keys,
+            keydir=os.path.join(generated, generation.CURRENT, "keydir"),
+            cache=cache,
+        )
+        keep = util.get_int(cfg, "gitosis", "keep-generations", default=generation.DEFAULT_KEEP)
+        generation.collect_garbage(generated, keep)
 
 
 class Main(app.App):
     def create_parser(self) -> optparse.OptionParser:
         parser = super().create_parser()
-        parser.set_usage("%prog [OPTS] HOOK")
+        parser.set_usage("%prog [OPTS] HOOK [ARGS...]")
         parser.set_description("Perform gitosis actions for a git hook")
         return parser
 
@@ -54,14 +71,12 @@ class Main(app.App):
         self,
         parser: optparse.OptionParser,
         cfg: configparser.ConfigParser,
-        options: optparse.Values,  # noqa: ARG002
+        options: optparse.Values,
         args: list[str],
     ) -> None:
-        hook = None
-        try:
-            (hook,) = args
-        except ValueError:
+        if not args:
             parser.error("Missing argument HOOK.")
+        hook, *hook_args = args
 
         os.umask(0o022)
 
@@ -70,9 +85,13 @@ class Main(app.App):
             _log.error("Must have GIT_DIR set in enviroment")
             sys.exit(1)
 
-        if hook == "post-update":
+        if hook == hooks.POST_UPDATE and layout.get_name(cfg, git_dir) == hooks.ADMIN:
             _log.info("Running hook %s", hook)
             post_update(cfg, git_dir)
             _log.info("Done.")
         else:
-            _log.warning("Ignoring unknown hook: %s", hook)
+            try:
+                hooks.dispatch(cfg, options.config, hook, git_dir, hook_args, sys.stdin)
+            except hooks.HookRejectedError as e:
+                _log.error("%s", e)
+                sys.exit(1)
@@ -4,13 +4,28 @@ prefix. Repository names are forced to match ALLOW_RE.
 """
 
 import configparser
+import fnmatch
 import logging
 import optparse
 import os
 import re
 import sys
 
-from gitosis import access, app, gitdaemon, gitweb, repository, util
+from gitosis import (
+    access,
+    app,
+    archive,
+    generation,
+    gitweb,
+    hooks,
+    layout,
+    pool,
+    replicate,
+    repository,
+    stats,
+    transfer,
+    util,
+)
 
 _log = logging.getLogger(__name__)
 
@@ -23,11 +38,19 @@ COMMANDS_READONLY = [
     "git upload-archive",
 ]
 
+COMMANDS_ARCHIVE = [
+    "git-upload-archive",
+    "git upload-archive",
+]
+
 COMMANDS_WRITE = [
     "git-receive-pack",
     "git receive-pack",
 ]
 
+# lists what the user has access to, optionally filtered by patterns
+COMMAND_INFO = "info"
+
 
 class ServingError(Exception):
     """Serving error"""
@@ -60,6 +83,10 @@ class ReadAccessDeniedError(AccessDeniedError):
     """Repository read access denied"""
 
 
+class QuotaExceededError(ServingError):
+    """Repository is over its quota"""
+
+
 def split_head(cmd: str) -> tuple[str, str]:
     try:
         head, tail = cmd.split(maxsplit=1)
@@ -69,11 +96,8 @@ def split_head(cmd: str) -> tuple[str, str]:
         return (head, tail)
 
 
-def serve(  # noqa: C901
-    cfg: configparser.ConfigParser,
-    user: str,
-    command: str,
-) -> str:
+def parse_command(command: str) -> tuple[str, str]:
+    """Split an SSH command into the verb and the repository path asked for."""
     if "\n" in command:
         raise CommandMayNotContainNewlineError
 
@@ -92,8 +116,90 @@ def serve(  # noqa: C901
     if match is None:
         raise UnsafeArgumentsError
 
-    path = match.group("path")
+    return verb, match.group("path")
+
+
+def serve(
+    cfg: configparser.ConfigParser,
+    user: str,
+    command: str,
+) -> str:
+    verb, path = parse_command(command)
+    fullpath = get_repository_path(cfg=cfg, user=user, verb=verb, path=path)
+
+    # put the verb back together with the new path
+    return f"{verb} '{fullpath}'"
+
+
+def get_grants(cfg: configparser.ConfigParser) -> access.Grants:
+    """Return the grants of every group, preferably as precomputed for the current generation."""
+    current = generation.get_current(util.get_generated_files_dir(config=cfg))
+    grants = None if current is None else access.read_grants(os.path.join(current, access.GRANTS))
+    if grants is None:
+        grants = access.get_grants(cfg)
+    return grants
+
+
+def info(cfg: configparser.ConfigParser, user: str, command: str) -> str:
+    """Answer an ``info [PATTERN...]`` command with the repositories ``user`` has access to.
+
+    Repositories are listed one per line, with ``R`` or ``R W`` for
+    their access, and their physical path if they're mapped, and only
+    those matching one of the glob patterns given, if any.
+    """
+    if "\n" in command:
+        raise CommandMayNotContainNewlineError
+    verb, *patterns = command.split()
+    if verb != COMMAND_INFO:
+        raise UnknownCommandError
+    lines = []
+    for grant in access.list_access(cfg, user, get_grants(cfg)):
+        if patterns and not any(fnmatch.fnmatchcase(grant.path, pattern) for pattern in patterns):
+            continue
+        mode = "R W" if grant.mode == "writable" else "R  "
+        mapped = f" -> {grant.mapping}" if grant.mapping != grant.path else ""
+        lines.append(f"{mode}  {grant.path}{mapped}\n")
+    return "".join(lines)
+
+
+def _create_repository(cfg: configparser.ConfigParser, topdir: str, fullpath: str) -> None:
+    # create leading directories
+    p = topdir
+    for segment in os.path.relpath(fullpath, topdir).split(os.sep)[:-1]:
+        p = os.path.join(p, segment)
+        os.makedirs(p, mode=0o750, exist_ok=True)
+
+    name = replicate.get_name(cfg, fullpath)
+    repository.init(path=fullpath)
+    git = util.find_git() or "git"
+    # ref rules apply under a group's own repositories directory too
+    hooks.install(cfg, name, fullpath, git=git)
+    if name is not None:
+        transfer.apply(cfg, name, fullpath, git=git)
+        try:
+            pool.fork(cfg, name, fullpath, git=git)
+        except (pool.ForkCycleError, pool.GitPoolError) as e:
+            _log.warning("Created %s without forking it: %s", name, e)
+    gitweb.set_descriptions(config=cfg)
+    generation.regenerate(config=cfg)
+
 
+def get_repository_path(
+    cfg: configparser.ConfigParser,
+    user: str,
+    verb: str,
+    path: str,
+) -> str:
+    """Find the repository ``user`` is asking for, if they may access it.
+
+    ``verb`` is one of :data:`COMMANDS_READONLY` or :data:`COMMANDS_WRITE`,
+    and ``path`` is the logical repository path the user asked for, which
+    must already have been checked against :data:`ALLOW_RE`. If the
+    configuration refers to a repository that doesn't exist yet, it's
+    created.
+
+    Returns the path to the physical repository.
+    """
     # write access is always sufficient
     newpath = access.have_access(config=cfg, user=user, mode="writable", path=path)
 
@@ -114,30 +220,22 @@ def serve(  # noqa: C901
             raise WriteAccessDeniedError
 
     (topdir, relpath) = newpath
-    repopath = f"{relpath}.git"
-    fullpath = os.path.join(topdir, repopath)
+    # relative to the home directory, not wherever we happen to be
+    topdir = os.path.join(os.path.expanduser("~"), topdir)
+    fullpath = layout.get_path(cfg, relpath, topdir)
     if not os.path.exists(fullpath):
         # it doesn't exist on the filesystem, but the configuration
         # refers to it, we're serving a write request, and the user is
         # authorized to do that: create the repository on the fly
+        _create_repository(cfg, topdir, fullpath)
+    elif verb in COMMANDS_READONLY:
+        fullpath = replicate.choose_read_path(cfg, fullpath)
+    elif verb in COMMANDS_WRITE:
+        name = replicate.get_name(cfg, fullpath)
+        if name is not None and stats.is_over_quota(cfg, name):
+            raise QuotaExceededError(name)
 
-        # create leading directories
-        p = topdir
-        for segment in repopath.split(os.sep)[:-1]:
-            p = os.path.join(p, segment)
-            os.makedirs(p, mode=0o750, exist_ok=True)
-
-        repository.init(path=fullpath)
-        gitweb.set_descriptions(config=cfg)
-        generated = util.get_generated_files_dir(config=cfg)
-        gitweb.generate_project_list(
-            config=cfg,
-            path=os.path.join(generated, "projects.list"),
-        )
-        gitdaemon.set_export_ok(config=cfg)
-
-    # put the verb back together with the new path
-    return f"{verb} '{fullpath}'"
+    return fullpath
 
 
 class Main(app.App):
@@ -171,24 +269,41 @@ class Main(app.App):
 
         os.chdir(os.path.expanduser("~"))
 
+        if cmd.split(None, 1)[:1] == [COMMAND_INFO]:
+            try:
+                sys.stdout.write(info(cfg, user, cmd))
+            except ServingError as e:
+                _log.error("%s", e)
+                sys.exit(1)
+            return
+
         try:
-            newcmd = serve(
-                cfg=cfg,
-                user=user,
-                command=cmd,
-            )
+            verb, path = parse_command(cmd)
+            fullpath = get_repository_path(cfg=cfg, user=user, verb=verb, path=path)
         except ServingError as e:
             _log.error("%s", e)
             sys.exit(1)
 
+        # put the verb back together with the new path
+        newcmd = f"{verb} '{fullpath}'"
         _log.debug("Serving %s", newcmd)
         os.environ["GITOSIS_USER"] = user
+        transfer.set_protocol(cfg, replicate.get_name(cfg, fullpath), os.environ)
         git_path = util.find_git()
         if git_path is None:
             _log.error("Cannot find git")
             sys.exit(1)
         _log.debug("Using %s as git", git_path)
 
+        if verb in COMMANDS_ARCHIVE:
+            cache = archive.get_cache(cfg, git=git_path)
+            if cache is not None:
+                try:
+                    sys.exit(archive.upload_archive(cache, fullpath, sys.stdin.buffer, sys.stdout.buffer))
+                except archive.ProtocolError as e:
+                    _log.error("%s", e)
+                    sys.exit(1)
+
         os.execvp(git_path, ["git", "shell", "-c", newcmd])  # noqa: S606
         _log.error("Cannot execute git-shell.")
         sys.exit(1)
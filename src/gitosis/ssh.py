@@ -1,11 +1,13 @@
 from collections import abc
 import errno
+import json
 import logging
 import os
 import re
-import secrets
 import typing as t
 
+from gitosis import util
+
 _log = logging.getLogger(__name__)
 
 _ACCEPTABLE_USER_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9_.-]*(@[a-zA-Z][a-zA-Z0-9.-]*)?$")
@@ -16,8 +18,7 @@ def is_safe_username(user: str) -> bool:
     return match is not None
 
 
-def read_keys(keydir: str) -> abc.Generator[tuple[str, str]]:
-    """Read SSH public keys from ``keydir/*.pub``"""
+def _key_files(keydir: str) -> abc.Iterator[tuple[str, str]]:
     for filename in os.listdir(keydir):
         if filename.startswith("."):
             continue
@@ -29,11 +30,135 @@ def read_keys(keydir: str) -> abc.Generator[tuple[str, str]]:
             _log.warning("Unsafe SSH username in keyfile: %s", filename)
             continue
 
-        path = os.path.join(keydir, filename)
-        with open(path) as f:
-            for line in f:
-                line = line.rstrip("\n")
-                yield (basename, line)
+        yield (basename, os.path.join(keydir, filename))
+
+
+def get_users(keydir: str) -> set[str]:
+    """Return the users with keys in ``keydir``."""
+    return {user for user, _ in _key_files(keydir)}
+
+
+def _read_key_file(path: str) -> list[str]:
+    with open(path) as f:
+        lines = (line.rstrip("\r\n") for line in f)
+        return [line for line in lines if line.strip() and not line.startswith("#")]
+
+
+def read_keys(keydir: str) -> abc.Generator[tuple[str, str]]:
+    """Read SSH public keys from ``keydir/*.pub``"""
+    for basename, path in _key_files(keydir):
+        for line in _read_key_file(path):
+            yield (basename, line)
+
+
+class KeyCache:
+    """Key files already read, so that only changed ones are read again.
+
+    A file is unchanged if its size, mtime and inode are, or if it has
+    the same ``id`` as before. Ids are supplied by the caller: blob ids
+    from the admin repository survive the keydir being checked out
+    afresh, which stat information does not.
+
+    The cache also remembers where the gitosis block starts in the
+    ``authorized_keys`` files it wrote, so that the lines before it can
+    be kept as they are if the file hasn't been touched since.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: dict[str, dict[str, t.Any]] = {}
+        self.splices: dict[str, list[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            _log.warning("Ignoring corrupt key cache: %s", path)
+        else:
+            if data.get("version") == self.VERSION:
+                self.entries = data["entries"]
+                self.splices = data["splices"]
+
+    def read_keys(self, keydir: str, ids: t.Optional[dict[str, str]] = None) -> list[tuple[str, str]]:
+        """Read SSH public keys from ``keydir/*.pub``, using the cache.
+
+        ``ids`` maps key filenames to ids for their current contents.
+        """
+        entries = {}
+        keys = []
+        for user, path in _key_files(keydir):
+            filename = os.path.basename(path)
+            st = os.stat(path)
+            stat = [st.st_size, st.st_mtime_ns, st.st_ino]
+            object_id = None if ids is None else ids.get(filename)
+            entry = self.entries.get(filename)
+            if entry is None:
+                hit = False
+            elif object_id is not None and entry["id"] is not None:
+                hit = entry["id"] == object_id
+            else:
+                hit = entry["stat"] == stat
+            if hit:
+                self.hits += 1
+                if entry["stat"] != stat or (object_id is not None and entry["id"] != object_id):
+                    entry = {**entry, "stat": stat, "id": object_id or entry["id"]}
+                    self.dirty = True
+            else:
+                self.misses += 1
+                entry = {"id": object_id, "stat": stat, "lines": _read_key_file(path)}
+                self.dirty = True
+            entries[filename] = entry
+            keys.extend((user, line) for line in entry["lines"])
+        if entries.keys() != self.entries.keys():
+            self.dirty = True
+        self.entries = entries
+        return keys
+
+    def get_unmanaged(self, path: str) -> t.Optional[str]:
+        """Return the lines before the gitosis block in ``path``.
+
+        Returns None unless ``path`` is exactly as this cache last wrote
+        it, in which case the lines must be filtered instead.
+        """
+        splice = self.splices.get(path)
+        if splice is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        *stat, offset = splice
+        if [st.st_size, st.st_mtime_ns, st.st_ino] != stat:
+            return None
+        with open(path) as fp:
+            unmanaged = fp.read(offset)
+            if fp.readline() != f"{COMMENT}\n":
+                return None
+        return unmanaged
+
+    def record(self, path: str, offset: int) -> None:
+        """Remember that the gitosis block in ``path`` starts ``offset`` characters in."""
+        st = os.stat(path)
+        self.splices[path] = [st.st_size, st.st_mtime_ns, st.st_ino, offset]
+        self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = {"version": self.VERSION, "entries": self.entries, "splices": self.splices}
+        with util.safe_open_write(self.path) as fp:
+            json.dump(data, fp, separators=(",", ":"))
+        self.dirty = False
 
 
 COMMENT = "### autogenerated by gitosis, DO NOT EDIT"
@@ -64,28 +189,31 @@ def filter_authorized_keys(fp: t.IO) -> abc.Iterator[str]:
         yield line
 
 
-def write_authorized_keys(path: str, keydir: str) -> None:
-    tmp = f"{path}.{secrets.token_hex(16)}.tmp"
+def _read_unmanaged(path: str) -> str:
     try:
-        in_ = open(path)  # noqa: SIM115
+        with open(path) as fp:
+            return "".join(f"{line}\n" for line in filter_authorized_keys(fp))
     except OSError as e:
-        if e.errno == errno.ENOENT:
-            in_ = None
-        else:
+        if e.errno != errno.ENOENT:
             raise
+        return ""
 
-    try:
-        with open(tmp, "w") as out:
-            if in_ is not None:
-                for line in filter_authorized_keys(in_):
-                    print(line, file=out)
-
-            keygen = read_keys(keydir)
-            for line in generate_authorized_keys(keygen):
-                print(line, file=out)
-
-            os.fsync(out)
-    finally:
-        if in_ is not None:
-            in_.close()
-    os.rename(tmp, path)
+
+def write_authorized_keys(path: str, keydir: str, cache: t.Optional[KeyCache] = None) -> None:
+    """Replace the gitosis block in ``path`` with the keys in ``keydir``.
+
+    With a ``cache``, unchanged key files aren't read again, and if
+    ``path`` hasn't changed since it was last written, the block is
+    spliced in without filtering the other lines.
+    """
+    unmanaged = None if cache is None else cache.get_unmanaged(path)
+    if unmanaged is None:
+        unmanaged = _read_unmanaged(path)
+    keys = read_keys(keydir) if cache is None else cache.read_keys(keydir)
+    with util.safe_open_write(path) as out:
+        out.write(unmanaged)
+        for line in generate_authorized_keys(keys):
+            print(line, file=out)
+    if cache is not None:
+        cache.record(path, len(unmanaged))
+        cache.save()
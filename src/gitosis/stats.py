@@ -0,0 +1,352 @@
+"""Keep statistics about repositories without rescanning them.
+
+With ``repository-stats = yes``, every repository gets a
+``post-receive`` hook that updates ``stats/NAME.json`` in the generated
+files directory: disk usage, loose object and pack counts, the number of
+refs, and the time of the last push. ``gitosis-stats --update`` does the
+same for every repository, for instance from ``cron``, and
+``gitosis-stats`` prints what's recorded.
+
+Updates are incremental. Git only ever creates, renames and deletes
+files in a repository, all of which change the modification time of the
+directory they're in, so a directory whose mtime is unchanged isn't
+listed again: its recorded totals are used as they are. Files that are
+appended to, like reflogs, are only noticed once something else in
+their directory changes, or with ``gitosis-stats --update --rescan``.
+
+A repository's ``quota`` (or the ``quota`` in ``[gitosis]``), such as
+``2G``, makes ``gitosis-serve`` refuse pushes to it while the recorded
+disk usage is over it.
+"""
+
+from collections import abc
+import configparser
+import datetime
+import errno
+import json
+import logging
+import optparse
+import os
+import re
+import sys
+import time
+import typing as t
+from urllib.parse import quote, unquote
+
+from gitosis import app, farm, replicate, util
+
+_log = logging.getLogger(__name__)
+
+VERSION = 1
+
+# git's own defaults for gc.auto and gc.autoPackLimit
+DEFAULT_LOOSE_LIMIT = 6700
+DEFAULT_PACK_LIMIT = 50
+
+FIELDS = ["size", "loose_objects", "loose_size", "packs", "pack_size", "refs", "last_push"]
+
+_LOOSE_DIR_RE = re.compile(r"^objects/[0-9a-f]{2}$")
+
+# directories modified this recently may change again without their
+# mtime changing, as timestamps are coarser than this; like git's racy
+# index entries, they're listed again next time
+_RACY_NS = 2 * 10**9
+
+
+def is_enabled(config: configparser.ConfigParser) -> bool:
+    return util.get_boolean(config, "gitosis", "repository-stats", default=False)
+
+
+def get_stats_dir(config: configparser.ConfigParser) -> str:
+    return os.path.join(util.get_generated_files_dir(config), "stats")
+
+
+def _list_dir(path: str) -> dict[str, t.Any]:
+    # totals for the files directly in the directory, and the names of
+    # its subdirectories, which are checked on their own
+    st = os.stat(path)
+    racy = time.time_ns() - st.st_mtime_ns < _RACY_NS
+    entry: dict[str, t.Any] = {
+        "mtime": None if racy else st.st_mtime_ns,
+        "files": 0,
+        "size": st.st_blocks * 512,
+        "packs": 0,
+        "pack_size": 0,
+        "subdirs": [],
+    }
+    with os.scandir(path) as it:
+        for dirent in it:
+            if dirent.is_dir(follow_symlinks=False):
+                entry["subdirs"].append(dirent.name)
+                continue
+            try:
+                size = dirent.stat(follow_symlinks=False).st_blocks * 512
+            except OSError as e:
+                # removed while we were looking
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            entry["files"] += 1
+            entry["size"] += size
+            if dirent.name.endswith(".pack"):
+                entry["packs"] += 1
+                entry["pack_size"] += size
+    return entry
+
+
+def _count_refs(git_dir: str) -> int:
+    names = set()
+    refs = os.path.join(git_dir, "refs")
+    for dirpath, _, filenames in os.walk(refs):
+        relpath = os.path.relpath(dirpath, git_dir)
+        names.update(f"{relpath}/{filename}" for filename in filenames if not filename.endswith(".lock"))
+    try:
+        with open(os.path.join(git_dir, "packed-refs")) as fp:
+            for line in fp:
+                if not line.startswith(("#", "^")):
+                    names.add(line.rstrip("\n").partition(" ")[2])
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    return len(names)
+
+
+def scan(git_dir: str, previous: t.Optional[dict[str, t.Any]] = None) -> dict[str, t.Any]:
+    """Collect statistics about the repository at ``git_dir``.
+
+    Directories that haven't changed since ``previous`` was recorded
+    aren't listed again.
+    """
+    old_dirs = {} if previous is None else previous.get("dirs", {})
+    dirs = {}
+    refs_changed = previous is None
+    pending = [""]
+    while pending:
+        relpath = pending.pop()
+        path = os.path.join(git_dir, relpath)
+        old = old_dirs.get(relpath)
+        try:
+            if old is not None and os.stat(path).st_mtime_ns == old["mtime"]:
+                entry = old
+            else:
+                entry = _list_dir(path)
+                # packed-refs is replaced by a rename, so it's covered by
+                # the top level directory changing
+                if relpath in ("", "refs") or relpath.startswith("refs/"):
+                    refs_changed = True
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            continue
+        dirs[relpath] = entry
+        pending.extend(os.path.join(relpath, subdir) if relpath else subdir for subdir in entry["subdirs"])
+    if old_dirs.keys() - dirs.keys():
+        refs_changed = True
+
+    loose = [entry for relpath, entry in dirs.items() if _LOOSE_DIR_RE.match(relpath)]
+    return {
+        "version": VERSION,
+        "size": sum(entry["size"] for entry in dirs.values()),
+        "loose_objects": sum(entry["files"] for entry in loose),
+        "loose_size": sum(entry["size"] for entry in loose),
+        "packs": sum(entry["packs"] for entry in dirs.values()),
+        "pack_size": sum(entry["pack_size"] for entry in dirs.values()),
+        "refs": _count_refs(git_dir) if refs_changed else t.cast("dict[str, t.Any]", previous)["refs"],
+        "last_push": None,
+        "updated": time.time(),
+        "dirs": dirs,
+    }
+
+
+class Index:
+    """Statistics for each repository, in ``NAME.json`` under ``path``."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _record_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{quote(name, safe='')}.json")
+
+    def names(self) -> list[str]:
+        try:
+            filenames = os.listdir(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+        return sorted(unquote(filename[: -len(".json")]) for filename in filenames if filename.endswith(".json"))
+
+    def read(self, name: str) -> t.Optional[dict[str, t.Any]]:
+        try:
+            with open(self._record_path(name)) as fp:
+                record = json.load(fp)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        except ValueError:
+            _log.warning("Ignoring corrupt statistics for %s", name)
+            return None
+        if record.get("version") != VERSION:
+            return None
+        return record
+
+    def update(self, name: str, git_dir: str, *, pushed: bool = False, rescan: bool = False) -> dict[str, t.Any]:
+        """Update the statistics for repository ``name`` at ``git_dir``."""
+        previous = self.read(name)
+        record = scan(git_dir, None if rescan else previous)
+        if pushed:
+            record["last_push"] = record["updated"]
+        elif previous is not None:
+            record["last_push"] = previous["last_push"]
+        os.makedirs(self.path, exist_ok=True)
+        util.write_file(self._record_path(name), json.dumps(record, separators=(",", ":")))
+        return record
+
+    def remove(self, name: str) -> None:
+        try:
+            os.unlink(self._record_path(name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def _get_repositories(config: configparser.ConfigParser) -> dict[str, str]:
+    repositories = {}
+    for target in set(farm.get_logical_names(config).values()):
+        name = replicate.get_name(config, target)
+        if name is not None and os.path.isdir(target):
+            repositories[name] = target
+    return repositories
+
+
+def record_push(config: configparser.ConfigParser, git_dir: str) -> None:
+    """Update the statistics of the repository at ``git_dir`` after a push."""
+    name = replicate.get_name(config, git_dir)
+    if name is None:
+        _log.warning("Not keeping statistics for repository outside the repository directory: %s", git_dir)
+        return
+    Index(get_stats_dir(config)).update(name, git_dir, pushed=True)
+
+
+def update_all(config: configparser.ConfigParser, *, rescan: bool = False) -> None:
+    """Update the statistics of every repository, and drop those of removed ones."""
+    index = Index(get_stats_dir(config))
+    repositories = _get_repositories(config)
+    for name, git_dir in sorted(repositories.items()):
+        index.update(name, git_dir, rescan=rescan)
+    for name in index.names():
+        if name not in repositories:
+            index.remove(name)
+
+
+def get_quota(config: configparser.ConfigParser, name: str) -> t.Optional[int]:
+    quota = util.get(config, f"repo {name}", "quota")
+    if quota is None:
+        quota = util.get(config, "gitosis", "quota")
+    if not quota:
+        return None
+    try:
+        return util.parse_size(quota)
+    except ValueError:
+        _log.warning("Ignoring bad quota for %s: %r", name, quota)
+        return None
+
+
+def is_over_quota(config: configparser.ConfigParser, name: str) -> bool:
+    """Check the recorded disk usage of repository ``name`` against its quota."""
+    quota = get_quota(config, name)
+    if quota is None:
+        return False
+    record = Index(get_stats_dir(config)).read(name)
+    return record is not None and record["size"] > quota
+
+
+def needs_gc(config: configparser.ConfigParser, record: dict[str, t.Any]) -> bool:
+    """Check whether a repository has enough loose objects or packs to need ``git gc``."""
+    loose_limit = util.get_int(config, "gitosis", "gc-loose-limit", default=DEFAULT_LOOSE_LIMIT)
+    pack_limit = util.get_int(config, "gitosis", "gc-pack-limit", default=DEFAULT_PACK_LIMIT)
+    return record["loose_objects"] > loose_limit or record["packs"] > pack_limit
+
+
+def format_record(name: str, record: dict[str, t.Any]) -> str:
+    fields = " ".join(f"{field}={record[field]}" for field in FIELDS if field != "last_push")
+    last_push = record["last_push"]
+    if last_push is None:
+        pushed = "never"
+    else:
+        pushed = datetime.datetime.fromtimestamp(last_push, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return f"{name} {fields} last_push={pushed}"
+
+
+def _sort_key(field: str) -> abc.Callable[[tuple[str, dict[str, t.Any]]], t.Any]:
+    if field == "name":
+        return lambda item: item[0]
+    # largest or most recent first
+    return lambda item: -(item[1][field] or 0)
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS] [REPOSITORY...]")
+        parser.set_description("Show or update repository statistics")
+        parser.add_option(
+            "--update",
+            action="store_true",
+            default=False,
+            help="update the statistics of every repository",
+        )
+        parser.add_option(
+            "--rescan",
+            action="store_true",
+            default=False,
+            help="with --update, list every directory again",
+        )
+        parser.add_option(
+            "--needs-gc",
+            action="store_true",
+            default=False,
+            help="only show repositories with too many loose objects or packs",
+        )
+        parser.add_option(
+            "--sort",
+            metavar="FIELD",
+            choices=["name", *FIELDS],
+            default="name",
+            help="sort by FIELD: name (the default), or one of " + ", ".join(FIELDS),
+        )
+        parser.add_option(
+            "--json",
+            action="store_true",
+            default=False,
+            help="print the statistics as JSON",
+        )
+        return parser
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,  # noqa: ARG002
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        if options.update:
+            update_all(cfg, rescan=options.rescan)
+        index = Index(get_stats_dir(cfg))
+        records = []
+        for name in args or index.names():
+            record = index.read(name)
+            if record is None:
+                _log.warning("No statistics for %s", name)
+                continue
+            if options.needs_gc and not needs_gc(cfg, record):
+                continue
+            records.append((name, record))
+        records.sort(key=_sort_key(options.sort))
+        if options.json:
+            json.dump({name: {field: record[field] for field in FIELDS} for name, record in records}, sys.stdout)
+            sys.stdout.write("\n")
+            return
+        for name, record in records:
+            sys.stdout.write(f"{format_record(name, record)}\n")
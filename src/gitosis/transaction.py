@@ -0,0 +1,256 @@
+"""Replace many files at once, paying for durability once.
+
+:func:`gitosis.util.safe_open_write` makes each file durable on its own,
+with an ``fsync`` per file, which adds up when a push to
+``gitosis-admin`` rewrites thousands of them, such as gitweb's
+``description`` files. A :class:`WriteTransaction` stages its files
+instead, and makes them durable together when it's committed:
+
+1. Each file is written to a temporary file next to it.
+2. The temporary files are flushed to disk, with one ``syncfs`` per
+   filesystem they're on when there are at least ``SYNCFS_THRESHOLD`` of
+   them and ``syncfs`` is available (Linux), or an ``fsync`` each
+   otherwise.
+3. They're renamed over the files they replace.
+4. Each directory renamed into is ``fsync``-ed once, so that the renames
+   themselves are on disk.
+
+What's guaranteed:
+
+- Each file is replaced atomically: readers see either its old contents
+  or its new ones, never a mix, nor an empty file, whenever the system
+  crashes.
+- Nothing is renamed before every new file's contents are on disk, and
+  if anything fails before then, no file is replaced at all.
+- Once :meth:`WriteTransaction.commit` returns, every file has its new
+  contents, and keeps them through a crash.
+
+What isn't: the files aren't replaced together. A crash (or an error)
+during the renames can leave some files replaced and others not, so
+callers must be able to cope with that, as when every file is derived
+from the configuration and written again on the next run. ``syncfs``
+also writes out whatever else is pending on the same filesystem, which
+can make it slower than an ``fsync`` per file on a busy one; it only
+reports write errors on Linux 5.8 and later.
+
+``gitosis-bench-writes`` compares the two ways of writing files.
+"""
+
+from collections import abc
+import configparser
+import contextlib
+import ctypes
+import ctypes.util
+import errno
+import optparse
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+import typing as t
+
+from gitosis import app, util
+
+# below this many files, fsyncing each is cheaper than syncing the
+# whole filesystem
+SYNCFS_THRESHOLD = 16
+
+PER_FILE = "per-file"
+BATCHED = "batched"
+MODES = (PER_FILE, BATCHED)
+
+
+def _find_syncfs() -> t.Optional[t.Callable[[int], int]]:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+    return getattr(libc, "syncfs", None)
+
+
+_syncfs = _find_syncfs()
+
+
+def syncfs(fd: int) -> None:
+    """Flush everything pending on the filesystem ``fd`` is on."""
+    if _syncfs is None:
+        raise OSError(errno.ENOSYS, "syncfs is not available")
+    if _syncfs(fd) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+
+def _fsync_path(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteTransaction:
+    """Files to be replaced, made durable together on :meth:`commit`.
+
+    Used as a context manager, the transaction is committed if the block
+    finishes, and aborted, leaving every file alone, if it raises.
+    """
+
+    def __init__(self) -> None:
+        # the temporary file for each path; staging a path again
+        # replaces what was staged for it
+        self._staged: dict[str, str] = {}
+
+    def __enter__(self) -> "WriteTransaction":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:  # noqa: ANN001
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def __len__(self) -> int:
+        return len(self._staged)
+
+    @contextlib.contextmanager
+    def open_write(self, path: str, mode: str = "w") -> abc.Iterator[t.IO]:
+        """Open a file whose contents are to replace ``path``, as with ``safe_open_write``."""
+        tmp = f"{path}.{secrets.token_hex(16)}.tmp"
+        try:
+            with open(tmp, mode) as fp:
+                yield fp
+        except BaseException:
+            self._unlink(tmp)
+            raise
+        previous = self._staged.pop(path, None)
+        if previous is not None:
+            self._unlink(previous)
+        self._staged[path] = tmp
+
+    def write_file(self, path: str, contents: str) -> None:
+        with self.open_write(path) as fp:
+            fp.write(contents)
+
+    def write_file_if_changed(self, path: str, contents: str) -> bool:
+        """Stage ``contents`` for ``path`` unless it already holds exactly that.
+
+        Returns whether the file was staged.
+        """
+        try:
+            with open(path) as f:
+                if f.read() == contents:
+                    return False
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.write_file(path, contents)
+        return True
+
+    def _flush(self) -> None:
+        if len(self._staged) >= SYNCFS_THRESHOLD and _syncfs is not None:
+            filesystems: dict[int, str] = {}
+            for tmp in self._staged.values():
+                filesystems.setdefault(os.stat(tmp).st_dev, tmp)
+            for tmp in filesystems.values():
+                fd = os.open(tmp, os.O_RDONLY)
+                try:
+                    syncfs(fd)
+                finally:
+                    os.close(fd)
+        else:
+            for tmp in self._staged.values():
+                _fsync_path(tmp)
+
+    def commit(self) -> None:
+        """Make every staged file durable, then replace the files with them."""
+        try:
+            self._flush()
+        except BaseException:
+            self.abort()
+            raise
+        staged, self._staged = self._staged, {}
+        directories = set()
+        try:
+            for path, tmp in staged.items():
+                os.rename(tmp, path)
+                directories.add(os.path.dirname(path) or os.curdir)
+        except BaseException:
+            for tmp in staged.values():
+                self._unlink(tmp)
+            raise
+        for directory in sorted(directories):
+            _fsync_path(directory)
+
+    def abort(self) -> None:
+        """Throw away every staged file."""
+        staged, self._staged = self._staged, {}
+        for tmp in staged.values():
+            self._unlink(tmp)
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def benchmark(path: str, files: int, size: int, mode: str) -> float:
+    """Replace ``files`` files of ``size`` bytes under ``path`` in ``mode``; returns the seconds taken."""
+    contents = "x" * size
+    paths = [os.path.join(path, f"{i % 100:02d}", f"{i}.txt") for i in range(files)]
+    for directory in {os.path.dirname(p) for p in paths}:
+        os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    if mode == PER_FILE:
+        for p in paths:
+            util.write_file(p, contents)
+    else:
+        with WriteTransaction() as transaction:
+            for p in paths:
+                transaction.write_file(p, contents)
+    return time.perf_counter() - start
+
+
+class Main(app.App):
+    def create_parser(self) -> optparse.OptionParser:
+        parser = super().create_parser()
+        parser.set_usage("%prog [OPTS]")
+        parser.set_description("Compare writing files durably one at a time and in a single transaction")
+        parser.set_defaults(files=1000, size=64, rounds=3)
+        parser.add_option("-n", "--files", type="int", help="write N files each round [%default]", metavar="N")
+        parser.add_option("--size", type="int", help="write N bytes to each file [%default]", metavar="N")
+        parser.add_option("--rounds", type="int", help="repeat N times, keeping the best [%default]", metavar="N")
+        parser.add_option("--dir", help="write files under DIR, which should be on the disk of interest", metavar="DIR")
+        return parser
+
+    def read_config(self, *a, **kw) -> None:  # noqa: ANN002, ANN003
+        # nothing here needs a configuration
+        with contextlib.suppress(app.ConfigFileDoesNotExistError):
+            super().read_config(*a, **kw)
+
+    def handle_args(
+        self,
+        parser: optparse.OptionParser,
+        cfg: configparser.ConfigParser,
+        options: optparse.Values,
+        args: list[str],
+    ) -> None:
+        super().handle_args(parser, cfg, options, args)
+        if args:
+            parser.error("Unexpected arguments.")
+        path = tempfile.mkdtemp(prefix="gitosis-bench-writes.", dir=options.dir)
+        try:
+            best = {
+                mode: min(benchmark(path, options.files, options.size, mode) for _ in range(options.rounds))
+                for mode in MODES
+            }
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+        for mode in MODES:
+            sys.stdout.write(f"{mode:10}{best[mode]:>10.3f}s{options.files / best[mode]:>12.1f} files/s\n")
+        flush = "syncfs" if _syncfs is not None and options.files >= SYNCFS_THRESHOLD else "fsync"
+        sys.stdout.write(f"batched is {best[PER_FILE] / best[BATCHED]:.1f}x as fast, using {flush}\n")
@@ -0,0 +1,144 @@
+"""Transfer policy: partial clones and protocol versions.
+
+``partial-clone = yes``, in ``[gitosis]`` or a ``[repo NAME]`` section,
+lets clients make partial clones, such as with
+``git clone --filter=blob:none``, by setting ``uploadpack.allowFilter``
+and ``uploadpack.allowReachableSHA1InWant`` in the repository, so that
+the objects left out can be fetched later on. Objects no ref leads to,
+such as those left behind by a forced push or borrowed from an object
+pool, stay out of reach, so ``uploadpack.allowAnySHA1InWant`` is unset
+either way. ``partial-clone = no`` sets them all to ``false``; leaving
+it out leaves the repository's own settings alone. Settings are applied
+to every repository on each push to ``gitosis-admin``, and to new
+repositories when they're created.
+
+Which protocol version is used is up to the client, which asks for one
+in ``GIT_PROTOCOL``: ``sshd`` has to pass it on (``AcceptEnv
+GIT_PROTOCOL``), and ``gitosis-serve`` then passes it on to git, as the
+HTTP frontend does with the ``Git-Protocol`` header. Only ``version``
+requests are passed on, and ``protocol-version = N`` caps the version
+used for a repository, for instance to keep clients on version 0 for a
+repository that misbehaves with version 2.
+"""
+
+import configparser
+import logging
+import os
+import re
+import subprocess
+import typing as t
+
+from gitosis import layout, repository, util
+
+_log = logging.getLogger(__name__)
+
+# git config settings for each value of partial-clone; None unsets a
+# setting. allowAnySHA1InWant is unset rather than turned off, as
+# turning it off turns allowReachableSHA1InWant off with it.
+PARTIAL_CLONE: dict[bool, dict[tuple[str, str], t.Optional[str]]] = {
+    True: {
+        ("uploadpack", "allowFilter"): "true",
+        ("uploadpack", "allowReachableSHA1InWant"): "true",
+        ("uploadpack", "allowAnySHA1InWant"): None,
+    },
+    False: {
+        ("uploadpack", "allowFilter"): "false",
+        ("uploadpack", "allowReachableSHA1InWant"): "false",
+        ("uploadpack", "allowAnySHA1InWant"): None,
+    },
+}
+
+_VERSION_RE = re.compile(r"^version=([0-9])$")
+
+
+def _get_option(config: configparser.ConfigParser, name: t.Optional[str], option: str) -> t.Optional[str]:
+    if name is not None:
+        value = util.get(config, f"repo {name}", option)
+        if value is not None:
+            return value
+    return util.get(config, "gitosis", option)
+
+
+def get_settings(config: configparser.ConfigParser, name: str) -> dict[tuple[str, str], t.Optional[str]]:
+    """Return the git config settings repository ``name`` should have, by section and key."""
+    value = _get_option(config, name, "partial-clone")
+    if value is None:
+        return {}
+    try:
+        enabled = configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        _log.warning("Ignoring bad value for partial-clone of %s: %s", name, value)
+        return {}
+    return PARTIAL_CLONE[enabled]
+
+
+def apply(config: configparser.ConfigParser, name: str, git_dir: str, *, git: str = "git") -> bool:
+    """Apply the settings for repository ``name`` at ``git_dir``; returns whether anything changed."""
+    settings = get_settings(config, name)
+    if not settings:
+        return False
+    current = repository.read_config(git_dir)
+    changed = False
+    for (section, key), value in settings.items():
+        if current is not None:
+            existing = current.get(section, key.lower(), fallback=None)
+            if (existing.lower() if existing is not None else None) == value:
+                continue
+        if value is None:
+            # exit status 5 means it wasn't set
+            args = [git, f"--git-dir={git_dir}", "config", "--unset-all", f"{section}.{key}"]
+            result = subprocess.run(args, check=False)  # noqa: S603
+            if result.returncode == 5:
+                continue
+            result.check_returncode()
+        else:
+            subprocess.run([git, f"--git-dir={git_dir}", "config", f"{section}.{key}", value], check=True)  # noqa: S603
+        changed = True
+    return changed
+
+
+def apply_all(config: configparser.ConfigParser, *, git: str = "git") -> None:
+    """Apply the settings for every repository, only running ``git config`` where they differ."""
+    for name, git_dir in layout.find_repositories(util.get_repository_dir(config)):
+        if not os.path.islink(git_dir):
+            apply(config, name, git_dir, git=git)
+
+
+def get_protocol(
+    config: configparser.ConfigParser, name: t.Optional[str], requested: t.Optional[str]
+) -> t.Optional[str]:
+    """Return what to pass on to git as ``GIT_PROTOCOL`` for repository ``name``.
+
+    ``requested`` is the client's ``GIT_PROTOCOL``, a colon-separated
+    list of parameters. Only the highest ``version`` asked for is kept,
+    capped by ``protocol-version``. Returns ``None`` for version 0, when
+    ``GIT_PROTOCOL`` is better left out altogether.
+    """
+    if not requested:
+        return None
+    versions = [int(match.group(1)) for match in map(_VERSION_RE.match, requested.split(":")) if match is not None]
+    if not versions:
+        return None
+    version = max(versions)
+    cap = _get_option(config, name, "protocol-version")
+    if cap is not None:
+        try:
+            version = min(version, int(cap))
+        except ValueError:
+            _log.warning("Ignoring bad value for protocol-version of %s: %s", name, cap)
+    if version <= 0:
+        return None
+    return f"version={version}"
+
+
+def set_protocol(
+    config: configparser.ConfigParser,
+    name: t.Optional[str],
+    environ: t.MutableMapping[str, str],
+) -> None:
+    """Replace ``GIT_PROTOCOL`` in ``environ`` with what :func:`get_protocol` makes of it."""
+    protocol = get_protocol(config, name, environ.get("GIT_PROTOCOL"))
+    if protocol is None:
+        environ.pop("GIT_PROTOCOL", None)
+    else:
+        environ["GIT_PROTOCOL"] = protocol
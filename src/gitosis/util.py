@@ -1,6 +1,7 @@
 from collections import abc
 import configparser
 import contextlib
+import errno
 import logging
 import os
 import secrets
@@ -11,10 +12,11 @@ _log = logging.getLogger(__name__)
 
 
 @contextlib.contextmanager
-def safe_open_write(path: str) -> abc.Iterator[t.IO]:
+def safe_open_write(path: str, mode: str = "w") -> abc.Iterator[t.IO]:
     tmp = f"{path}.{secrets.token_hex(16)}.tmp"
-    with open(tmp, "w") as fp:
+    with open(tmp, mode) as fp:
         yield fp
+        fp.flush()
         os.fsync(fp)
     os.rename(tmp, path)
 
@@ -24,6 +26,34 @@ def write_file(path: str, contents: str) -> None:
         fp.write(contents)
 
 
+def write_file_if_changed(path: str, contents: str) -> bool:
+    """Write ``contents`` to ``path`` unless it already holds exactly that.
+
+    Returns whether the file was written.
+    """
+    try:
+        with open(path) as f:
+            if f.read() == contents:
+                return False
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    write_file(path, contents)
+    return True
+
+
+def replace_symlink(target: str, path: str) -> None:
+    """Atomically make ``path`` a symlink to ``target``."""
+    dirname, basename = os.path.split(path)
+    tmp = os.path.join(dirname, f".{basename}.{secrets.token_hex(16)}.tmp")
+    os.symlink(target, tmp)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        os.unlink(tmp)
+        raise
+
+
 def read_file(path: str) -> str:
     with open(path) as f:
         return f.read()
@@ -43,11 +73,54 @@ def get_boolean(cfg: configparser.ConfigParser, section: str, key: str, *, defau
         return default
 
 
+def get_int(cfg: configparser.ConfigParser, section: str, key: str, *, default: int) -> int:
+    try:
+        return cfg.getint(section, key)
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        return default
+    except ValueError:
+        _log.warning("Ignoring bad value for %s in [%s]", key, section)
+        return default
+
+
+def get_float(cfg: configparser.ConfigParser, section: str, key: str, *, default: float) -> float:
+    try:
+        return cfg.getfloat(section, key)
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        return default
+    except ValueError:
+        _log.warning("Ignoring bad value for %s in [%s]", key, section)
+        return default
+
+
+_SIZE_SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(value: str) -> int:
+    """Parse a size such as ``512M`` into a number of bytes.
+
+    Raises ``ValueError`` if ``value`` isn't a whole number of bytes,
+    optionally followed by ``K``, ``M``, ``G`` or ``T``.
+    """
+    value = value.strip().upper()
+    multiplier = _SIZE_SUFFIXES.get(value[-1:], 1)
+    if value[-1:] in _SIZE_SUFFIXES:
+        value = value[:-1]
+    return int(value) * multiplier
+
+
 def get_repository_dir(config: configparser.ConfigParser) -> str:
     path = get(config, "gitosis", "repositories", default="repositories")
     return os.path.join(os.path.expanduser("~"), path)  # type: ignore
 
 
+def get_symlink_farm_dir(config: configparser.ConfigParser) -> t.Optional[str]:
+    path = get(config, "gitosis", "symlink-farm")
+    if not path:
+        return None
+    return os.path.join(os.path.expanduser("~"), path)
+
+
 def get_generated_files_dir(config: configparser.ConfigParser) -> str:
     return get(config, "gitosis", "generate-files-in", default=os.path.expanduser("~/gitosis"))  # type: ignore
 
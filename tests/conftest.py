@@ -0,0 +1,13 @@
+import configparser
+import os
+
+import pytest
+
+
+@pytest.fixture
+def cfg(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", os.path.join(tmpdir, "repositories"))
+    cfg.set("gitosis", "generate-files-in", os.path.join(tmpdir, "generated"))
+    return cfg
@@ -190,3 +190,35 @@ def test_dotgit():
         "repositories",
         "foo/bar",
     )
+
+
+def test_grants():
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "map writable foo", "elsewhere")
+    cfg.set("group fooers", "writable", "foo bar")
+    cfg.set("group fooers", "map readonly baz", "quux")
+    cfg.add_section("repo foo")
+    assert access.get_grants(cfg) == {
+        "fooers": {
+            "writable": {"foo": "foo", "bar": "bar"},
+            "writeable": {},
+            "readonly": {"baz": "quux"},
+        },
+    }
+
+
+def test_list_access():
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "members", "jdoe")
+    cfg.set("group fooers", "readonly", "foo bar")
+    cfg.add_section("group barers")
+    cfg.set("group barers", "members", "@fooers")
+    cfg.set("group barers", "map writable bar", "elsewhere")
+    assert access.list_access(cfg, "jdoe") == [
+        access.Grant("bar", "writable", "elsewhere"),
+        access.Grant("foo", "readonly", "foo"),
+    ]
+    assert access.list_access(cfg, "wsmith") == []
@@ -0,0 +1,248 @@
+import configparser
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from gitosis import archive, repository
+from gitosis.util import read_file
+
+from .util import git
+
+
+@pytest.fixture
+def git_dir(tmpdir):
+    path = os.path.join(tmpdir, "foo.git")
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg="initial",
+        committer="John Doe <jdoe@example.com>",
+        files=[("README", "hello\n"), ("src/main.c", "int main() { return 0; }\n")],
+    )
+    git(path, "tag", "v1.0", "master")
+    return path
+
+
+def _git_archive(git_dir, *args):
+    return git(git_dir, "archive", *args)
+
+
+def _request(*args):
+    return b"".join(archive._pkt(f"argument {arg}\n".encode()) for arg in args) + archive.FLUSH
+
+
+def _unpack(response):
+    fp = io.BytesIO(response)
+    assert archive._read_pkt(fp) == b"ACK\n"
+    assert archive._read_pkt(fp) is None
+    data = []
+    while True:
+        pkt = archive._read_pkt(fp)
+        if pkt is None:
+            break
+        assert pkt[0] == 1
+        data.append(pkt[1:])
+    assert fp.read() == b""
+    return b"".join(data)
+
+
+def test_from_arguments():
+    request = archive.Archive.from_arguments(["--format=tgz", "-9", "--prefix=foo/", "v1.0", "src"])
+    assert request is not None
+    assert request.arguments() == ["--format=tgz", "-9", "--prefix=foo/", "v1.0", "src"]
+    assert request.extension == "tar.gz"
+    request = archive.Archive.from_arguments(["master"])
+    assert request is not None
+    assert request.arguments() == ["--format=tar", "master"]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        [],
+        ["--format=tar.xz", "master"],
+        ["--worktree-attributes", "master"],
+        ["master", "--output=/tmp/evil"],
+        ["master:src"],
+    ],
+)
+def test_from_arguments_uncacheable(args):
+    assert archive.Archive.from_arguments(args) is None
+
+
+def test_resolve(git_dir):
+    commit = git(git_dir, "rev-parse", "master").decode().strip()
+    tree = git(git_dir, "rev-parse", "master^{tree}").decode().strip()
+    assert archive.resolve(git_dir, "v1.0") == (commit, tree)
+    assert archive.resolve(git_dir, "master") == (commit, tree)
+    assert archive.resolve(git_dir, commit) is None
+    assert archive.resolve(git_dir, commit, refs_only=False) == (commit, tree)
+    assert archive.resolve(git_dir, tree, refs_only=False) == ("", tree)
+    assert archive.resolve(git_dir, "nonexistent") is None
+    assert archive.resolve(git_dir, "--output=x") is None
+
+
+def test_cache_hit(tmpdir, git_dir):
+    cache = archive.ArchiveCache(os.path.join(tmpdir, "cache"))
+    request = archive.Archive("v1.0", "tgz", 9)
+    resolved = archive.resolve(git_dir, "v1.0")
+    with cache.open(git_dir, request, *resolved) as fp:
+        first = fp.read()
+    assert first == _git_archive(git_dir, "--format=tgz", "-9", "v1.0")
+    with cache.open(git_dir, archive.Archive("master", "tgz", 9), *archive.resolve(git_dir, "master")) as fp:
+        assert fp.read() == first
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["entries"] == 1
+    assert stats["size"] == len(first)
+
+
+def test_cache_key(tmpdir, git_dir):
+    cache = archive.ArchiveCache(os.path.join(tmpdir, "cache"))
+    resolved = archive.resolve(git_dir, "v1.0")
+    keys = {
+        cache.key(archive.Archive("v1.0", "tgz"), *resolved),
+        cache.key(archive.Archive("v1.0", "tgz", 9), *resolved),
+        cache.key(archive.Archive("v1.0", "zip"), *resolved),
+        cache.key(archive.Archive("v1.0", "tgz", prefix="foo/"), *resolved),
+        cache.key(archive.Archive("v1.0", "tgz", paths=["src"]), *resolved),
+        cache.key(archive.Archive("v1.0", "tgz"), "", resolved[1]),
+    }
+    assert len(keys) == 6
+    assert cache.key(archive.Archive("v1.0", "tgz"), *resolved) == cache.key(
+        archive.Archive("master", "tgz"), *resolved
+    )
+
+
+def test_cache_ref_moved(tmpdir, git_dir):
+    cache = archive.ArchiveCache(os.path.join(tmpdir, "cache"))
+    request = archive.Archive("master")
+    resolved = archive.resolve(git_dir, "master")
+    expected = _git_archive(git_dir, "--format=tar", resolved[0])
+    # a push between resolving the ref and building the archive
+    tree = git(git_dir, "mktree", stdin=b"").decode().strip()
+    commit = git(git_dir, "-c", "user.name=x", "-c", "user.email=x@example.com", "commit-tree", tree, "-m", "empty")
+    git(git_dir, "update-ref", "refs/heads/master", commit.decode().strip())
+    with cache.open(git_dir, request, *resolved) as fp:
+        assert fp.read() == expected
+    with cache.open(git_dir, request, *resolved) as fp:
+        assert fp.read() == expected
+
+
+def test_cache_failure(tmpdir, git_dir):
+    cache = archive.ArchiveCache(os.path.join(tmpdir, "cache"))
+    request = archive.Archive("v1.0", paths=["nonexistent"])
+    with pytest.raises(archive.ArchiveError, match="Cannot make archive"):
+        cache.open(git_dir, request, *archive.resolve(git_dir, "v1.0"))
+    assert os.listdir(os.path.join(tmpdir, "cache", "tmp")) == []
+
+
+def test_cache_evicts_least_recently_used(tmpdir, git_dir):
+    cache = archive.ArchiveCache(os.path.join(tmpdir, "cache"))
+    resolved = archive.resolve(git_dir, "v1.0")
+    size = len(_git_archive(git_dir, "v1.0"))
+    cache.max_size = 2 * size
+
+    def get(prefix):
+        with cache.open(git_dir, archive.Archive("v1.0", prefix=prefix), *resolved) as fp:
+            return fp.read()
+
+    get("a/")
+    get("b/")
+    # make "a/" the least recently used
+    for mtime, prefix in enumerate(["a/", "b/"]):
+        path = cache._entry(cache.key(archive.Archive("v1.0", prefix=prefix), *resolved), archive.Archive("v1.0"))
+        os.utime(path, (mtime, mtime))
+    get("b/")
+    get("c/")
+    assert cache.stats()["entries"] == 2
+    get("b/")
+    get("a/")
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 4
+
+
+def test_cache_too_large(tmpdir, git_dir):
+    cache = archive.ArchiveCache(os.path.join(tmpdir, "cache"), max_size=10)
+    with cache.open(git_dir, archive.Archive("v1.0"), *archive.resolve(git_dir, "v1.0")) as fp:
+        assert fp.read() == _git_archive(git_dir, "v1.0")
+    assert cache.stats()["entries"] == 0
+
+
+def test_get_cache(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    assert archive.get_cache(cfg) is None
+    cfg.set("gitosis", "archive-cache", os.path.join(tmpdir, "cache"))
+    cache = archive.get_cache(cfg)
+    assert cache.path == os.path.join(tmpdir, "cache")
+    assert cache.max_size == archive.DEFAULT_SIZE
+    cfg.set("gitosis", "archive-cache-size", "10M")
+    assert archive.get_cache(cfg).max_size == 10 << 20
+
+
+def test_upload_archive(tmpdir, git_dir):
+    cache = archive.ArchiveCache(os.path.join(tmpdir, "cache"))
+    for _ in range(2):
+        out = io.BytesIO()
+        status = archive.upload_archive(cache, git_dir, io.BytesIO(_request("--format=zip", "v1.0")), out)
+        assert status == 0
+        assert _unpack(out.getvalue()) == _git_archive(git_dir, "--format=zip", "v1.0")
+    stats = json.loads(read_file(os.path.join(tmpdir, "cache", archive.STATS)))
+    assert stats == {"hits": 1, "misses": 1}
+
+
+def test_upload_archive_bad_request(tmpdir, git_dir):
+    cache = archive.ArchiveCache(os.path.join(tmpdir, "cache"))
+    with pytest.raises(archive.ProtocolError, match="expected argument"):
+        archive.upload_archive(cache, git_dir, io.BytesIO(archive._pkt(b"evil\n")), io.BytesIO())
+    with pytest.raises(archive.ProtocolError, match="unexpected end of request"):
+        archive.upload_archive(cache, git_dir, io.BytesIO(archive._pkt(b"argument v1.0\n")), io.BytesIO())
+    with pytest.raises(archive.ProtocolError, match="not UTF-8"):
+        archive.upload_archive(cache, git_dir, io.BytesIO(archive._pkt(b"argument \xff\n")), io.BytesIO())
+
+
+SERVE_SCRIPT = """\
+import sys
+from gitosis import archive
+cache = archive.ArchiveCache(sys.argv[1])
+sys.exit(archive.upload_archive(cache, sys.argv[2], sys.stdin.buffer, sys.stdout.buffer))
+"""
+
+
+def _remote_archive(tmpdir, git_dir, *args):
+    # git runs the --exec command with the repository path appended
+    script = os.path.join(tmpdir, "serve.py")
+    with open(script, "w") as fp:
+        fp.write(SERVE_SCRIPT)
+    cache = os.path.join(tmpdir, "cache")
+    return subprocess.run(  # noqa: S603
+        ["git", "archive", f"--remote={git_dir}", f"--exec={sys.executable} {script} {cache}", *args],  # noqa: S607
+        capture_output=True,
+        cwd=str(tmpdir),
+        check=False,
+    )
+
+
+def test_remote_archive(tmpdir, git_dir):
+    result = _remote_archive(tmpdir, git_dir, "--format=tgz", "--prefix=foo-1.0/", "v1.0")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == _git_archive(git_dir, "--format=tgz", "--prefix=foo-1.0/", "v1.0")
+    assert os.path.exists(os.path.join(tmpdir, "cache", archive.STATS))
+
+
+def test_remote_archive_passed_through(tmpdir, git_dir):
+    commit = git(git_dir, "rev-parse", "master").decode().strip()
+    result = _remote_archive(tmpdir, git_dir, commit)
+    # git upload-archive refuses unadvertised objects itself
+    assert result.returncode != 0
+    assert b"no such ref" in result.stderr
+    result = _remote_archive(tmpdir, git_dir, "--format=tar", "master", "src")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == _git_archive(git_dir, "--format=tar", "master", "src")
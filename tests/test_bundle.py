@@ -0,0 +1,136 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+from gitosis import bundle, repository, stats, util
+
+from .util import git
+
+
+@pytest.fixture
+def cfg(cfg, tmpdir):
+    cfg.set("gitosis", "bundle-dir", os.path.join(tmpdir, "bundles"))
+    cfg.set("gitosis", "bundle-uri", "https://git.example.com/bundles/")
+    cfg.set("gitosis", "bundle-max-increments", "1")
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "bundles", "yes")
+    return cfg
+
+
+def _make_repo(tmpdir, name):
+    path = os.path.join(tmpdir, "repositories", f"{name}.git")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    repository.init(path)
+    _commit(path, "initial", None)
+    return path
+
+
+def _commit(path, content, parent="refs/heads/master^0"):
+    repository.fast_import(
+        git_dir=path,
+        commit_msg=content,
+        committer="John Doe <jdoe@example.com>",
+        files=[("foo", f"{content}\n")],
+        parent=parent,
+    )
+
+
+def _read_state(cfg, name):
+    with open(os.path.join(bundle.get_bundle_dir(cfg), name, bundle.STATE)) as fp:
+        return json.load(fp)["bundles"]
+
+
+def _get_config(path):
+    try:
+        output = git(path, "config", "--get-regexp", "^(bundle|uploadpack)\\.")
+    except subprocess.CalledProcessError:
+        return {}
+    return dict(line.split(" ", 1) for line in output.decode().splitlines())
+
+
+def test_is_selected(cfg, tmpdir):
+    index = stats.Index(os.path.join(tmpdir, "stats"))
+    assert bundle.is_selected(cfg, "foo", index)
+    assert not bundle.is_selected(cfg, "bar", index)
+    cfg.set("gitosis", "bundle-min-size", "1K")
+    os.makedirs(index.path)
+    for name, size in [("bar", 2048), ("baz", 100)]:
+        util.write_file(index._record_path(name), json.dumps({"version": stats.VERSION, "size": size}))
+    # large private repositories aren't published without asking
+    assert not bundle.is_selected(cfg, "bar", index)
+    cfg.add_section("repo bar")
+    cfg.set("repo bar", "gitweb", "yes")
+    cfg.add_section("repo baz")
+    cfg.set("repo baz", "gitweb", "yes")
+    assert bundle.is_selected(cfg, "bar", index)
+    assert not bundle.is_selected(cfg, "baz", index)
+    cfg.set("gitosis", "bundle-min-size", "1.5K")
+    assert not bundle.is_selected(cfg, "bar", index)
+    cfg.set("gitosis", "bundle-min-size", "1K")
+    cfg.set("repo bar", "bundles", "no")
+    assert not bundle.is_selected(cfg, "bar", index)
+
+
+def test_update(cfg, tmpdir):
+    path = _make_repo(tmpdir, "foo")
+    bundle_dir = os.path.join(tmpdir, "bundles", "foo")
+    assert bundle.update(cfg, "foo", path)
+    assert [entry["file"] for entry in _read_state(cfg, "foo")] == ["1.bundle"]
+    git(path, "bundle", "verify", os.path.join(bundle_dir, "1.bundle"))
+    assert _get_config(path) == {
+        "bundle.version": "1",
+        "bundle.mode": "all",
+        "bundle.heuristic": "creationToken",
+        "bundle.b1.uri": "https://git.example.com/bundles/foo/1.bundle",
+        "bundle.b1.creationtoken": "1",
+        "uploadpack.advertisebundleuris": "true",
+    }
+    # nothing was pushed, so there's nothing to bundle
+    assert not bundle.update(cfg, "foo", path)
+
+    _commit(path, "second")
+    assert bundle.update(cfg, "foo", path)
+    bundles = _read_state(cfg, "foo")
+    assert [entry["file"] for entry in bundles] == ["1.bundle", "2.bundle"]
+    assert bundles[1]["tips"] == {"refs/heads/master": git(path, "rev-parse", "refs/heads/master").decode().strip()}
+    # the incremental bundle needs the first one
+    output = git(path, "bundle", "list-heads", os.path.join(bundle_dir, "2.bundle"))
+    assert b"refs/heads/master" in output
+    assert _get_config(path)["bundle.b2.creationtoken"] == "2"
+
+    # past bundle-max-increments, the bundles start over
+    _commit(path, "third")
+    assert bundle.update(cfg, "foo", path)
+    assert [entry["file"] for entry in _read_state(cfg, "foo")] == ["3.bundle"]
+    assert sorted(os.listdir(bundle_dir)) == [".lock", "3.bundle", bundle.STATE]
+    assert "bundle.b1.uri" not in _get_config(path)
+
+    assert bundle.update(cfg, "foo", path, full=True)
+    assert [entry["file"] for entry in _read_state(cfg, "foo")] == ["4.bundle"]
+
+
+def test_clone_from_bundles(cfg, tmpdir):
+    path = _make_repo(tmpdir, "foo")
+    bundle.update(cfg, "foo", path)
+    _commit(path, "second")
+    bundle.update(cfg, "foo", path)
+    clone = os.path.join(tmpdir, "clone")
+    git(path, "init", "--bare", clone)
+    for entry in _read_state(cfg, "foo"):
+        git(clone, "bundle", "unbundle", os.path.join(tmpdir, "bundles", "foo", entry["file"]))
+    assert git(clone, "cat-file", "-p", git(path, "rev-parse", "refs/heads/master:foo").strip().decode()) == b"second\n"
+
+
+def test_update_all(cfg, tmpdir):
+    foo = _make_repo(tmpdir, "foo")
+    _make_repo(tmpdir, "bar")
+    assert bundle.update_all(cfg) == 1
+    assert os.listdir(os.path.join(tmpdir, "bundles")) == ["foo"]
+    assert bundle.update_all(cfg) == 0
+
+    cfg.set("repo foo", "bundles", "no")
+    bundle.update_all(cfg)
+    assert os.listdir(os.path.join(tmpdir, "bundles")) == []
+    assert _get_config(foo) == {}
@@ -0,0 +1,98 @@
+import configparser
+from io import StringIO
+import os
+
+from gitosis import cgit
+from gitosis.util import read_file
+
+
+def test_cgitrc_empty():
+    cfg = configparser.ConfigParser(interpolation=None)
+    got = StringIO()
+    cgit.generate_cgitrc_fp(config=cfg, fp=got)
+    assert got.getvalue() == ""
+
+
+def test_cgitrc_repo_denied():
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("repo foo/bar")
+    got = StringIO()
+    cgit.generate_cgitrc_fp(config=cfg, fp=got)
+    assert got.getvalue() == ""
+
+
+def test_cgitrc_gitweb_visible(tmpdir):
+    os.makedirs(os.path.join(tmpdir, "foo", "bar.git"))
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", str(tmpdir))
+    cfg.add_section("repo foo/bar")
+    cfg.set("repo foo/bar", "gitweb", "yes")
+    cfg.set("repo foo/bar", "description", "blah\n  blah")
+    cfg.set("repo foo/bar", "owner", "John Doe")
+    got = StringIO()
+    cgit.generate_cgitrc_fp(config=cfg, fp=got)
+    assert got.getvalue() == (
+        "repo.url=foo/bar\n"
+        f"repo.path={os.path.join(tmpdir, 'foo', 'bar.git')}\n"
+        "repo.desc=blah blah\n"
+        "repo.owner=John Doe\n"
+        "\n"
+    )
+
+
+def test_cgitrc_overrides(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", str(tmpdir))
+    cfg.set("gitosis", "gitweb", "yes")
+    cfg.set("gitosis", "cgit", "no")
+    cfg.add_section("repo hidden")
+    cfg.add_section("repo shown")
+    cfg.set("repo shown", "cgit", "yes")
+    cfg.add_section("repo webonly")
+    cfg.set("repo webonly", "gitweb", "yes")
+    cfg.set("repo webonly", "cgit", "no")
+    got = StringIO()
+    cgit.generate_cgitrc_fp(config=cfg, fp=got)
+    assert got.getvalue().splitlines()[0::3] == ["repo.url=shown"]
+
+
+def test_cgitrc_precedence(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", str(tmpdir))
+    cfg.set("gitosis", "gitweb", "no")
+    cfg.add_section("repo webonly")
+    cfg.set("repo webonly", "gitweb", "yes")
+    cfg.add_section("repo cgitonly")
+    cfg.set("repo cgitonly", "gitweb", "no")
+    cfg.set("repo cgitonly", "cgit", "yes")
+    cfg.add_section("repo neither")
+    got = StringIO()
+    cgit.generate_cgitrc_fp(config=cfg, fp=got)
+    assert got.getvalue().splitlines()[0::3] == ["repo.url=webonly", "repo.url=cgitonly"]
+    # a global cgit setting beats gitweb settings in any section
+    cfg.set("gitosis", "cgit", "yes")
+    got = StringIO()
+    cgit.generate_cgitrc_fp(config=cfg, fp=got)
+    assert got.getvalue().splitlines()[0::3] == ["repo.url=webonly", "repo.url=cgitonly", "repo.url=neither"]
+    cfg.set("gitosis", "cgit", "no")
+    got = StringIO()
+    cgit.generate_cgitrc_fp(config=cfg, fp=got)
+    assert got.getvalue().splitlines()[0::3] == ["repo.url=cgitonly"]
+
+
+def test_cgitrc_only_rewritten_on_change(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", str(tmpdir))
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "gitweb", "yes")
+    path = os.path.join(tmpdir, "cgitrc")
+    assert cgit.generate_cgitrc(config=cfg, path=path)
+    assert "repo.url=foo\n" in read_file(path)
+    assert not cgit.generate_cgitrc(config=cfg, path=path)
+    cfg.set("repo foo", "owner", "John Doe")
+    assert cgit.generate_cgitrc(config=cfg, path=path)
+    assert "repo.owner=John Doe\n" in read_file(path)
@@ -0,0 +1,23 @@
+import configparser
+import io
+
+from gitosis import check, matrix
+
+
+def test_answer():
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("group hackers")
+    cfg.set("group hackers", "members", "jdoe")
+    cfg.set("group hackers", "writable", "foo")
+    perms = matrix.build(cfg)
+    queries = io.StringIO("jdoe writable foo\njdoe readonly foo.git\nwsmith readonly foo\n\nbogus\njdoe evil foo\n")
+    out = io.StringIO()
+    check.answer(perms, queries, out)
+    assert out.getvalue().splitlines() == [
+        "jdoe writable foo yes",
+        "jdoe readonly foo.git yes",
+        "wsmith readonly foo no",
+        "invalid",
+        "bogus invalid",
+        "jdoe evil foo invalid",
+    ]
@@ -0,0 +1,178 @@
+import configparser
+from io import StringIO
+import json
+import os
+
+import pytest
+
+from gitosis import access, config, group, util
+from gitosis.util import read_file, write_file
+
+CONF = """\
+[gitosis]
+loglevel = DEBUG
+
+[group hackers]
+members = jdoe
+  wsmith
+writable = foo
+
+[repo foo]
+description = blah blah
+
+[group others]
+members = @hackers
+readonly = bar
+"""
+
+
+def _lazy(tmpdir, contents=CONF):
+    path = os.path.join(tmpdir, "gitosis.conf")
+    write_file(path, contents)
+    cfg = config.LazyConfigParser(interpolation=None)
+    assert cfg.read(path) == [path]
+    return cfg
+
+
+def test_scan_sections():
+    fp = StringIO(CONF)
+    got = config.scan_sections(
+        (line.encode() for line in fp),  # type: ignore
+        configparser.ConfigParser.SECTCRE,
+    )
+    assert [name for name, _, _ in got] == ["gitosis", "group hackers", "repo foo", "group others"]
+    assert got[0][1] == 0
+    assert got[-1][2] == len(CONF)
+    for (_, _, end), (_, start, _) in zip(got, got[1:]):
+        assert end == start
+
+
+def test_scan_sections_indented_header_is_not_a_section():
+    got = config.scan_sections(
+        iter([b"[foo]\n", b"x = 1\n", b"  [bar]\n"]),  # type: ignore
+        configparser.ConfigParser.SECTCRE,
+    )
+    assert got == [("foo", 0, 20)]
+
+
+def test_sections_without_parsing(tmpdir):
+    cfg = _lazy(tmpdir)
+    assert cfg.sections() == ["gitosis", "group hackers", "repo foo", "group others"]
+    assert cfg.has_section("repo foo")
+    assert set(cfg.pending_sections()) == set(cfg.sections())
+
+
+def test_get_parses_only_that_section(tmpdir):
+    cfg = _lazy(tmpdir)
+    assert cfg.get("gitosis", "loglevel") == "DEBUG"
+    assert "gitosis" not in cfg.pending_sections()
+    assert "repo foo" in cfg.pending_sections()
+
+
+def test_multiline_value(tmpdir):
+    cfg = _lazy(tmpdir)
+    assert cfg.get("group hackers", "members").split() == ["jdoe", "wsmith"]
+
+
+def test_missing(tmpdir):
+    cfg = _lazy(tmpdir)
+    assert util.get(cfg, "gitosis", "nope") is None
+    assert util.get(cfg, "nope", "nope") is None
+    assert not util.get_boolean(cfg, "repo foo", "gitweb", default=False)
+    with pytest.raises(configparser.NoSectionError):
+        cfg.options("nope")
+
+
+def test_missing_file(tmpdir):
+    cfg = config.LazyConfigParser(interpolation=None)
+    assert cfg.read(os.path.join(tmpdir, "nope.conf")) == []
+    assert cfg.sections() == []
+
+
+def test_group_and_access_unchanged(tmpdir):
+    cfg = _lazy(tmpdir)
+    assert list(group.get_membership(cfg, "jdoe")) == ["hackers", "others", "all"]
+    assert access.have_access(cfg, "jdoe", "readonly", "bar") == ("repositories", "bar")
+    assert "repo foo" in cfg.pending_sections()
+
+
+def test_same_as_configparser(tmpdir):
+    cfg = _lazy(tmpdir)
+    eager = configparser.ConfigParser(interpolation=None)
+    eager.read_string(CONF)
+    assert {s: dict(cfg.items(s)) for s in cfg.sections()} == {s: dict(eager.items(s)) for s in eager.sections()}
+
+
+def test_defaults(tmpdir):
+    cfg = _lazy(tmpdir, "[repo foo]\n\n[DEFAULT]\ngitweb = yes\n")
+    assert cfg.sections() == ["repo foo"]
+    assert cfg.getboolean("repo foo", "gitweb")
+
+
+def test_duplicate_section(tmpdir):
+    path = os.path.join(tmpdir, "gitosis.conf")
+    write_file(path, "[foo]\n[foo]\n")
+    cfg = config.LazyConfigParser(interpolation=None)
+    with pytest.raises(configparser.DuplicateSectionError):
+        cfg.read(path)
+
+
+def test_reread_merges(tmpdir):
+    cfg = _lazy(tmpdir)
+    assert cfg.get("repo foo", "description") == "blah blah"
+    other = os.path.join(tmpdir, "other.conf")
+    write_file(other, "[repo foo]\ndescription = changed\n")
+    cfg.read(other)
+    assert cfg.get("repo foo", "description") == "changed"
+
+
+def test_set_and_remove(tmpdir):
+    cfg = _lazy(tmpdir)
+    cfg.set("repo foo", "owner", "John Doe")
+    assert cfg.get("repo foo", "description") == "blah blah"
+    cfg.remove_section("group others")
+    assert not cfg.has_section("group others")
+    assert "group others" not in cfg.pending_sections()
+
+
+def test_write(tmpdir):
+    cfg = _lazy(tmpdir)
+    got = StringIO()
+    cfg.write(got)
+    assert "description = blah blah" in got.getvalue()
+
+
+def test_replaced_file_does_not_affect_parser(tmpdir):
+    cfg = _lazy(tmpdir)
+    path = os.path.join(tmpdir, "gitosis.conf")
+    write_file(path, "[repo foo]\ndescription = something much longer than before\n")
+    assert cfg.get("repo foo", "description") == "blah blah"
+
+
+def test_index_cached(tmpdir):
+    cfg = _lazy(tmpdir)
+    path = os.path.join(tmpdir, "gitosis.conf")
+    idx = config.index_path(path)
+    # readers never write the index themselves
+    assert not os.path.exists(idx)
+    config.write_index(path)
+    cached = json.loads(read_file(idx))
+    assert [name for name, _, _ in cached["sections"]] == cfg.sections()
+
+    # a stale-looking index with the right key is trusted as-is
+    cached["sections"] = cached["sections"][:1]
+    write_file(idx, json.dumps(cached))
+    assert config.LazyConfigParser().read(path) == [path]
+    cfg = config.LazyConfigParser()
+    cfg.read(path)
+    assert cfg.sections() == ["gitosis"]
+
+
+def test_index_invalidated(tmpdir):
+    _lazy(tmpdir)
+    path = os.path.join(tmpdir, "gitosis.conf")
+    config.write_index(path)
+    write_file(path, "[repo bar]\n")
+    cfg = config.LazyConfigParser()
+    cfg.read(path)
+    assert cfg.sections() == ["repo bar"]
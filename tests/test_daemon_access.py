@@ -0,0 +1,86 @@
+import io
+import os
+
+import pytest
+
+from gitosis import daemon_access
+from gitosis.util import write_file
+
+
+def _policy(tmpdir, entries, *, default=False):
+    path = os.path.join(tmpdir, "policy")
+    fp = io.StringIO()
+    daemon_access.write_policy(fp, default=default, entries=entries)
+    write_file(path, fp.getvalue())
+    return path
+
+
+def test_write_policy():
+    fp = io.StringIO()
+    daemon_access.write_policy(fp, default=False, entries={"/r/b.git": True, "/r/a.git": False})
+    assert fp.getvalue() == f"{daemon_access.HEADER} default=deny\n/r/a.git\tdeny\n/r/b.git\tallow\n"
+
+
+def test_lookup_many(tmpdir):
+    entries = {f"/r/repo{i:05d}.git": i % 3 == 0 for i in range(2000)}
+    policy = _policy(tmpdir, entries)
+    for path, allowed in entries.items():
+        assert daemon_access.is_allowed(policy, "upload-pack", path) == allowed
+    assert not daemon_access.is_allowed(policy, "upload-pack", "/r/repo.git")
+    assert not daemon_access.is_allowed(policy, "upload-pack", "/r/zzz.git")
+    assert not daemon_access.is_allowed(policy, "upload-pack", "/a.git")
+
+
+def test_default(tmpdir):
+    assert daemon_access.is_allowed(_policy(tmpdir, {}, default=True), "upload-pack", "/r/foo.git")
+    assert not daemon_access.is_allowed(_policy(tmpdir, {}, default=False), "upload-pack", "/r/foo.git")
+    policy = _policy(tmpdir, {"/r/hidden.git": False}, default=True)
+    assert not daemon_access.is_allowed(policy, "upload-pack", "/r/hidden.git")
+    assert daemon_access.is_allowed(policy, "upload-pack", "/r/other.git")
+
+
+def test_service(tmpdir):
+    policy = _policy(tmpdir, {"/r/foo.git": True})
+    assert daemon_access.is_allowed(policy, "upload-archive", "/r/foo.git")
+    assert not daemon_access.is_allowed(policy, "receive-pack", "/r/foo.git")
+
+
+def test_path_variants(tmpdir):
+    policy = _policy(tmpdir, {"/r/foo.git": True})
+    assert daemon_access.is_allowed(policy, "upload-pack", "/r/foo")
+    assert daemon_access.is_allowed(policy, "upload-pack", "/r/foo.git/")
+    assert daemon_access.is_allowed(policy, "upload-pack", "/r//foo.git/.git")
+
+
+def test_symlink_resolved(tmpdir):
+    physical = os.path.join(tmpdir, "repositories", "actual.git")
+    os.makedirs(physical)
+    link = os.path.join(tmpdir, "farm", "visible.git")
+    os.makedirs(os.path.dirname(link))
+    os.symlink(physical, link)
+    policy = _policy(tmpdir, {os.path.realpath(physical): True})
+    assert daemon_access.is_allowed(policy, "upload-pack", link)
+    policy = _policy(tmpdir, {os.path.realpath(physical): True, link: False})
+    assert not daemon_access.is_allowed(policy, "upload-pack", link)
+
+
+def test_bad_policy(tmpdir):
+    path = os.path.join(tmpdir, "policy")
+    write_file(path, "/r/foo.git\tallow\n")
+    assert not daemon_access.is_allowed(path, "upload-pack", "/r/foo.git")
+
+
+def test_main(tmpdir):
+    policy = _policy(tmpdir, {"/r/foo.git": True})
+    with pytest.raises(SystemExit) as e:
+        daemon_access.main(["--policy", policy, "upload-pack", "/r/foo.git", "example.com", "", "127.0.0.1", "9418"])
+    assert e.value.code == 0
+    with pytest.raises(SystemExit) as e:
+        daemon_access.main(["--policy", policy, "upload-pack", "/r/bar.git", "example.com"])
+    assert e.value.code == 1
+    with pytest.raises(SystemExit) as e:
+        daemon_access.main(["--policy", os.path.join(tmpdir, "missing"), "upload-pack", "/r/foo.git"])
+    assert e.value.code == 1
+    with pytest.raises(SystemExit) as e:
+        daemon_access.main([])
+    assert e.value.code == 2
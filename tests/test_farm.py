@@ -0,0 +1,129 @@
+import configparser
+from io import StringIO
+import json
+import os
+
+from gitosis import farm, gitweb
+from gitosis.util import read_file
+
+
+def _config(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", os.path.join(tmpdir, "repositories"))
+    cfg.set("gitosis", "symlink-farm", os.path.join(tmpdir, "farm"))
+    return cfg
+
+
+def test_logical_names(tmpdir):
+    cfg = _config(tmpdir)
+    repos = os.path.join(tmpdir, "repositories")
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "writable", "foo")
+    cfg.set("group fooers", "map readonly visible/name", "actual/name")
+    cfg.add_section("group other")
+    cfg.set("group other", "repositories", "/elsewhere")
+    cfg.set("group other", "readonly", "bar")
+    cfg.add_section("repo quux")
+    assert farm.get_logical_names(cfg) == {
+        "foo.git": os.path.join(repos, "foo.git"),
+        "visible/name.git": os.path.join(repos, "actual/name.git"),
+        "bar.git": "/elsewhere/bar.git",
+        "quux.git": os.path.join(repos, "quux.git"),
+    }
+
+
+def test_logical_names_first_wins(tmpdir):
+    cfg = _config(tmpdir)
+    repos = os.path.join(tmpdir, "repositories")
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "map writable foo", "one")
+    cfg.add_section("group barers")
+    cfg.set("group barers", "map writable foo", "two")
+    assert farm.get_logical_names(cfg) == {"foo.git": os.path.join(repos, "one.git")}
+
+
+def test_logical_names_unsafe(tmpdir):
+    cfg = _config(tmpdir)
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "writable", "../evil")
+    cfg.set("group fooers", "map writable foo", "../../etc")
+    assert farm.get_logical_names(cfg) == {}
+
+
+def test_update_farm_disabled(tmpdir):
+    cfg = _config(tmpdir)
+    cfg.remove_option("gitosis", "symlink-farm")
+    farm.update_farm(cfg)
+    assert not os.path.exists(os.path.join(tmpdir, "farm"))
+
+
+def test_update_farm(tmpdir):
+    cfg = _config(tmpdir)
+    repos = os.path.join(tmpdir, "repositories")
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "map writable visible/name", "actual")
+    farm.update_farm(cfg)
+    link = os.path.join(tmpdir, "farm", "visible", "name.git")
+    assert os.readlink(link) == os.path.join(repos, "actual.git")
+    manifest = json.loads(read_file(os.path.join(tmpdir, "farm", farm.MANIFEST)))
+    assert manifest == {"visible/name.git": os.path.join(repos, "actual.git")}
+
+
+def test_update_farm_incremental(tmpdir, monkeypatch):
+    cfg = _config(tmpdir)
+    repos = os.path.join(tmpdir, "repositories")
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "map writable a/one", "x")
+    cfg.set("group fooers", "map writable two", "y")
+    farm.update_farm(cfg)
+
+    made = []
+    real_symlink = farm._symlink
+    monkeypatch.setattr(farm, "_symlink", lambda *a: made.append(a[1]) or real_symlink(*a))
+    monkeypatch.setattr(farm, "scan_farm", _no_scan)
+
+    cfg.remove_option("group fooers", "map writable a/one")
+    cfg.set("group fooers", "map writable two", "z")
+    cfg.set("group fooers", "map writable three", "y")
+    farm.update_farm(cfg)
+    assert sorted(made) == ["three.git", "two.git"]
+    assert not os.path.lexists(os.path.join(tmpdir, "farm", "a"))
+    assert os.readlink(os.path.join(tmpdir, "farm", "two.git")) == os.path.join(repos, "z.git")
+
+
+def _no_scan(_farm):
+    raise AssertionError("farm should not be scanned when a manifest exists")
+
+
+def test_update_farm_without_manifest(tmpdir):
+    cfg = _config(tmpdir)
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "writable", "keep")
+    farm.update_farm(cfg)
+    stale = os.path.join(tmpdir, "farm", "stale.git")
+    os.symlink("/nowhere", stale)
+    os.unlink(os.path.join(tmpdir, "farm", farm.MANIFEST))
+    farm.update_farm(cfg)
+    assert not os.path.lexists(stale)
+    assert os.path.islink(os.path.join(tmpdir, "farm", "keep.git"))
+
+
+def test_update_farm_leaves_foreign_files(tmpdir):
+    cfg = _config(tmpdir)
+    os.makedirs(os.path.join(tmpdir, "farm", "mine.git"))
+    farm.update_farm(cfg)
+    assert os.path.isdir(os.path.join(tmpdir, "farm", "mine.git"))
+
+
+def test_projects_list_uses_farm(tmpdir):
+    cfg = _config(tmpdir)
+    os.makedirs(os.path.join(tmpdir, "repositories", "actual.git"))
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "map readonly visible", "actual")
+    cfg.add_section("repo visible")
+    cfg.set("repo visible", "gitweb", "yes")
+    farm.update_farm(cfg)
+    got = StringIO()
+    gitweb.generate_project_list_fp(config=cfg, fp=got)
+    assert got.getvalue() == "visible.git\n"
@@ -0,0 +1,131 @@
+import configparser
+import os
+
+import pytest
+
+from gitosis import fragments, generation, objects, repository, run_hook
+from gitosis.util import read_file
+
+BASE = """\
+[gitosis]
+gitweb = no
+
+[group admins]
+members = jdoe
+writable = gitosis-admin
+"""
+
+
+@pytest.fixture
+def admin(tmpdir):
+    path = os.path.join(tmpdir, "repositories", "gitosis-admin.git")
+    os.makedirs(os.path.dirname(path))
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg="initial",
+        committer="John Doe <jdoe@example.com>",
+        files=[
+            ("gitosis.conf", BASE),
+            ("gitosis.d/b.conf", "[repo foo]\ndescription = from b\n"),
+            ("gitosis.d/a.conf", "[repo foo]\ngitweb = yes\ndescription = from a\n\n[group admins]\nmembers = jdoe\n"),
+            ("gitosis.d/README", "not a fragment\n"),
+            ("keydir/jdoe.pub", "ssh-rsa AAAA jdoe@example.com\n"),
+        ],
+    )
+    return path
+
+
+def _read_config(path):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.read(path)
+    return cfg
+
+
+def test_parse():
+    assert fragments.parse("x.conf", "[DEFAULT]\nfoo = 1\n[repo a]\nGitweb = yes\ndescription = one\n two\n") == {
+        "DEFAULT": {"foo": "1"},
+        "repo a": {"gitweb": "yes", "description": "one\ntwo"},
+    }
+    with pytest.raises(fragments.FragmentError, match="Cannot parse configuration file: x.conf"):
+        fragments.parse("x.conf", "[repo a]\n[repo a]\n")
+
+
+def test_merge():
+    merged, conflicts = fragments.merge(
+        [
+            ("one", {"repo a": {"gitweb": "yes"}}),
+            ("two", {"repo a": {"gitweb": "no", "daemon": "yes"}, "repo b": {}}),
+            ("three", {"repo a": {"gitweb": "yes"}}),
+        ],
+    )
+    assert merged == {"repo a": {"gitweb": "yes", "daemon": "yes"}, "repo b": {}}
+    assert conflicts == [fragments.Conflict("repo a", "gitweb", "one", "two")]
+    assert str(conflicts[0]) == "[repo a] gitweb is set by both one and two; using one"
+
+
+def test_format_sections_round_trip(tmpdir):
+    sections = {"DEFAULT": {"x": "1"}, "repo a": {"description": "one\ntwo", "owner": ""}}
+    path = os.path.join(tmpdir, "gitosis.conf")
+    with open(path, "w") as fp:
+        fp.write(fragments.format_sections(sections))
+    assert fragments.parse("gitosis.conf", read_file(path)) == sections
+
+
+def test_combine(admin, tmpdir):
+    cache = fragments.Cache(os.path.join(tmpdir, "cache"))
+    path = os.path.join(tmpdir, "gitosis.conf")
+    with objects.Repository(admin) as repo:
+        conflicts = fragments.combine(repo, "HEAD", path, cache)
+    assert [str(conflict) for conflict in conflicts] == [
+        "[repo foo] description is set by both gitosis.d/a.conf and gitosis.d/b.conf; using gitosis.d/a.conf",
+    ]
+    cfg = _read_config(path)
+    assert cfg.sections() == ["gitosis", "group admins", "repo foo"]
+    assert cfg.get("repo foo", "description") == "from a"
+    assert cfg.get("group admins", "members") == "jdoe"
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    repository.fast_import(
+        git_dir=admin,
+        commit_msg="change",
+        committer="John Doe <jdoe@example.com>",
+        files=[("gitosis.d/b.conf", "[repo bar]\ndaemon = yes\n")],
+        parent="refs/heads/master^0",
+    )
+    cache = fragments.Cache(os.path.join(tmpdir, "cache"))
+    with objects.Repository(admin) as repo:
+        assert fragments.combine(repo, "HEAD", path, cache) == []
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.collect_garbage()
+    assert len(os.listdir(os.path.join(tmpdir, "cache"))) == 3
+    assert _read_config(path).get("repo bar", "daemon") == "yes"
+
+
+def test_combine_without_fragments(tmpdir):
+    path = os.path.join(tmpdir, "repo.git")
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg="initial",
+        committer="John Doe <jdoe@example.com>",
+        files=[("gitosis.conf", BASE)],
+    )
+    cache = fragments.Cache(os.path.join(tmpdir, "cache"))
+    with objects.Repository(path) as repo:
+        assert fragments.combine(repo, "HEAD", os.path.join(tmpdir, "out.conf"), cache) == []
+    assert not os.path.exists(os.path.join(tmpdir, "out.conf"))
+
+
+def test_post_update(admin, tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", os.path.join(tmpdir, "repositories"))
+    cfg.set("gitosis", "generate-files-in", os.path.join(tmpdir, "generated"))
+    cfg.set("gitosis", "ssh-authorized-keys-path", os.path.join(tmpdir, "authorized_keys"))
+    repository.init(os.path.join(tmpdir, "repositories", "foo.git"))
+    run_hook.post_update(cfg, admin)
+    current = os.path.join(tmpdir, "generated", generation.CURRENT)
+    assert _read_config(os.path.join(current, "gitosis.conf")).get("repo foo", "gitweb") == "yes"
+    assert read_file(os.path.join(current, "projects.list")) == "foo.git\n"
+    assert read_file(os.path.join(tmpdir, "repositories", "foo.git", "description")) == "from a\n"
@@ -0,0 +1,200 @@
+import os
+import time
+
+import pytest
+
+from gitosis import config, daemon_access, generation, transaction
+from gitosis.util import read_file, write_file
+
+
+@pytest.fixture
+def cfg(cfg, tmpdir):
+    os.makedirs(os.path.join(tmpdir, "repositories", "foo.git"))
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "gitweb", "yes")
+    return cfg
+
+
+def _generations(generated):
+    return sorted(name for name in os.listdir(os.path.join(generated, "generations")) if not name.startswith("."))
+
+
+def test_building(tmpdir):
+    generated = os.path.join(tmpdir, "generated")
+    assert generation.get_current(generated) is None
+    with generation.building(generated) as path:
+        write_file(os.path.join(path, "projects.list"), "foo.git\n")
+        # nothing is visible until the generation is complete
+        assert generation.get_current(generated) is None
+    current = generation.get_current(generated)
+    assert os.path.dirname(current) == os.path.join(generated, "generations")
+    assert os.readlink(os.path.join(generated, "projects.list")) == "current/projects.list"
+    assert read_file(os.path.join(generated, "projects.list")) == "foo.git\n"
+
+
+def test_building_failure(tmpdir):
+    generated = os.path.join(tmpdir, "generated")
+    with generation.building(generated) as path:
+        write_file(os.path.join(path, "projects.list"), "old\n")
+    current = generation.get_current(generated)
+
+    def fail():
+        with generation.building(generated) as path:
+            write_file(os.path.join(path, "projects.list"), "new\n")
+            raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        fail()
+    assert generation.get_current(generated) == current
+    assert os.listdir(os.path.join(generated, "generations")) == [os.path.basename(current)]
+    assert read_file(os.path.join(generated, "projects.list")) == "old\n"
+
+
+def test_publish_replaces_legacy_files(tmpdir):
+    generated = os.path.join(tmpdir, "generated")
+    os.makedirs(os.path.join(generated, "user-projects", "users"))
+    write_file(os.path.join(generated, "projects.list"), "legacy\n")
+    write_file(os.path.join(generated, "cgitrc"), "legacy\n")
+    with generation.building(generated) as path:
+        write_file(os.path.join(path, "projects.list"), "new\n")
+        os.mkdir(os.path.join(path, "user-projects"))
+    assert os.path.islink(os.path.join(generated, "projects.list"))
+    assert os.path.islink(os.path.join(generated, "user-projects"))
+    # not generated any more, but not ours to remove either
+    assert read_file(os.path.join(generated, "cgitrc")) == "legacy\n"
+
+    with generation.building(generated) as path:
+        write_file(os.path.join(path, "projects.list"), "newer\n")
+    assert not os.path.lexists(os.path.join(generated, "user-projects"))
+
+
+def test_carry(tmpdir):
+    generated = os.path.join(tmpdir, "generated")
+    with generation.building(generated) as path:
+        write_file(os.path.join(path, "gitosis.conf"), "[gitosis]\n")
+        os.mkdir(os.path.join(path, "keydir"))
+        write_file(os.path.join(path, "keydir", "jdoe.pub"), "key\n")
+    old = generation.get_current(generated)
+    with generation.building(generated, carry=["gitosis.conf", "keydir", "missing"]) as path:
+        assert read_file(os.path.join(path, "keydir", "jdoe.pub")) == "key\n"
+        write_file(os.path.join(path, "gitosis.conf"), "[gitosis]\nchanged = yes\n")
+    assert read_file(os.path.join(old, "gitosis.conf")) == "[gitosis]\n"
+    assert read_file(os.path.join(generated, "current", "gitosis.conf")) == "[gitosis]\nchanged = yes\n"
+
+
+def test_config_index(tmpdir):
+    generated = os.path.join(tmpdir, "generated")
+    with generation.building(generated) as path:
+        write_file(os.path.join(path, "gitosis.conf"), "[gitosis]\n[repo foo]\n")
+    current = generation.get_current(generated)
+    before = sorted(os.listdir(current))
+    assert config.index_path(os.path.join(current, "gitosis.conf")) == os.path.join(current, ".gitosis.conf.idx")
+    assert ".gitosis.conf.idx" in before
+    cfg = config.LazyConfigParser()
+    cfg.read(os.path.join(generated, "current", "gitosis.conf"))
+    assert cfg.sections() == ["gitosis", "repo foo"]
+    # reading the published generation leaves it alone
+    assert sorted(os.listdir(current)) == before
+
+
+def test_collect_garbage(tmpdir):
+    generated = os.path.join(tmpdir, "generated")
+    for _ in range(5):
+        with generation.building(generated):
+            pass
+    names = _generations(generated)
+    abandoned = os.path.join(generated, "generations", ".00000000000000000000-abandoned.tmp")
+    in_progress = os.path.join(generated, "generations", ".00000000000000000001-in-progress.tmp")
+    os.mkdir(abandoned)
+    os.mkdir(in_progress)
+    os.utime(abandoned, (time.time() - 2 * 3600,) * 2)
+    generation.collect_garbage(generated, keep=2)
+    assert _generations(generated) == names[-2:]
+    assert not os.path.exists(abandoned)
+    assert os.path.exists(in_progress)
+
+
+def test_collect_garbage_keeps_current(tmpdir):
+    generated = os.path.join(tmpdir, "generated")
+    for _ in range(3):
+        with generation.building(generated):
+            pass
+    first = _generations(generated)[0]
+    generation.publish(generated, os.path.join(generated, "generations", first))
+    generation.collect_garbage(generated, keep=1)
+    assert _generations(generated) == sorted({first, _generations(generated)[-1]})
+
+
+def test_regenerate(cfg, tmpdir):
+    generated = os.path.join(tmpdir, "generated")
+    with generation.building(generated) as path:
+        write_file(os.path.join(path, "gitosis.conf"), "[gitosis]\n")
+        os.mkdir(os.path.join(path, "keydir"))
+        write_file(os.path.join(path, "keydir", "jdoe.pub"), "ssh-rsa AAAA jdoe@example.com\n")
+    generation.regenerate(cfg)
+    current = generation.get_current(generated)
+    assert sorted(os.listdir(current)) == [
+        ".gitosis.conf.idx",
+        "authorized_keys",
+        "gitosis.conf",
+        "grants.json",
+        "keydir",
+        "projects.list",
+    ]
+    assert read_file(os.path.join(current, "projects.list")) == "foo.git\n"
+    assert 'command="gitosis-serve jdoe"' in read_file(os.path.join(current, "authorized_keys"))
+    assert len(_generations(generated)) == 2
+
+
+def test_generate_optional_files(cfg, tmpdir):
+    cfg.set("gitosis", "generate-cgitrc", "yes")
+    cfg.set("gitosis", "user-project-lists", "yes")
+    cfg.set("gitosis", "daemon-access-hook", "yes")
+    generation.regenerate(cfg)
+    generated = os.path.join(tmpdir, "generated")
+    for filename in generation.LINKED:
+        assert os.readlink(os.path.join(generated, filename)) == f"current/{filename}"
+        assert os.path.exists(os.path.join(generated, filename))
+
+
+def test_cgitrc_kept_when_unchanged(cfg, tmpdir):
+    cfg.set("gitosis", "generate-cgitrc", "yes")
+    generated = os.path.join(tmpdir, "generated")
+    generation.regenerate(cfg)
+    before = os.stat(os.path.join(generated, "cgitrc"))
+    generation.regenerate(cfg)
+    after = os.stat(os.path.join(generated, "cgitrc"))
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+    cfg.set("repo foo", "description", "changed")
+    generation.regenerate(cfg)
+    assert os.stat(os.path.join(generated, "cgitrc")).st_ino != before.st_ino
+    cfg.set("gitosis", "generate-cgitrc", "no")
+    generation.regenerate(cfg)
+    assert not os.path.lexists(os.path.join(generated, "cgitrc"))
+
+
+def test_generate_one_transaction(cfg, tmpdir, monkeypatch):
+    cfg.set("gitosis", "generate-cgitrc", "yes")
+    cfg.set("gitosis", "user-project-lists", "yes")
+    cfg.set("gitosis", "daemon-access-hook", "yes")
+    cfg.add_section("group foo")
+    cfg.set("group foo", "members", "jdoe")
+    cfg.set("group foo", "readonly", "foo")
+    committed = []
+    real_commit = transaction.WriteTransaction.commit
+
+    def commit(self):
+        committed.append(sorted(os.path.basename(path) for path in self._staged))
+        real_commit(self)
+
+    monkeypatch.setattr(transaction.WriteTransaction, "commit", commit)
+    path = os.path.join(tmpdir, "build")
+    os.makedirs(os.path.join(path, "keydir"))
+    write_file(os.path.join(path, "keydir", "jdoe.pub"), "ssh-rsa AAAA jdoe@example.com\n")
+    generation.generate(cfg, path)
+    assert len(committed) == 1
+    assert [name for name in committed[0] if not name.endswith(".list")] == sorted(
+        [daemon_access.POLICY, "authorized_keys", "cgitrc", "grants.json"]
+    )
+    assert "projects.list" in committed[0]
+    assert len(os.listdir(os.path.join(path, "user-projects", "lists"))) == 1
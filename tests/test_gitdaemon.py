@@ -1,7 +1,7 @@
 import configparser
 import os
 
-from gitosis import gitdaemon
+from gitosis import daemon_access, gitdaemon
 from gitosis.util import write_file
 
 
@@ -151,3 +151,69 @@ def test_git_daemon_export_ok_allowed_global(tmpdir):
     assert exported(os.path.join(tmpdir, "foo.git"))
     assert exported(os.path.join(tmpdir, "quux.git"))
     assert not exported(os.path.join(tmpdir, "thud.git"))
+
+
+def _policy_config(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", os.path.join(tmpdir, "repositories"))
+    cfg.set("gitosis", "generate-files-in", os.path.join(tmpdir, "generated"))
+    cfg.add_section("group fooers")
+    cfg.set("group fooers", "writable", "foo bar")
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "daemon", "yes")
+    return cfg
+
+
+def test_compile_access_policy(tmpdir):
+    cfg = _policy_config(tmpdir)
+    repos = os.path.join(tmpdir, "repositories")
+    assert gitdaemon.compile_access_policy(cfg) == (
+        False,
+        {
+            os.path.join(repos, "foo.git"): True,
+            os.path.join(repos, "bar.git"): False,
+        },
+    )
+
+
+def test_compile_access_policy_farm(tmpdir):
+    cfg = _policy_config(tmpdir)
+    cfg.set("gitosis", "symlink-farm", os.path.join(tmpdir, "farm"))
+    cfg.set("gitosis", "daemon", "yes")
+    cfg.set("group fooers", "map readonly public", "bar")
+    cfg.add_section("repo bar")
+    cfg.set("repo bar", "daemon", "no")
+    repos = os.path.join(tmpdir, "repositories")
+    farm = os.path.join(tmpdir, "farm")
+    default, entries = gitdaemon.compile_access_policy(cfg)
+    assert default
+    assert entries == {
+        os.path.join(repos, "foo.git"): True,
+        os.path.join(farm, "foo.git"): True,
+        os.path.join(repos, "bar.git"): False,
+        os.path.join(farm, "bar.git"): False,
+        os.path.join(farm, "public.git"): True,
+    }
+
+
+def test_update_daemon_access(tmpdir):
+    cfg = _policy_config(tmpdir)
+    os.makedirs(os.path.join(tmpdir, "repositories", "foo.git"))
+    gitdaemon.update_daemon_access(config=cfg)
+    assert not os.path.exists(os.path.join(tmpdir, "generated"))
+    assert exported(os.path.join(tmpdir, "repositories", "foo.git"))
+
+
+def test_update_daemon_access_hook(tmpdir):
+    cfg = _policy_config(tmpdir)
+    cfg.set("gitosis", "daemon-access-hook", "yes")
+    cfg.set("gitosis", "daemon-export-ok-files", "no")
+    repo = os.path.join(tmpdir, "repositories", "foo.git")
+    os.makedirs(repo)
+    os.mkdir(os.path.join(tmpdir, "generated"))
+    gitdaemon.update_daemon_access(config=cfg)
+    assert not exported(repo)
+    policy = os.path.join(tmpdir, "generated", daemon_access.POLICY)
+    assert daemon_access.is_allowed(policy, "upload-pack", repo)
+    assert not daemon_access.is_allowed(policy, "upload-pack", os.path.join(tmpdir, "repositories", "bar.git"))
@@ -2,7 +2,7 @@ import configparser
 from io import StringIO
 import os
 
-from gitosis import gitweb
+from gitosis import gitweb, util
 from gitosis.util import read_file, write_file
 
 
@@ -218,3 +218,58 @@ def test_description_again(tmpdir):
     gitweb.set_descriptions(config=cfg)
     got = read_file(os.path.join(path, "description"))
     assert got == "foodesc\n"
+
+
+def _user_lists_config(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", str(tmpdir))
+    cfg.add_section("group hackers")
+    cfg.set("group hackers", "members", "jdoe wsmith")
+    cfg.set("group hackers", "writable", "foo")
+    cfg.set("group hackers", "map readonly visible", "actual")
+    cfg.add_section("group admins")
+    cfg.set("group admins", "members", "root")
+    cfg.set("group admins", "readonly", "bar")
+    cfg.add_section("group all")
+    cfg.set("group all", "readonly", "public")
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "owner", "John Doe")
+    return cfg
+
+
+def test_user_project_lists(tmpdir):
+    os.makedirs(os.path.join(tmpdir, "foo.git"))
+    cfg = _user_lists_config(tmpdir)
+    path = os.path.join(tmpdir, "lists")
+    gitweb.generate_user_project_lists(config=cfg, path=path, users=["nobody"])
+    users = os.path.join(path, "users")
+    assert sorted(os.listdir(users)) == ["jdoe.list", "nobody.list", "root.list", "wsmith.list"]
+    assert read_file(os.path.join(users, "jdoe.list")) == "foo.git John+Doe\npublic\nvisible\n"
+    assert read_file(os.path.join(users, "root.list")) == "bar\npublic\n"
+    assert read_file(os.path.join(users, "nobody.list")) == "public\n"
+    # users with the same access share a list
+    assert os.readlink(os.path.join(users, "jdoe.list")) == os.readlink(os.path.join(users, "wsmith.list"))
+    assert len(os.listdir(os.path.join(path, "lists"))) == 3
+
+
+def test_user_project_lists_incremental(tmpdir, monkeypatch):
+    cfg = _user_lists_config(tmpdir)
+    path = os.path.join(tmpdir, "lists")
+    gitweb.generate_user_project_lists(config=cfg, path=path)
+    users = os.path.join(path, "users")
+    before = {name: os.readlink(os.path.join(users, name)) for name in os.listdir(users)}
+
+    written = []
+    real_write_file = util.write_file
+    monkeypatch.setattr(util, "write_file", lambda p, c: written.append(p) or real_write_file(p, c))
+    cfg.set("group admins", "readonly", "bar baz")
+    cfg.set("group hackers", "members", "jdoe")
+    gitweb.generate_user_project_lists(config=cfg, path=path)
+
+    assert len(written) == 1
+    assert sorted(os.listdir(users)) == ["jdoe.list", "root.list"]
+    assert os.readlink(os.path.join(users, "jdoe.list")) == before["jdoe.list"]
+    assert read_file(os.path.join(users, "root.list")) == "bar\nbaz\npublic\n"
+    # the old list for root is no longer used by anyone
+    assert len(os.listdir(os.path.join(path, "lists"))) == 2
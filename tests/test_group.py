@@ -162,3 +162,26 @@ def test_no_recurse_loop():
     assert next(gen) == "all"
     with pytest.raises(StopIteration):
         next(gen)
+
+
+def test_closure_matches_get_membership():
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("group everyone")
+    cfg.set("group everyone", "members", "@all")
+    cfg.add_section("group hackers")
+    cfg.set("group hackers", "members", "@smackers wsmith")
+    cfg.add_section("group smackers")
+    cfg.set("group smackers", "members", "@hackers jdoe")
+    cfg.add_section("group crackers")
+    cfg.set("group crackers", "members", "@everyone")
+    cfg.add_section("group others")
+    cfg.set("group others", "members", "alice")
+    got = group.get_membership_closure(config=cfg, users=["bob"])
+    assert set(got) == {"bob", "jdoe", "wsmith", "alice"}
+    for user, groups in got.items():
+        assert groups == tuple(group.get_membership(config=cfg, user=user))
+
+
+def test_closure_empty():
+    cfg = configparser.ConfigParser(interpolation=None)
+    assert group.get_membership_closure(config=cfg, users=["jdoe"]) == {"jdoe": ("all",)}
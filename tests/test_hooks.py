@@ -0,0 +1,139 @@
+import io
+import os
+import subprocess
+
+import pytest
+
+from gitosis import hooks, repository
+from gitosis.util import read_file, write_file
+
+from .util import git
+
+OLD = "0" * 40
+NEW = "1" * 40
+
+
+class Recorder(hooks.Plugin):
+    name = "recorder"
+    hooks = frozenset([hooks.PRE_RECEIVE, hooks.POST_RECEIVE])
+
+    def __init__(self):
+        self.seen = []
+
+    def run(self, context):
+        self.seen.append((context.hook, context.name, context.updates))
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    plugins = {cls.name: cls() for cls in hooks.BUILTIN_PLUGINS}
+    plugins["recorder"] = Recorder()
+    monkeypatch.setattr(hooks, "get_plugins", lambda: plugins)
+    return plugins["recorder"]
+
+
+@pytest.fixture
+def cfg(cfg):
+    cfg.add_section("repo foo")
+    return cfg
+
+
+@pytest.fixture
+def git_dir(tmpdir):
+    path = os.path.join(tmpdir, "repositories", "foo.git")
+    os.makedirs(os.path.dirname(path))
+    repository.init(path)
+    return path
+
+
+def test_read_updates():
+    lines = [f"{OLD} {NEW} refs/heads/master\n", "garbage\n"]
+    expected = [hooks.RefUpdate(OLD, NEW, "refs/heads/master")]
+    assert hooks.read_updates(hooks.POST_RECEIVE, [], lines) == expected
+    assert hooks.read_updates(hooks.PRE_RECEIVE, [], lines) == expected
+    assert hooks.read_updates(hooks.UPDATE, ["refs/heads/master", OLD, NEW], []) == expected
+    assert hooks.read_updates(hooks.POST_UPDATE, ["refs/heads/master"], lines) == []
+
+
+@pytest.mark.usefixtures("recorder")
+def test_get_enabled(cfg, tmpdir):
+    assert hooks.get_enabled(cfg, "foo") == []
+    cfg.set("gitosis", "repository-stats", "yes")
+    cfg.set("gitosis", "replicas", os.path.join(tmpdir, "replicas"))
+    cfg.set("gitosis", "hooks", "recorder")
+    assert [plugin.name for plugin in hooks.get_enabled(cfg, "foo")] == ["stats", "replicate", "recorder"]
+    cfg.set("repo foo", "hooks", "bogus")
+    assert [plugin.name for plugin in hooks.get_enabled(cfg, "foo")] == ["stats", "replicate"]
+
+
+def test_dispatch(cfg, git_dir, recorder):
+    stdin = io.StringIO(f"{OLD} {NEW} refs/heads/master\n")
+    hooks.dispatch(cfg, "gitosis.conf", hooks.POST_RECEIVE, git_dir, [], stdin)
+    assert recorder.seen == []
+    cfg.set("repo foo", "hooks", "recorder")
+    hooks.dispatch(cfg, "gitosis.conf", hooks.POST_RECEIVE, git_dir, [], stdin)
+    assert recorder.seen == [("post-receive", "foo", [hooks.RefUpdate(OLD, NEW, "refs/heads/master")])]
+    hooks.dispatch(cfg, "gitosis.conf", hooks.POST_UPDATE, git_dir, ["refs/heads/master"], stdin)
+    assert len(recorder.seen) == 1
+
+
+class Broken(hooks.Plugin):
+    name = "broken"
+    hooks = frozenset([hooks.PRE_RECEIVE, hooks.POST_RECEIVE])
+
+    def run(self, context):  # noqa: ARG002
+        raise RuntimeError("oops")
+
+
+def test_dispatch_failing_plugin(cfg, git_dir, recorder, monkeypatch, caplog):
+    plugins = {"broken": Broken(), "recorder": recorder}
+    monkeypatch.setattr(hooks, "get_plugins", lambda: plugins)
+    cfg.set("repo foo", "hooks", "broken recorder")
+    hooks.dispatch(
+        cfg, "gitosis.conf", hooks.POST_RECEIVE, git_dir, [], io.StringIO(f"{OLD} {NEW} refs/heads/master\n")
+    )
+    # the plugins after it still run
+    assert [seen[0] for seen in recorder.seen] == ["post-receive"]
+    assert "Hook plugin broken failed" in caplog.text
+    with pytest.raises(hooks.HookRejectedError, match="broken failed"):
+        hooks.dispatch(cfg, "gitosis.conf", hooks.PRE_RECEIVE, git_dir, [], io.StringIO(""))
+    assert len(recorder.seen) == 1
+
+
+@pytest.mark.usefixtures("recorder")
+def test_install(cfg, git_dir):
+    hooks.install_all(cfg)
+    assert not os.path.exists(os.path.join(git_dir, "hooks", "post-receive"))
+    cfg.set("repo foo", "hooks", "recorder")
+    hooks.install_all(cfg)
+    for hook in ["pre-receive", "post-receive"]:
+        path = os.path.join(git_dir, "hooks", hook)
+        assert os.access(path, os.X_OK)
+        assert read_file(path) == f'#!/bin/sh\nexec gitosis-run-hook {hook} "$@"\n'
+
+
+@pytest.mark.usefixtures("recorder")
+def test_install_leaves_own_hooks_alone(cfg, git_dir, caplog):
+    path = os.path.join(git_dir, "hooks", "post-receive")
+    write_file(path, "#!/bin/sh\nexec send-mail\n")
+    cfg.set("gitosis", "repository-stats", "yes")
+    hooks.install_all(cfg)
+    assert read_file(path) == "#!/bin/sh\nexec send-mail\n"
+    assert "Not replacing hook" in caplog.text
+
+
+@pytest.mark.usefixtures("recorder")
+def test_install_shared(cfg, git_dir, tmpdir):
+    admin = os.path.join(tmpdir, "repositories", "gitosis-admin.git")
+    repository.init(admin)
+    cfg.set("gitosis", "shared-hooks", "yes")
+    hooks.install_all(cfg)
+    shared_dir = os.path.join(tmpdir, "generated", "hooks")
+    assert sorted(os.listdir(shared_dir)) == ["post-receive", "pre-receive"]
+    assert git(git_dir, "config", "core.hooksPath").decode().strip() == shared_dir
+    with pytest.raises(subprocess.CalledProcessError):
+        git(admin, "config", "core.hooksPath")
+
+    cfg.set("gitosis", "shared-hooks", "no")
+    hooks.install_all(cfg)
+    assert git(git_dir, "config", "--default=", "core.hooksPath") == b"\n"
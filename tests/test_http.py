@@ -0,0 +1,256 @@
+import base64
+import io
+import os
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from gitosis import archive, http, repository
+from gitosis.util import read_file, write_file
+
+from .util import git
+
+CONF = """\
+[gitosis]
+repositories = {repositories}
+generate-files-in = {generated}
+
+[group readers]
+members = reader
+readonly = foo
+map readonly visible = foo
+
+[group writers]
+members = writer
+writable = foo
+"""
+
+
+@pytest.fixture
+def config_path(tmpdir):
+    repositories = os.path.join(tmpdir, "repositories")
+    generated = os.path.join(tmpdir, "generated")
+    os.makedirs(repositories)
+    os.makedirs(generated)
+    repository.init(os.path.join(repositories, "foo.git"))
+    repository.fast_import(
+        git_dir=os.path.join(repositories, "foo.git"),
+        commit_msg="initial",
+        committer="John Doe <jdoe@example.com>",
+        files=[("README", "hello\n")],
+    )
+    path = os.path.join(tmpdir, "gitosis.conf")
+    write_file(path, CONF.format(repositories=repositories, generated=generated))
+    return path
+
+
+@pytest.fixture
+def app(config_path):
+    return http.Application(config_path)
+
+
+def _request(app, user, path, query="", method="GET", body=b"", protocol=None):
+    environ = {
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "REQUEST_METHOD": method,
+        "CONTENT_TYPE": "application/x-git-upload-pack-request",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+    }
+    if user is not None:
+        environ["REMOTE_USER"] = user
+    if protocol is not None:
+        environ["HTTP_GIT_PROTOCOL"] = protocol
+    setup_testing_defaults(environ)
+    got = {}
+
+    def start_response(status, headers):
+        got["status"] = status
+        got["headers"] = dict(headers)
+
+    body = b"".join(app(environ, start_response))
+    return got["status"], got["headers"], body
+
+
+def test_unauthenticated(app):
+    status, headers, _ = _request(app, None, "/foo.git/info/refs", "service=git-upload-pack")
+    assert status == "401 Unauthorized"
+    assert headers["WWW-Authenticate"] == 'Basic realm="gitosis"'
+
+
+def test_dumb_protocol_refused(app):
+    status, _, _ = _request(app, "reader", "/foo.git/HEAD")
+    assert status == "404 Not Found"
+
+
+def test_unknown_service(app):
+    status, _, _ = _request(app, "reader", "/foo.git/info/refs", "service=git-evil")
+    assert status == "404 Not Found"
+
+
+def test_unsafe_path(app):
+    status, _, _ = _request(app, "reader", "/../foo.git/info/refs", "service=git-upload-pack")
+    assert status == "404 Not Found"
+
+
+def test_no_access(app):
+    status, _, _ = _request(app, "stranger", "/foo.git/info/refs", "service=git-upload-pack")
+    assert status == "404 Not Found"
+
+
+def test_read_only_cannot_push(app):
+    status, _, _ = _request(app, "reader", "/foo.git/info/refs", "service=git-receive-pack")
+    assert status == "403 Forbidden"
+
+
+@pytest.mark.parametrize(("user", "path"), [("reader", "/foo.git"), ("reader", "/visible"), ("writer", "/foo")])
+def test_upload_pack_advertisement(app, user, path):
+    status, headers, body = _request(app, user, f"{path}/info/refs", "service=git-upload-pack")
+    assert status.startswith("200")
+    assert headers["Content-Type"] == "application/x-git-upload-pack-advertisement"
+    assert b"# service=git-upload-pack" in body
+    assert b"refs/heads/master" in body
+
+
+def test_receive_pack_advertisement(app):
+    status, headers, _ = _request(app, "writer", "/foo.git/info/refs", "service=git-receive-pack")
+    assert status.startswith("200")
+    assert headers["Content-Type"] == "application/x-git-receive-pack-advertisement"
+
+
+def test_protocol_version(app, config_path):
+    _, _, body = _request(app, "reader", "/foo.git/info/refs", "service=git-upload-pack", protocol="version=2:x=y")
+    assert b"version 2" in body
+    with open(config_path, "a") as fp:
+        fp.write("\n[repo foo]\nprotocol-version = 0\n")
+    _, _, body = _request(app, "reader", "/foo.git/info/refs", "service=git-upload-pack", protocol="version=2")
+    assert b"version 2" not in body
+    assert b"refs/heads/master" in body
+
+
+def test_upload_pack_request(app):
+    # a request without any wants gets an empty response
+    status, headers, body = _request(app, "reader", "/foo.git/git-upload-pack", method="POST", body=b"0000")
+    assert status.startswith("200")
+    assert headers["Content-Type"] == "application/x-git-upload-pack-result"
+    assert body == b""
+
+
+def test_policy_reloaded(app, tmpdir):
+    status, _, _ = _request(app, "newbie", "/foo.git/info/refs", "service=git-upload-pack")
+    assert status == "404 Not Found"
+    path = os.path.join(tmpdir, "gitosis.conf")
+    with open(path, "a") as fp:
+        fp.write("\n[group newbies]\nmembers = newbie\nreadonly = foo\n")
+    status, _, _ = _request(app, "newbie", "/foo.git/info/refs", "service=git-upload-pack")
+    assert status.startswith("200")
+
+
+def test_check_password():
+    hashed = http.hash_password("s3cret", iterations=1000)
+    assert http.check_password("s3cret", hashed)
+    assert not http.check_password("wrong", hashed)
+    # htpasswd -s
+    assert http.check_password("password", "{SHA}W6ph5Mm5Pz8GgiULbPgzG37mj9g=")
+    assert not http.check_password("password", "$apr1$unsupported")
+
+
+def test_htpasswd(tmpdir):
+    path = os.path.join(tmpdir, "htpasswd")
+    write_file(path, f"# comment\njdoe:{http.hash_password('s3cret', iterations=1000)}\n")
+    auth = http.HtpasswdAuthenticator(path)
+
+    def _basic(credentials):
+        return {"HTTP_AUTHORIZATION": "Basic " + base64.b64encode(credentials.encode()).decode()}
+
+    assert auth(_basic("jdoe:s3cret")) == "jdoe"
+    assert auth(_basic("jdoe:s3cret")) == "jdoe"
+    assert auth(_basic("jdoe:wrong")) is None
+    assert auth(_basic("nobody:s3cret")) is None
+    assert auth({"HTTP_AUTHORIZATION": "Bearer xyz"}) is None
+    assert auth({}) is None
+    write_file(path, "")
+    assert auth(_basic("jdoe:s3cret")) is None
+
+
+def test_htpasswd_unreadable(tmpdir, caplog):
+    path = os.path.join(tmpdir, "htpasswd")
+    auth = http.HtpasswdAuthenticator(path)
+    credentials = {"HTTP_AUTHORIZATION": "Basic " + base64.b64encode(b"jdoe:s3cret").decode()}
+    assert auth(credentials) is None
+    assert auth(credentials) is None
+    assert caplog.text.count("Cannot read") == 1
+    write_file(path, f"jdoe:{http.hash_password('s3cret', iterations=1000)}\n")
+    assert auth(credentials) == "jdoe"
+    os.unlink(path)
+    assert auth(credentials) is None
+
+
+@pytest.fixture
+def snapshot_app(config_path, tmpdir):
+    conf = read_file(config_path).replace(
+        "[gitosis]\n", f"[gitosis]\narchive-cache = {os.path.join(tmpdir, 'cache')}\n"
+    )
+    write_file(config_path, f"{conf}\n[repo foo]\ngitweb = yes\n")
+    return http.SnapshotApplication(config_path)
+
+
+def test_snapshot(snapshot_app, tmpdir):
+    git_dir = os.path.join(tmpdir, "repositories", "foo.git")
+    status, headers, body = _request(snapshot_app, None, "/", "p=foo.git;a=snapshot;h=master;sf=tgz")
+    assert status == "200 OK"
+    assert headers["Content-Type"] == "application/x-gzip"
+    assert headers["Content-Disposition"] == 'attachment; filename="foo-master.tar.gz"'
+    assert body == git(git_dir, "archive", "--format=tgz", "--prefix=foo-master/", "master")
+    assert int(headers["Content-Length"]) == len(body)
+    _request(snapshot_app, None, "/", "p=foo.git;a=snapshot;h=master;sf=tgz")
+    stats = archive.get_cache(snapshot_app.policy.get()).stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_snapshot_full_hash(snapshot_app, tmpdir):
+    git_dir = os.path.join(tmpdir, "repositories", "foo.git")
+    commit = git(git_dir, "rev-parse", "master").decode().strip()
+    status, headers, _ = _request(snapshot_app, None, "/", f"p=foo.git&a=snapshot&h={commit}&sf=zip")
+    assert status == "200 OK"
+    assert headers["Content-Disposition"] == f'attachment; filename="foo-{commit[:7]}.zip"'
+
+
+def test_snapshot_unreachable(snapshot_app, tmpdir):
+    git_dir = os.path.join(tmpdir, "repositories", "foo.git")
+    master = git(git_dir, "rev-parse", "master").decode().strip()
+    tree = git(git_dir, "rev-parse", "master^{tree}").decode().strip()
+    dangling = (
+        git(git_dir, "-c", "user.name=x", "-c", "user.email=x@example.com", "commit-tree", tree, "-m", "secret")
+        .decode()
+        .strip()
+    )
+    status, _, _ = _request(snapshot_app, None, "/", f"p=foo.git;a=snapshot;h={dangling};sf=tgz")
+    assert status == "404 Not Found"
+    status, _, _ = _request(snapshot_app, None, "/", f"p=foo.git;a=snapshot;h={tree};sf=tgz")
+    assert status == "404 Not Found"
+    status, _, _ = _request(snapshot_app, None, "/", f"p=foo.git;a=snapshot;h={master};sf=tgz")
+    assert status == "200 OK"
+
+
+def test_snapshot_filename(snapshot_app, tmpdir):
+    git_dir = os.path.join(tmpdir, "repositories", "foo.git")
+    git(git_dir, "tag", 'v1"x', "master")
+    status, headers, _ = _request(snapshot_app, None, "/", 'p=foo.git;a=snapshot;h=v1"x;sf=tgz')
+    assert status == "200 OK"
+    assert headers["Content-Disposition"] == 'attachment; filename="foo-v1-x.tar.gz"'
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [
+        ("p=foo.git;h=nonexistent", "404 Not Found"),
+        ("p=visible;h=master", "404 Not Found"),
+        ("p=../foo.git;h=master", "404 Not Found"),
+        ("p=foo.git;h=master;sf=tbz2", "400 Bad Request"),
+    ],
+)
+def test_snapshot_refused(snapshot_app, query, expected):
+    status, _, _ = _request(snapshot_app, None, "/", query)
+    assert status == expected
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from gitosis import layout
+
+
+def test_get_layout(cfg):
+    assert layout.get_layout(cfg) == layout.FLAT
+    cfg.set("gitosis", "repository-layout", "sharded")
+    assert layout.get_layout(cfg) == layout.SHARDED
+    cfg.set("gitosis", "repository-layout", "bogus")
+    with pytest.raises(layout.UnknownLayoutError, match="Unknown repository layout: bogus"):
+        layout.get_layout(cfg)
+
+
+def test_get_relpath():
+    # sha1("foo") = 0beec7b5...
+    assert layout.get_relpath(layout.FLAT, "foo") == "foo.git"
+    assert layout.get_relpath(layout.SHARDED, "foo") == os.path.join("0b", "ee", "foo.git")
+
+
+def test_get_path_falls_back(cfg, tmpdir):
+    repositories = os.path.join(tmpdir, "repositories")
+    cfg.set("gitosis", "repository-layout", "sharded")
+    assert layout.get_path(cfg, "foo") == os.path.join(repositories, "0b", "ee", "foo.git")
+    # not migrated yet
+    os.makedirs(os.path.join(repositories, "foo.git"))
+    assert layout.get_path(cfg, "foo") == os.path.join(repositories, "foo.git")
+    assert layout.find(cfg, "foo") == os.path.join(repositories, "foo.git")
+    assert layout.find(cfg, "bar") is None
+
+
+def test_find(cfg, tmpdir):
+    repositories = os.path.join(tmpdir, "repositories")
+    cfg.set("gitosis", "repository-layout", "sharded")
+    path = os.path.join(repositories, "0b", "ee", "foo.git")
+    os.makedirs(path)
+    assert layout.find(cfg, "foo") == path
+    assert layout.find(cfg, "foo.git") == path
+    farm = os.path.join(tmpdir, "farm")
+    os.makedirs(os.path.join(farm, "foo.git"))
+    assert layout.find(cfg, "foo", farm) == os.path.join(farm, "foo.git")
+    assert layout.find(cfg, "bar", farm) is None
+
+
+def test_get_name(cfg, tmpdir):
+    repositories = os.path.join(tmpdir, "repositories")
+    for name in ["foo", "sub/dir/bar"]:
+        for kind in layout.LAYOUTS:
+            path = os.path.join(repositories, layout.get_relpath(kind, name))
+            assert layout.get_name(cfg, path) == name
+    assert layout.get_name(cfg, os.path.join(tmpdir, "elsewhere.git")) is None
+    assert layout.get_name(cfg, os.path.join(repositories, "foo")) is None
+
+
+def test_get_name_looks_like_shard():
+    # a flat name that happens to start like a shard, but not its own
+    assert layout.get_name_from_relpath(os.path.join("ab", "cd", "foo.git")) == "ab/cd/foo"
+
+
+def test_find_repositories(tmpdir):
+    repositories = os.path.join(tmpdir, "repositories")
+    paths = {
+        "foo": os.path.join(repositories, layout.get_relpath(layout.SHARDED, "foo")),
+        "sub/bar": os.path.join(repositories, "sub", "bar.git"),
+        "quux": os.path.join(repositories, "quux.git"),
+    }
+    for path in paths.values():
+        os.makedirs(os.path.join(path, "refs", "nested.git"))
+    assert dict(layout.find_repositories(repositories)) == paths
@@ -0,0 +1,77 @@
+import os
+import random
+
+import pytest
+
+from gitosis import load
+
+from .util import git
+
+
+def test_parse_mix():
+    assert load.parse_mix("read=3, write=1") == {"read": 3, "write": 1}
+    with pytest.raises(load.LoadError, match="Cannot generate load: unknown operation: delete"):
+        load.parse_mix("delete=1")
+    with pytest.raises(load.LoadError, match="bad weight"):
+        load.parse_mix("read=x")
+    with pytest.raises(load.LoadError, match="mix has no operations"):
+        load.parse_mix("read=0")
+
+
+def test_generate():
+    requests = load.generate({"read": 1, "create": 1}, 50, 3, 2, random.Random(1))  # noqa: S311
+    assert len(requests) == 50
+    assert {request.user for request in requests} <= {"user0", "user1", "user2"}
+    created = [request.command for request in requests if request.operation == load.CREATE]
+    assert created == [f"git-receive-pack 'new-{i}.git'" for i in range(len(created))]
+    reads = {request.command for request in requests if request.operation == load.READ}
+    assert reads <= {"git-upload-pack 'repo0.git'", "git-upload-pack 'repo1.git'"}
+
+
+def test_read_trace():
+    requests = load.read_trace(
+        ["# a comment", "", "jdoe git-upload-pack 'foo.git'", "jdoe git receive-pack 'sub/bar'", "jdoe rm -rf /"],
+    )
+    assert requests == [
+        load.Request("jdoe", "git-upload-pack 'foo.git'", load.READ),
+        load.Request("jdoe", "git receive-pack 'sub/bar'", load.WRITE),
+        load.Request("jdoe", "rm -rf /", load.READ),
+    ]
+    assert [load.get_name(request) for request in requests] == ["foo", "sub/bar", None]
+
+
+def test_summarize():
+    assert load.percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.0
+    assert load.percentile([1.0, 2.0, 3.0, 4.0], 99) == 4.0
+    results = [
+        load.Result(load.READ, 0.1, ok=True),
+        load.Result(load.READ, 0.3, ok=True),
+        load.Result(load.WRITE, 0.2, ok=False),
+    ]
+    summary = load.summarize(results, 2.0)
+    assert list(summary) == [load.READ, load.WRITE, "all"]
+    assert summary["all"]["requests"] == 3
+    assert summary["all"]["failed"] == 1
+    assert summary["all"]["throughput"] == 1.5
+    assert summary[load.READ]["p50"] == 0.1
+    assert "p99 ms" in load.format_summary(summary)
+
+
+def test_run(tmpdir):
+    requests = [
+        *load.read_trace(["jdoe git-upload-pack 'foo.git'", "jdoe git-receive-pack 'sub/bar.git'", "jdoe rm -rf /"]),
+        load.Request("jdoe", "git-receive-pack 'new-0.git'", load.CREATE),
+    ]
+    fixture = load.setup_fixture(str(tmpdir), requests)
+    assert os.path.exists(os.path.join(tmpdir, ".ssh", "authorized_keys"))
+    assert not os.path.exists(os.path.join(tmpdir, "repositories", "new-0.git"))
+    results, _ = load.run(fixture, requests, concurrency=2)
+    assert [result.ok for result in results] == [True, True, False, True]
+    # created, but nothing was pushed
+    assert git(os.path.join(tmpdir, "repositories", "new-0.git"), "for-each-ref") == b""
+
+    results, _ = load.run(fixture, requests, concurrency=2, end_to_end=True)
+    assert [result.ok for result in results] == [True, True, False, True]
+    assert git(os.path.join(tmpdir, "repositories", "new-0.git"), "for-each-ref", "--format=%(refname)") == (
+        b"refs/heads/load/3\n"
+    )
@@ -0,0 +1,94 @@
+import configparser
+import io
+import os
+
+import pytest
+
+from gitosis import access, matrix
+
+
+def _config():
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("group hackers")
+    cfg.set("group hackers", "members", "jdoe @smackers")
+    cfg.set("group hackers", "writable", "foo")
+    cfg.set("group hackers", "readonly", "bar")
+    cfg.add_section("group smackers")
+    cfg.set("group smackers", "members", "wsmith")
+    cfg.set("group smackers", "writeable", "baz")
+    cfg.set("group smackers", "map readonly visible", "actual")
+    cfg.add_section("group all")
+    cfg.set("group all", "readonly", "public")
+    return cfg
+
+
+def test_build():
+    perms = matrix.build(_config(), users=["nobody"])
+    assert perms.users == ["@all", "jdoe", "nobody", "wsmith"]
+    assert perms.repos == ["bar", "baz", "foo", "public", "visible"]
+    assert perms.allowed("jdoe", "writable", "foo")
+    assert perms.allowed("jdoe", "readonly", "foo.git")
+    assert not perms.allowed("jdoe", "writable", "bar")
+    assert perms.allowed("wsmith", "writable", "baz")
+    assert perms.allowed("wsmith", "writable", "foo")
+    assert perms.allowed("unlisted", "readonly", "public")
+    assert not perms.allowed("unlisted", "readonly", "foo")
+    assert not perms.allowed("jdoe", "readonly", "nonexistent")
+
+
+def test_queries():
+    perms = matrix.build(_config())
+    assert perms.repos_for("jdoe", "readonly") == ["bar", "foo", "public"]
+    assert perms.repos_for("wsmith", "writable") == ["baz", "foo"]
+    assert perms.users_with("writable", "foo") == ["jdoe", "wsmith"]
+    assert perms.users_with("readonly", "public") == ["@all", "jdoe", "wsmith"]
+    assert perms.users_with("readonly", "nonexistent") == []
+
+
+def test_matches_have_access():
+    cfg = _config()
+    perms = matrix.build(cfg)
+    for user in ["jdoe", "wsmith", "unlisted"]:
+        for repo in perms.repos:
+            can_write = any(access.have_access(cfg, user, mode, repo) for mode in ("writable", "writeable"))
+            can_read = can_write or access.have_access(cfg, user, "readonly", repo) is not None
+            assert perms.allowed(user, "writable", repo) == can_write
+            assert perms.allowed(user, "readonly", repo) == can_read
+
+
+def _same(a, b):
+    assert a.users == b.users
+    assert a.repos == b.repos
+    for user in a.users:
+        for mode in ("writable", "readonly"):
+            assert a.repos_for(user, mode) == b.repos_for(user, mode)
+
+
+def test_json_roundtrip():
+    perms = matrix.build(_config())
+    _same(perms, matrix.PermissionMatrix.from_json(perms.to_json()))
+
+
+def test_binary_roundtrip():
+    perms = matrix.build(_config())
+    fp = io.BytesIO()
+    perms.write_binary(fp)
+    fp.seek(0)
+    _same(perms, matrix.PermissionMatrix.read_binary(fp))
+
+
+def test_binary_truncated():
+    fp = io.BytesIO()
+    matrix.build(_config()).write_binary(fp)
+    with pytest.raises(matrix.MatrixFormatError, match="truncated bitsets"):
+        matrix.PermissionMatrix.read_binary(io.BytesIO(fp.getvalue()[:-1]))
+    with pytest.raises(matrix.MatrixFormatError, match="bad magic"):
+        matrix.PermissionMatrix.read_binary(io.BytesIO(b"X" * 32))
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_save_load(tmpdir, binary):
+    perms = matrix.build(_config())
+    path = os.path.join(tmpdir, "matrix")
+    matrix.save(perms, path, binary=binary)
+    _same(perms, matrix.load(path))
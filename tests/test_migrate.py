@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from gitosis import layout, migrate, repository
+from gitosis.util import read_file
+
+
+@pytest.fixture
+def cfg(cfg, tmpdir):
+    cfg.set("gitosis", "symlink-farm", os.path.join(tmpdir, "farm"))
+    cfg.set("gitosis", "gitweb", "yes")
+    for name in ["foo", "sub/bar", "quux"]:
+        cfg.add_section(f"repo {name}")
+        repository.init(os.path.join(tmpdir, "repositories", f"{name}.git"))
+    return cfg
+
+
+def _physical(tmpdir):
+    repositories = os.path.join(tmpdir, "repositories")
+    for dirpath, dirnames, _ in os.walk(repositories):
+        for dirname in dirnames:
+            # no symlinks are left behind
+            assert not os.path.islink(os.path.join(dirpath, dirname))
+    return dict(layout.find_repositories(repositories))
+
+
+def test_migrate(cfg, tmpdir):
+    repositories = os.path.join(tmpdir, "repositories")
+    cfg.set("gitosis", "repository-layout", "sharded")
+    assert migrate.migrate(cfg, batch_size=2) == 3
+    expected = {
+        name: os.path.join(repositories, layout.get_relpath(layout.SHARDED, name))
+        for name in ["foo", "sub/bar", "quux"]
+    }
+    assert _physical(tmpdir) == expected
+    assert not os.path.exists(os.path.join(repositories, "sub"))
+    for name, path in expected.items():
+        assert os.path.realpath(os.path.join(tmpdir, "farm", f"{name}.git")) == os.path.realpath(path)
+    assert read_file(os.path.join(tmpdir, "generated", "projects.list")) == "foo.git\nsub%2Fbar.git\nquux.git\n"
+    assert migrate.migrate(cfg) == 0
+
+    cfg.set("gitosis", "repository-layout", "flat")
+    assert migrate.migrate(cfg) == 3
+    assert _physical(tmpdir) == {name: os.path.join(repositories, f"{name}.git") for name in expected}
+    assert sorted(os.listdir(repositories)) == ["foo.git", "quux.git", "sub"]
+
+
+def test_migrate_dry_run(cfg, tmpdir):
+    cfg.set("gitosis", "repository-layout", "sharded")
+    assert migrate.migrate(cfg, dry_run=True) == 3
+    assert sorted(os.listdir(os.path.join(tmpdir, "repositories"))) == ["foo.git", "quux.git", "sub"]
+
+
+def test_migrate_existing_destination(cfg, tmpdir):
+    cfg.set("gitosis", "repository-layout", "sharded")
+    os.makedirs(os.path.join(tmpdir, "repositories", layout.get_relpath(layout.SHARDED, "foo")))
+    assert migrate.migrate(cfg) == 2
+    assert os.path.isdir(os.path.join(tmpdir, "repositories", "foo.git"))
@@ -0,0 +1,159 @@
+import os
+
+import pytest
+
+from gitosis import objects, repository
+from gitosis.util import read_file
+
+from .util import git
+
+
+@pytest.fixture
+def git_dir(tmpdir):
+    path = os.path.join(tmpdir, "repo.git")
+    repository.init(path)
+    parent = None
+    for i in range(1, 11):
+        repository.fast_import(
+            git_dir=path,
+            commit_msg=f"commit {i}",
+            committer="John Doe <jdoe@example.com>",
+            files=[
+                ("gitosis.conf", "[gitosis]\n" + "".join(f"[repo r{n}]\ngitweb = yes\n" for n in range(i * 20))),
+                (f"keydir/user{i}.pub", f"ssh-rsa KEY{i} user{i}@example.com\n"),
+            ],
+            parent=parent,
+        )
+        parent = "refs/heads/master^0"
+    return path
+
+
+def _all_objects(git_dir):
+    listing = git(git_dir, "cat-file", "--batch-all-objects", "--batch-check=%(objectname) %(objecttype)")
+    return [line.split() for line in listing.decode().splitlines()]
+
+
+def _check_all_objects(git_dir):
+    found = _all_objects(git_dir)
+    assert len(found) > 30
+    with objects.Repository(git_dir) as repo:
+        for object_id, type_name in found:
+            kind, data = repo.read(object_id)
+            assert objects.TYPE_NAMES[kind] == type_name
+            assert data == git(git_dir, "cat-file", type_name, object_id)
+
+
+def test_read_fast_import(git_dir):
+    _check_all_objects(git_dir)
+
+
+def test_read_ofs_delta(git_dir):
+    git(git_dir, "repack", "-a", "-d", "-f", "-q", "--depth=50")
+    _check_all_objects(git_dir)
+
+
+def test_read_ref_delta(git_dir):
+    git(git_dir, "-c", "repack.useDeltaBaseOffset=false", "repack", "-a", "-d", "-f", "-q", "--depth=50")
+    _check_all_objects(git_dir)
+
+
+def test_read_loose(git_dir):
+    object_id = git(git_dir, "hash-object", "-w", "--stdin", stdin=b"loose\n").decode().strip()
+    with objects.Repository(git_dir) as repo:
+        assert repo.read(object_id) == (objects.OBJ_BLOB, b"loose\n")
+        with pytest.raises(objects.ObjectNotFoundError):
+            repo.read("0" * 40)
+
+
+def test_read_new_pack(git_dir):
+    with objects.Repository(git_dir) as repo:
+        repo.read(repo.resolve("HEAD"))
+        object_id = git(git_dir, "hash-object", "-w", "--stdin", stdin=b"later\n").decode().strip()
+        git(git_dir, "repack", "-a", "-d", "-q")
+        assert repo.read(object_id) == (objects.OBJ_BLOB, b"later\n")
+
+
+def test_alternates(git_dir, tmpdir):
+    borrower = os.path.join(tmpdir, "borrower.git")
+    repository.init(borrower)
+    with open(os.path.join(borrower, "objects", "info", "alternates"), "w") as fp:
+        fp.write(f"{os.path.join(git_dir, 'objects')}\n")
+    head = git(git_dir, "rev-parse", "HEAD").decode().strip()
+    with objects.Repository(borrower) as repo:
+        assert repo.read_file(head, "gitosis.conf").startswith(b"[gitosis]\n")
+
+
+def test_resolve(git_dir):
+    head = git(git_dir, "rev-parse", "HEAD").decode().strip()
+    git(git_dir, "tag", "v1.0", "HEAD~1")
+    with objects.Repository(git_dir) as repo:
+        assert repo.resolve("HEAD") == head
+        assert repo.resolve("master") == head
+        assert repo.resolve("refs/heads/master") == head
+        assert repo.resolve("v1.0") == git(git_dir, "rev-parse", "HEAD~1").decode().strip()
+        assert repo.resolve(head) == head
+        assert repo.resolve("nonexistent") is None
+        assert repo.resolve("../../etc/passwd") is None
+    git(git_dir, "pack-refs", "--all")
+    with objects.Repository(git_dir) as repo:
+        assert repo.resolve("master") == head
+        assert repo.resolve("v1.0") == git(git_dir, "rev-parse", "HEAD~1").decode().strip()
+
+
+def test_resolve_unborn(tmpdir):
+    path = os.path.join(tmpdir, "empty.git")
+    repository.init(path)
+    with objects.Repository(path) as repo:
+        assert repo.resolve("HEAD") is None
+
+
+def test_read_file(git_dir):
+    with objects.Repository(git_dir) as repo:
+        assert repo.read_file("HEAD", "keydir/user3.pub") == b"ssh-rsa KEY3 user3@example.com\n"
+        first = git(git_dir, "rev-parse", "HEAD~9").decode().strip()
+        assert repo.read_file(first, "keydir/user3.pub") is None
+        assert repo.read_file("HEAD", "keydir") is None
+        assert repo.read_file("HEAD", "gitosis.conf/nested") is None
+
+
+def test_get_blob_ids(git_dir):
+    with objects.Repository(git_dir) as repo:
+        ids = repo.get_blob_ids("HEAD", "keydir")
+        assert sorted(ids) == sorted(f"user{i}.pub" for i in range(1, 11))
+        assert ids["user1.pub"] == git(git_dir, "rev-parse", "HEAD:keydir/user1.pub").decode().strip()
+        assert repo.get_blob_ids("HEAD", "missing") == {}
+        assert repo.get_blob_ids("HEAD", "gitosis.conf") == {}
+
+
+def _blob(git_dir, data):
+    return git(git_dir, "hash-object", "-w", "--stdin", stdin=data).decode().strip()
+
+
+def test_export(git_dir, tmpdir):
+    nested = _blob(git_dir, b"nested\n")
+    script = _blob(git_dir, b"#!/bin/sh\n")
+    target = _blob(git_dir, b"run.sh")
+    subtree = git(git_dir, "mktree", stdin=f"100644 blob {nested}\tfile\n".encode()).decode().strip()
+    listing = f"100755 blob {script}\trun.sh\n120000 blob {target}\tlink\n040000 tree {subtree}\tsub\n"
+    tree = git(git_dir, "mktree", stdin=listing.encode()).decode().strip()
+    path = os.path.join(tmpdir, "export")
+    os.makedirs(path)
+    with open(os.path.join(path, "link"), "w") as fp:
+        fp.write("replaced\n")
+    with objects.Repository(git_dir) as repo:
+        repo.export(tree, path)
+    assert sorted(os.listdir(path)) == ["link", "run.sh", "sub"]
+    assert os.readlink(os.path.join(path, "link")) == "run.sh"
+    assert os.access(os.path.join(path, "run.sh"), os.X_OK)
+    assert read_file(os.path.join(path, "sub", "file")) == "nested\n"
+
+
+def test_apply_delta():
+    base = b"hello world\n"
+    # copy 6 bytes from offset 0, then insert "there\n"
+    delta = bytes([len(base), 12, 0x90, 6, 6]) + b"there\n"
+    assert objects.apply_delta(base, delta) == b"hello there\n"
+    with pytest.raises(objects.CorruptObjectError, match="base size mismatch"):
+        objects.apply_delta(b"short", delta)
+    with pytest.raises(objects.CorruptObjectError, match="invalid delta opcode"):
+        objects.apply_delta(base, bytes([len(base), 1, 0]))
@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+
+from gitosis import pool, repository, serve
+from gitosis.util import read_file
+
+from .util import git
+
+
+@pytest.fixture
+def cfg(cfg, tmpdir):
+    cfg.set("gitosis", "object-pools", os.path.join(tmpdir, "pools"))
+    cfg.add_section("group foo")
+    cfg.set("group foo", "members", "jdoe")
+    cfg.set("group foo", "writable", "foo fork fork2")
+    cfg.add_section("repo fork")
+    cfg.set("repo fork", "fork-of", "foo")
+    cfg.add_section("repo fork2")
+    cfg.set("repo fork2", "fork-of", "fork.git")
+    return cfg
+
+
+@pytest.fixture
+def parent(tmpdir):
+    path = os.path.join(tmpdir, "repositories", "foo.git")
+    os.makedirs(os.path.dirname(path))
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg="initial",
+        committer="John Doe <jdoe@example.com>",
+        files=[("README", "hello\n")],
+    )
+    return path
+
+
+def _count_objects(git_dir):
+    output = git(git_dir, "count-objects", "-v").decode()
+    return dict(line.split(": ") for line in output.splitlines())
+
+
+def test_get_ancestors(cfg):
+    assert pool.get_ancestors(cfg, "foo") == []
+    assert pool.get_ancestors(cfg, "fork2") == ["fork", "foo"]
+    assert pool.get_root(cfg, "fork2") == "foo"
+    assert pool.get_networks(cfg) == {"foo": ["foo", "fork", "fork2"]}
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "fork-of", "fork2")
+    with pytest.raises(pool.ForkCycleError, match="Repository is a fork of itself: foo"):
+        pool.get_ancestors(cfg, "foo")
+    assert pool.get_networks(cfg) == {}
+
+
+def test_fork(cfg, parent, tmpdir):
+    path = serve.get_repository_path(cfg, "jdoe", "git-receive-pack", "fork")
+    assert path == os.path.join(tmpdir, "repositories", "fork.git")
+    assert git(path, "rev-parse", "master") == git(parent, "rev-parse", "master")
+    assert git(path, "symbolic-ref", "HEAD") == b"refs/heads/master\n"
+    # nothing was copied into the fork
+    counts = _count_objects(path)
+    assert counts["count"] == counts["packs"] == "0"
+
+    pool_path = os.path.join(tmpdir, "pools", "foo.git")
+    objects = os.path.join(pool_path, "objects")
+    assert read_file(os.path.join(path, "objects", "info", "alternates")) == f"{objects}\n"
+    assert read_file(os.path.join(parent, "objects", "info", "alternates")) == f"{objects}\n"
+    assert json.loads(read_file(os.path.join(pool_path, pool.MEMBERS))) == {"foo": 1, "fork": 2}
+    assert git(pool_path, "config", "pack.islandCore") == b"1\n"
+    assert git(pool_path, "config", "gc.auto") == b"0\n"
+
+    # forks of forks share the same pool
+    path2 = serve.get_repository_path(cfg, "jdoe", "git-receive-pack", "fork2")
+    assert git(path2, "rev-parse", "master") == git(parent, "rev-parse", "master")
+    assert json.loads(read_file(os.path.join(pool_path, pool.MEMBERS))) == {"foo": 1, "fork": 2, "fork2": 3}
+
+
+def test_fork_missing_parent(cfg, tmpdir):
+    path = serve.get_repository_path(cfg, "jdoe", "git-receive-pack", "fork")
+    assert not os.path.exists(os.path.join(path, "objects", "info", "alternates"))
+    assert not os.path.exists(os.path.join(tmpdir, "pools"))
+
+
+def test_parent_gc_is_safe(cfg, parent):
+    path = serve.get_repository_path(cfg, "jdoe", "git-receive-pack", "fork")
+    git(parent, "update-ref", "-d", "refs/heads/master")
+    git(parent, "reflog", "expire", "--expire=now", "--all")
+    git(parent, "gc", "--quiet", "--prune=now")
+    git(path, "fsck", "--connectivity-only")
+
+
+def test_gc(cfg, parent, tmpdir):
+    path = serve.get_repository_path(cfg, "jdoe", "git-receive-pack", "fork")
+    commit = git(parent, "rev-parse", "master").decode().strip()
+    # the parent moves on
+    git(parent, "update-ref", "-d", "refs/heads/master")
+    # the fork disappears, so its refs are dropped
+    os.rename(path, os.path.join(tmpdir, "gone.git"))
+    pool_path = pool.sync(cfg, "foo", ["foo", "fork"])
+    assert json.loads(read_file(os.path.join(pool_path, pool.MEMBERS))) == {"foo": 1}
+    assert git(pool_path, "for-each-ref") == b""
+
+    pool.gc(cfg, "foo", ["foo", "fork"])
+    # unreachable, but not pruned yet
+    git(pool_path, "cat-file", "-e", commit)
@@ -0,0 +1,112 @@
+import dbm
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from gitosis import access, config, group, provider
+
+
+@pytest.fixture
+def cfg(cfg, tmpdir):
+    cfg.set("gitosis", "group-provider", f"json:{os.path.join(tmpdir, 'groups.json')}")
+    cfg.add_section("group hackers")
+    cfg.set("group hackers", "members", "jdoe @contractors")
+    cfg.set("group hackers", "writable", "foo")
+    return cfg
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    started = []
+    monkeypatch.setattr(provider, "_start_refresh", started.append)
+    return started
+
+
+def _write_groups(tmpdir, groups):
+    with open(os.path.join(tmpdir, "groups.json"), "w") as fp:
+        json.dump(groups, fp)
+
+
+def test_get_provider(cfg, tmpdir):
+    assert isinstance(provider.get_provider(cfg), provider.JSONProvider)
+    cfg.set("gitosis", "group-provider", "ldap:whatever")
+    assert provider.get_provider(cfg) is None
+    cfg.remove_option("gitosis", "group-provider")
+    assert provider.get_provider(cfg) is None
+
+    path = os.path.join(tmpdir, "groups.db")
+    with dbm.open(path, "c") as db:
+        db["contractors"] = "wsmith  asmith"
+    assert provider.DBMProvider(path).fetch() == {"contractors": ["wsmith", "asmith"]}
+    with pytest.raises(provider.ProviderError):
+        provider.DBMProvider(os.path.join(tmpdir, "missing.db")).fetch()
+
+    command = f'{sys.executable} -c \'print("{{\\"ops\\": [\\"bob\\"]}}")\''
+    assert provider.CommandProvider(command).fetch() == {"ops": ["bob"]}
+    with pytest.raises(provider.ProviderError, match="Cannot read groups from provider"):
+        provider.CommandProvider("false").fetch()
+    with pytest.raises(provider.ProviderError, match="members of ops aren't a list of strings"):
+        provider.CommandProvider(f'{sys.executable} -c \'print("{{\\"ops\\": 1}}")\'').fetch()
+
+
+def test_refresh(cfg, tmpdir, refreshes):
+    # nothing is read until a refresh, which is started in the background
+    _write_groups(tmpdir, {"contractors": ["wsmith"]})
+    assert provider.get_groups(cfg) == {}
+    assert refreshes == [cfg]
+    # but not again until it's time for a retry
+    assert provider.get_groups(cfg) == {}
+    assert len(refreshes) == 1
+
+    assert provider.refresh(cfg)
+    assert provider.get_groups(cfg) == {"contractors": ["wsmith"]}
+    assert len(refreshes) == 1
+
+    # a failing provider leaves the snapshot alone
+    os.unlink(os.path.join(tmpdir, "groups.json"))
+    assert not provider.refresh(cfg)
+    assert provider.get_groups(cfg) == {"contractors": ["wsmith"]}
+
+
+def test_refresh_when_stale(cfg, tmpdir, refreshes):
+    _write_groups(tmpdir, {"contractors": ["wsmith"]})
+    assert provider.refresh(cfg)
+    path = provider.get_snapshot_path(cfg)
+    stale = time.time() - provider.DEFAULT_RETRY - 1
+    os.utime(f"{path}.lock", (stale, stale))
+    cfg.set("gitosis", "group-provider-ttl", "0")
+    # the stale snapshot is still used while it's refreshed
+    assert provider.get_groups(cfg) == {"contractors": ["wsmith"]}
+    assert refreshes == [cfg]
+
+
+@pytest.mark.usefixtures("refreshes")
+def test_membership(cfg, tmpdir):
+    _write_groups(tmpdir, {"contractors": ["wsmith"], "hackers": ["asmith"], "other": ["@hackers"]})
+    assert provider.refresh(cfg)
+    assert list(group.get_membership(cfg, "wsmith")) == ["contractors", "hackers", "other", "all"]
+    assert list(group.get_membership(cfg, "asmith")) == ["hackers", "other", "all"]
+    closure = group.get_membership_closure(cfg, ["nobody"])
+    assert closure["wsmith"] == ("contractors", "hackers", "other", "all")
+    assert closure["jdoe"] == ("hackers", "other", "all")
+    assert closure["nobody"] == ("all",)
+    assert access.have_access(cfg, "wsmith", "writable", "foo") == (os.path.join(tmpdir, "repositories"), "foo")
+
+
+def test_start_refresh(cfg, tmpdir):
+    _write_groups(tmpdir, {"contractors": ["wsmith"]})
+    path = os.path.join(tmpdir, "gitosis.conf")
+    with open(path, "w") as fp:
+        cfg.write(fp)
+    lazy = config.LazyConfigParser(interpolation=None)
+    lazy.read(path)
+    provider._start_refresh(lazy)
+    snapshot = provider.get_snapshot_path(cfg)
+    deadline = time.monotonic() + 30
+    while not os.path.exists(snapshot) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    with open(snapshot) as fp:
+        assert json.load(fp)["groups"] == {"contractors": ["wsmith"]}
@@ -0,0 +1,125 @@
+import io
+import os
+
+import pytest
+
+from gitosis import hooks, readme, repository
+from gitosis.util import read_file
+
+from .util import git
+
+
+@pytest.fixture
+def cfg(cfg):
+    cfg.set("gitosis", "readme-html", "yes")
+    cfg.add_section("repo quux")
+    cfg.set("repo quux", "readme-html", "no")
+    return cfg
+
+
+def _make_repo(tmpdir, name, files):
+    path = os.path.join(tmpdir, "repositories", f"{name}.git")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    repository.init(path)
+    if files:
+        repository.fast_import(
+            git_dir=path,
+            commit_msg="initial",
+            committer="John Doe <jdoe@example.com>",
+            files=files,
+        )
+    return path
+
+
+def test_get_renderer(monkeypatch):
+    monkeypatch.setattr(readme, "_is_available", lambda module: module in ("markdown", "nh3"))
+    assert readme.get_renderer("README.md") == "markdown"
+    assert readme.get_renderer("README.rst") == "plain"
+    assert readme.get_renderer("README") == "plain"
+    # nothing is rendered that can't be cleaned up
+    monkeypatch.setattr(readme, "_is_available", lambda module: module == "markdown")
+    assert readme.get_renderer("README.md") == "plain"
+
+
+def test_update(tmpdir, monkeypatch):
+    monkeypatch.setattr(readme, "_is_available", lambda module: False)  # noqa: ARG005
+    path = _make_repo(tmpdir, "foo", [("README", "<b>hi</b> & bye\n"), ("README.old", "not this one\n")])
+    output = os.path.join(path, readme.OUTPUT)
+    assert readme.update(path)
+    assert read_file(output) == "<pre>&lt;b&gt;hi&lt;/b&gt; &amp; bye\n</pre>\n"
+    # nothing changed, so nothing is rendered
+    os.utime(output, (0, 0))
+    assert not readme.update(path)
+    assert os.stat(output).st_mtime == 0
+    assert readme.update(path, force=True)
+
+    repository.fast_import(
+        git_dir=path,
+        commit_msg="readme",
+        committer="John Doe <jdoe@example.com>",
+        files=[("README.rst", "changed\n")],
+        parent="refs/heads/master^0",
+    )
+    assert readme.update(path)
+    assert read_file(output) == "<pre>changed\n</pre>\n"
+
+    git(path, "update-ref", "-d", "refs/heads/master")
+    assert not readme.update(path)
+    assert not os.path.exists(output)
+    assert not os.path.exists(os.path.join(path, readme.STAMP))
+
+
+def test_update_leaves_other_readme_alone(tmpdir):
+    path = _make_repo(tmpdir, "foo", [])
+    with open(os.path.join(path, readme.OUTPUT), "w") as fp:
+        fp.write("written by hand")
+    assert not readme.update(path)
+    assert read_file(os.path.join(path, readme.OUTPUT)) == "written by hand"
+
+
+def test_render_markdown(tmpdir):
+    pytest.importorskip("markdown")
+    pytest.importorskip("nh3")
+    text = "# Title\n\n<script>x</script>\n\n[a](javascript:alert(1)) [b](https://example.com/) [c](docs/)\n"
+    path = _make_repo(tmpdir, "foo", [("README.md", text)])
+    assert readme.update(path)
+    rendered = read_file(os.path.join(path, readme.OUTPUT))
+    assert "<h1>Title</h1>" in rendered
+    assert "<script>" not in rendered
+    assert "javascript:" not in rendered
+    assert 'href="https://example.com/"' in rendered
+    assert 'href="docs/"' in rendered
+
+
+def test_render_rst(tmpdir):
+    pytest.importorskip("docutils")
+    pytest.importorskip("nh3")
+    text = "Title\n=====\n\n.. raw:: html\n\n   <script>x</script>\n\n`x <javascript:alert(1)>`_ `y <mailto:a@example.com>`_\n"
+    path = _make_repo(tmpdir, "foo", [("README.rst", text)])
+    assert readme.update(path)
+    rendered = read_file(os.path.join(path, readme.OUTPUT))
+    assert "Title" in rendered
+    assert "<script>" not in rendered
+    assert "javascript:" not in rendered
+    assert 'href="mailto:a@example.com"' in rendered
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_update_all(cfg, tmpdir, workers):
+    cfg.set("gitosis", "readme-workers", workers)
+    for name in ("foo", "bar", "sub/baz", "quux"):
+        _make_repo(tmpdir, name, [("README", f"{name}\n")])
+    _make_repo(tmpdir, "empty", [])
+    assert readme.update_all(cfg) == 3
+    assert read_file(os.path.join(tmpdir, "repositories", "sub", "baz.git", readme.OUTPUT)) == "<pre>sub/baz\n</pre>\n"
+    assert not os.path.exists(os.path.join(tmpdir, "repositories", "quux.git", readme.OUTPUT))
+    assert readme.update_all(cfg) == 0
+    assert readme.update_all(cfg, force=True) == 3
+
+
+def test_plugin(cfg, tmpdir):
+    path = _make_repo(tmpdir, "foo", [("README", "hello\n")])
+    assert [plugin.name for plugin in hooks.get_enabled(cfg, "foo")] == ["readme"]
+    assert hooks.get_enabled(cfg, "quux") == []
+    hooks.dispatch(cfg, "gitosis.conf", hooks.POST_RECEIVE, path, [], io.StringIO())
+    assert read_file(os.path.join(path, readme.OUTPUT)) == "<pre>hello\n</pre>\n"
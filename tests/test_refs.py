@@ -0,0 +1,145 @@
+import io
+import os
+import subprocess
+
+import pytest
+
+from gitosis import hooks, refs, repository, serve
+
+OLD = "0" * 40
+NEW = "1" * 40
+
+
+@pytest.fixture
+def cfg(cfg):
+    cfg.add_section("group devs")
+    cfg.set("group devs", "members", "jdoe wsmith")
+    cfg.set("group devs", "writable", "foo")
+    cfg.set("group devs", "map writable bar", "elsewhere")
+    cfg.set("group devs", "refs writable", "refs/heads/feature/* refs/heads/fix/*")
+    cfg.set("group devs", "refs deny", "refs/heads/feature/frozen")
+    cfg.add_section("group releasers")
+    cfg.set("group releasers", "members", "wsmith")
+    cfg.set("group releasers", "writable", "foo")
+    cfg.set("group releasers", "refs writable", "refs/tags/*")
+    cfg.add_section("group admins")
+    cfg.set("group admins", "members", "root")
+    cfg.set("group admins", "writable", "foo")
+    return cfg
+
+
+def test_rule():
+    rule = refs.Rule(["refs/heads/*"], ["refs/heads/master", "refs/heads/release-*"])
+    assert rule.permits("refs/heads/topic")
+    assert rule.permits("refs/heads/a/b")
+    assert not rule.permits("refs/heads/master")
+    assert not rule.permits("refs/heads/release-1")
+    assert not rule.permits("refs/tags/v1")
+    assert refs.Rule([], ["refs/tags/*"]).permits("refs/heads/master")
+
+
+def test_check(cfg, tmpdir):
+    assert refs.has_rules(cfg)
+    foo = os.path.join(tmpdir, "repositories", "foo.git")
+    pushed = ["refs/heads/feature/x", "refs/heads/feature/frozen", "refs/heads/master", "refs/tags/v1"]
+    assert refs.check(cfg, "jdoe", foo, pushed) == ["refs/heads/feature/frozen", "refs/heads/master", "refs/tags/v1"]
+    # groups add up
+    assert refs.check(cfg, "wsmith", foo, pushed) == ["refs/heads/feature/frozen", "refs/heads/master"]
+    # a group without rules can push anything
+    assert refs.check(cfg, "root", foo, pushed) == []
+    # rules follow maps to the physical repository
+    elsewhere = os.path.join(tmpdir, "repositories", "elsewhere.git")
+    assert refs.check(cfg, "jdoe", elsewhere, pushed) == [
+        "refs/heads/feature/frozen",
+        "refs/heads/master",
+        "refs/tags/v1",
+    ]
+    # a repository none of the user's groups can write to can't be told
+    with pytest.raises(refs.UnknownRepositoryError):
+        refs.check(cfg, "jdoe", os.path.join(tmpdir, "repositories", "bar.git"), pushed)
+
+
+def test_check_group_repositories(cfg, tmpdir):
+    cfg.set("group releasers", "repositories", os.path.join(tmpdir, "releases"))
+    cfg.set("group releasers", "writable", "foo")
+    cfg.set("group releasers", "refs writable", "refs/heads/*")
+    foo = os.path.join(tmpdir, "releases", "foo.git")
+    assert refs.check(cfg, "wsmith", foo, ["refs/heads/master", "refs/tags/v1"]) == ["refs/tags/v1"]
+
+
+def test_check_many_refs(cfg, tmpdir):
+    foo = os.path.join(tmpdir, "repositories", "foo.git")
+    pushed = [f"refs/heads/feature/{i}" for i in range(10000)]
+    assert refs.check(cfg, "jdoe", foo, pushed) == []
+
+
+def test_plugin(cfg, tmpdir, monkeypatch):
+    git_dir = os.path.join(tmpdir, "repositories", "foo.git")
+    repository.init(git_dir)
+    hooks.install_all(cfg)
+    assert os.path.exists(os.path.join(git_dir, "hooks", "pre-receive"))
+
+    def _push(ref):
+        stdin = io.StringIO(f"{OLD} {NEW} {ref}\n")
+        hooks.dispatch(cfg, "gitosis.conf", hooks.PRE_RECEIVE, git_dir, [], stdin)
+
+    # pushes made on the server aren't restricted
+    monkeypatch.delenv("GITOSIS_USER", raising=False)
+    _push("refs/heads/master")
+    monkeypatch.setenv("GITOSIS_USER", "jdoe")
+    _push("refs/heads/feature/x")
+    with pytest.raises(hooks.HookRejectedError, match="Push rejected: jdoe may not push to refs/heads/master"):
+        _push("refs/heads/master")
+
+
+def test_plugin_group_repositories(cfg, tmpdir, monkeypatch):
+    cfg.set("group releasers", "repositories", os.path.join(tmpdir, "releases"))
+    git_dir = os.path.join(tmpdir, "releases", "foo.git")
+    repository.init(git_dir)
+    monkeypatch.setenv("GITOSIS_USER", "wsmith")
+    stdin = io.StringIO(f"{OLD} {NEW} refs/heads/master\n")
+    with pytest.raises(hooks.HookRejectedError, match="may not push to refs/heads/master"):
+        hooks.dispatch(cfg, "gitosis.conf", hooks.PRE_RECEIVE, git_dir, [], stdin)
+    stdin = io.StringIO(f"{OLD} {NEW} refs/heads/master\n")
+    monkeypatch.setenv("GITOSIS_USER", "jdoe")
+    with pytest.raises(hooks.HookRejectedError, match="Cannot tell which repository"):
+        hooks.dispatch(cfg, "gitosis.conf", hooks.PRE_RECEIVE, git_dir, [], stdin)
+
+
+def _push(git_dir, url, ref, user):
+    env = {**os.environ, "GITOSIS_USER": user}
+    return subprocess.run(  # noqa: S603
+        ["git", f"--git-dir={git_dir}", "push", "--quiet", url, f"master:{ref}"],  # noqa: S607
+        env=env,
+        capture_output=True,
+        check=False,
+    )
+
+
+def test_push_group_repositories(cfg, tmpdir, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmpdir))
+    cfg.set("group releasers", "members", "rsmith")
+    cfg.set("group releasers", "repositories", os.path.join(tmpdir, "releases"))
+    with open(os.path.join(tmpdir, ".gitosis.conf"), "w") as fp:
+        cfg.write(fp)
+    git_dir = os.path.join(tmpdir, "releases", "foo.git")
+    assert serve.serve(cfg, "rsmith", "git-receive-pack 'foo'") == f"git-receive-pack '{git_dir}'"
+    assert os.path.exists(os.path.join(git_dir, "hooks", "pre-receive"))
+
+    source = os.path.join(tmpdir, "source.git")
+    repository.init(source)
+    repository.fast_import(
+        git_dir=source,
+        commit_msg="initial",
+        committer="Mr. Unit Test <unit.test@example.com>",
+        files=[("foo", "bar\n")],
+    )
+    result = _push(source, git_dir, "refs/heads/master", "rsmith")
+    assert result.returncode != 0
+    assert b"rsmith may not push to refs/heads/master" in result.stderr
+    assert _push(source, git_dir, "refs/tags/v1", "rsmith").returncode == 0
+
+    # install_all covers the group's directory too
+    os.unlink(os.path.join(git_dir, "hooks", "pre-receive"))
+    hooks.install_all(cfg)
+    assert _push(source, git_dir, "refs/heads/master", "rsmith").returncode != 0
@@ -0,0 +1,185 @@
+import os
+
+import pytest
+
+from gitosis import hooks, replicate, repository, serve
+
+from .util import git
+
+
+@pytest.fixture
+def cfg(cfg, tmpdir):
+    cfg.set("gitosis", "replicas", f"{os.path.join(tmpdir, 'one')} {os.path.join(tmpdir, 'two')}")
+    cfg.set("gitosis", "replicate-backoff", "0")
+    return cfg
+
+
+@pytest.fixture
+def primary(tmpdir):
+    path = os.path.join(tmpdir, "repositories", "foo.git")
+    os.makedirs(os.path.dirname(path))
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg="initial",
+        committer="John Doe <jdoe@example.com>",
+        files=[("README", "hello\n")],
+    )
+    return path
+
+
+def _refs(git_dir):
+    return git(git_dir, "for-each-ref", "--format=%(refname) %(objectname)").decode()
+
+
+def test_is_local():
+    assert replicate.is_local("/srv/git")
+    assert replicate.is_local("replicas")
+    assert replicate.is_local("./with:colon")
+    assert not replicate.is_local("ssh://mirror/srv/git")
+    assert not replicate.is_local("mirror:srv/git")
+
+
+def test_get_replicas(cfg, tmpdir):
+    assert replicate.get_replicas(cfg, "foo/bar") == [
+        os.path.join(tmpdir, "one", "foo/bar.git"),
+        os.path.join(tmpdir, "two", "foo/bar.git"),
+    ]
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "replicas", "ssh://mirror/srv/git/")
+    assert replicate.get_replicas(cfg, "foo") == ["ssh://mirror/srv/git/foo.git"]
+    cfg.set("repo foo", "replicas", "")
+    assert replicate.get_replicas(cfg, "foo") == []
+
+
+def test_get_name(cfg, tmpdir):
+    assert replicate.get_name(cfg, os.path.join(tmpdir, "repositories", "foo", "bar.git")) == "foo/bar"
+    assert replicate.get_name(cfg, os.path.join(tmpdir, "elsewhere.git")) is None
+
+
+def test_queue_updates(cfg, primary):
+    assert not replicate.queue_updates(cfg, primary, [])
+    assert replicate.queue_updates(cfg, primary, ["refs/heads/master"])
+    spool = replicate.Spool(replicate.get_spool_dir(cfg))
+    assert spool.names() == ["foo"]
+    assert spool.refs("foo", spool.entries("foo")) == ["refs/heads/master"]
+
+
+def test_queue_updates_without_replicas(cfg, primary):
+    cfg.set("gitosis", "replicas", "")
+    assert not replicate.queue_updates(cfg, primary, ["refs/heads/master"])
+
+
+def test_replicate(cfg, primary, tmpdir):
+    spool = replicate.Spool(replicate.get_spool_dir(cfg))
+    spool.enqueue("foo", ["refs/heads/master"])
+    assert replicate.run(cfg)
+    for replica in ["one", "two"]:
+        assert _refs(os.path.join(tmpdir, replica, "foo.git")) == _refs(primary)
+    assert spool.names() == []
+    assert spool.lag("foo", os.path.join(tmpdir, "one", "foo.git")) == 0.0
+
+
+def test_replicate_batches(cfg, primary, tmpdir, monkeypatch):
+    git(primary, "branch", "topic", "master")
+    spool = replicate.Spool(replicate.get_spool_dir(cfg))
+    spool.enqueue("foo", ["refs/heads/master"])
+    spool.enqueue("foo", ["refs/heads/topic", "refs/heads/master"])
+    pushes = []
+    real_push = replicate.push
+
+    def push(git_dir, location, refs, **kwargs):
+        pushes.append((location, refs))
+        return real_push(git_dir, location, refs, **kwargs)
+
+    monkeypatch.setattr(replicate, "push", push)
+    assert replicate.replicate(cfg)
+    assert sorted(pushes) == [
+        (os.path.join(tmpdir, "one", "foo.git"), ["refs/heads/master", "refs/heads/topic"]),
+        (os.path.join(tmpdir, "two", "foo.git"), ["refs/heads/master", "refs/heads/topic"]),
+    ]
+
+    # deleted refs are deleted from the replicas
+    git(primary, "branch", "-D", "topic")
+    spool.enqueue("foo", ["refs/heads/topic"])
+    assert replicate.replicate(cfg)
+    assert "refs/heads/topic" not in _refs(os.path.join(tmpdir, "one", "foo.git"))
+
+
+@pytest.mark.usefixtures("primary")
+def test_replicate_failure(cfg, tmpdir):
+    good = os.path.join(tmpdir, "one")
+    cfg.set("gitosis", "replicas", f"{good} file://{tmpdir}/missing")
+    cfg.set("gitosis", "replicate-retries", "1")
+    spool = replicate.Spool(replicate.get_spool_dir(cfg))
+    entry = spool.enqueue("foo", ["refs/heads/master"])
+    assert not replicate.replicate(cfg)
+    bad = f"file://{tmpdir}/missing/foo.git"
+    state = spool.read_state("foo")
+    assert state[bad]["failures"] == 1
+    assert "last_error" in state[bad]
+    assert state[os.path.join(good, "foo.git")]["done"] == entry
+    # kept for the replica that failed
+    assert spool.entries("foo") == [entry]
+    assert spool.lag("foo", bad) > 0
+    assert spool.lag("foo", os.path.join(good, "foo.git")) == 0.0
+
+    # replicas removed from the configuration no longer hold updates back
+    cfg.set("gitosis", "replicas", good)
+    assert replicate.replicate(cfg)
+    assert spool.names() == []
+    assert list(spool.read_state("foo")) == [os.path.join(good, "foo.git")]
+
+
+@pytest.mark.usefixtures("primary")
+def test_run_locked(cfg, tmpdir):
+    spool = replicate.Spool(replicate.get_spool_dir(cfg))
+    spool.enqueue("foo", ["refs/heads/master"])
+    with spool.locked() as locked:
+        assert locked
+        assert replicate.run(cfg)
+    assert spool.names() == ["foo"]
+    assert not os.path.exists(os.path.join(tmpdir, "one", "foo.git"))
+
+
+def test_choose_read_path(cfg, primary, tmpdir, monkeypatch):
+    one = os.path.join(tmpdir, "one", "foo.git")
+    assert replicate.choose_read_path(cfg, primary) == primary
+    cfg.set("gitosis", "replica-reads", "yes")
+    monkeypatch.setattr(os, "getpid", lambda: 1)
+    # never replicated, so not up to date
+    assert replicate.choose_read_path(cfg, primary) == primary
+
+    spool = replicate.Spool(replicate.get_spool_dir(cfg))
+    spool.enqueue("foo", ["refs/heads/master"])
+    replicate.replicate(cfg)
+    assert replicate.choose_read_path(cfg, primary) == one
+
+    # behind again
+    spool.enqueue("foo", ["refs/heads/master"])
+    assert replicate.choose_read_path(cfg, primary) == primary
+
+
+def test_serve_routes_reads(cfg, primary, tmpdir, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmpdir))
+    cfg.set("gitosis", "replica-reads", "yes")
+    cfg.add_section("group foo")
+    cfg.set("group foo", "members", "jdoe")
+    cfg.set("group foo", "writable", "foo")
+    cfg.set("gitosis", "repositories", "repositories")
+    spool = replicate.Spool(replicate.get_spool_dir(cfg))
+    spool.enqueue("foo", ["refs/heads/master"])
+    replicate.replicate(cfg)
+    monkeypatch.setattr(os, "getpid", lambda: 1)
+    one = os.path.join(tmpdir, "one", "foo.git")
+    assert serve.serve(cfg, "jdoe", "git-upload-pack 'foo'") == f"git-upload-pack '{one}'"
+    assert serve.serve(cfg, "jdoe", "git-receive-pack 'foo'") == f"git-receive-pack '{primary}'"
+
+
+def test_install_hooks(cfg, primary):
+    cfg.add_section("repo foo")
+    hooks.install_all(cfg)
+    hook = os.path.join(primary, "hooks", replicate.HOOK)
+    assert os.access(hook, os.X_OK)
+    with open(hook) as fp:
+        assert "gitosis-run-hook post-receive" in fp.read()
@@ -336,3 +336,41 @@ def test_fast_import_parent(tmpdir):
         path=export,
     )
     assert sorted(os.listdir(export)) == sorted(["foo", "quux"])
+
+
+def test_init_hooks(tmpdir):
+    path = os.path.join(tmpdir, "repo.git")
+    repository.init(path, hooks=["post-receive"])
+    hook = os.path.join(path, "hooks", "post-receive")
+    check_mode(hook, 0o755, is_file=True)
+    assert read_file(hook) == '#!/bin/sh\nexec gitosis-run-hook post-receive "$@"\n'
+
+
+def test_install_hook_upgrades_own_hook(tmpdir):
+    path = os.path.join(tmpdir, "repo.git")
+    repository.init(path)
+    hook = os.path.join(path, "hooks", "post-receive")
+    write_file(hook, "#!/bin/sh\nexec gitosis-run-hook post-receive\n")
+    assert repository.install_hook(path, "post-receive")
+    assert read_file(hook) == '#!/bin/sh\nexec gitosis-run-hook post-receive "$@"\n'
+
+
+def test_install_hook_leaves_other_hook_alone(tmpdir, caplog):
+    path = os.path.join(tmpdir, "repo.git")
+    repository.init(path)
+    hook = os.path.join(path, "hooks", "post-receive")
+    write_file(hook, "#!/bin/sh\nexec send-mail\n")
+    assert not repository.install_hook(path, "post-receive")
+    assert read_file(hook) == "#!/bin/sh\nexec send-mail\n"
+    assert "Not replacing hook" in caplog.text
+
+
+def test_run_git(tmpdir):
+    class CustomError(repository.GitError):
+        """custom"""
+
+    path = os.path.join(tmpdir, "repo.git")
+    repository.init(path)
+    assert repository.run_git("git", path, "rev-parse", "--is-bare-repository") == "true\n"
+    with pytest.raises(CustomError, match="custom: .*"):
+        repository.run_git("git", path, "rev-parse", "--verify", "nonexistent", error=CustomError)
@@ -1,7 +1,7 @@
 import configparser
 import os
 
-from gitosis import init, repository, run_hook
+from gitosis import generation, init, objects, repository, run_hook
 from gitosis.util import read_file
 
 
@@ -78,7 +78,22 @@ description = blah blah
         git_dir=admin_repository,
     )
     assert read_file(os.path.join(repos, "forweb.git", "description")) == "blah blah\n"
-    assert os.listdir(generated) == ["projects.list"]
+    assert sorted(os.listdir(generated)) == ["current", "generations", "key-cache.json", "projects.list"]
+    assert os.readlink(os.path.join(generated, "projects.list")) == "current/projects.list"
+    current = os.path.realpath(os.path.join(generated, "current"))
+    assert sorted(os.listdir(current)) == [
+        ".gitosis.conf.idx",
+        "authorized_keys",
+        "commit",
+        "gitosis.conf",
+        "grants.json",
+        "keydir",
+        "projects.list",
+    ]
+    with objects.Repository(admin_repository) as admin:
+        assert read_file(os.path.join(current, "commit")) == f"{admin.resolve('HEAD')}\n"
+    assert os.path.realpath(os.path.join(admin_repository, "gitosis.conf")) == os.path.join(current, "gitosis.conf")
+    assert not os.path.exists(os.path.join(admin_repository, "gitosis-export"))
     assert (
         read_file(os.path.join(generated, "projects.list"))
         == """\
@@ -93,3 +108,12 @@ forweb.git John+Doe
         'command="gitosis-serve jdoe",no-port-forwarding,no-X11-forwarding,no-agent-forwarding,no-pty ssh-somealgo 0123456789ABCDEFBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB= jdoe@host.example.com\n'
         in got
     ), f"SSH authorized_keys line for jdoe not found: {got!r}"
+
+    # HEAD hasn't moved, so the export is reused
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+    assert os.path.realpath(os.path.join(generated, "current")) != current
+    assert os.path.samefile(
+        os.path.join(generated, "current", "gitosis.conf"),
+        os.path.join(current, "gitosis.conf"),
+    )
+    assert generation.get_commit(generated) == read_file(os.path.join(current, "commit")).strip()
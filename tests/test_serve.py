@@ -6,7 +6,7 @@ import tempfile
 
 import pytest
 
-from gitosis import repository, serve, util
+from gitosis import generation, repository, serve, util
 
 from .util import check_mode
 
@@ -290,6 +290,36 @@ def test_push_inits_if_needed(tmpdir):
     assert os.path.isfile(os.path.join(repositories, "foo.git", "HEAD"))
 
 
+def test_push_inits_if_needed_sharded(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    repositories = os.path.join(tmpdir, "repositories")
+    os.mkdir(repositories)
+    cfg.set("gitosis", "repositories", repositories)
+    cfg.set("gitosis", "repository-layout", "sharded")
+    generated = os.path.join(tmpdir, "generated")
+    os.mkdir(generated)
+    cfg.set("gitosis", "generate-files-in", generated)
+    cfg.add_section("group foo")
+    cfg.set("group foo", "members", "jdoe")
+    cfg.set("group foo", "writable", "foo")
+    cfg.add_section("repo foo")
+    cfg.set("repo foo", "gitweb", "yes")
+    cfg.set("repo foo", "description", "foodesc")
+    got = serve.serve(
+        cfg=cfg,
+        user="jdoe",
+        command="git-receive-pack 'foo'",
+    )
+    # sha1("foo") starts with 0beec7b5
+    path = os.path.join(repositories, "0b", "ee", "foo.git")
+    assert got == f"git-receive-pack '{path}'"
+    assert os.path.isfile(os.path.join(path, "HEAD"))
+    assert util.read_file(os.path.join(path, "description")) == "foodesc\n"
+    assert util.read_file(os.path.join(generated, "projects.list")) == "foo.git\n"
+    check_mode(os.path.join(repositories, "0b"), 0o750, is_dir=True)
+
+
 def test_push_inits_if_needed_have_extension(tmpdir):
     # a push to a non-existent repository (but where config authorizes
     # you to do that) will create the repository on the fly
@@ -542,3 +572,45 @@ def test_typo_writeable(tmpdir):
     assert got == f"git-receive-pack '{tmpdir}/foo.git'"
     handler.flush()
     assert buf.getvalue() == 'Repository "foo" config has typo: "writeable", should be "writable"\n'
+
+
+def test_parse_command():
+    assert serve.parse_command("git upload-archive '/foo.git'") == ("git upload-archive", "foo.git")
+    assert serve.parse_command("git-receive-pack 'foo/bar'") == ("git-receive-pack", "foo/bar")
+    with pytest.raises(serve.UnsafeArgumentsError):
+        serve.parse_command("git upload-archive '../foo'")
+
+
+def _info_config(tmpdir):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    cfg.set("gitosis", "repositories", str(tmpdir))
+    cfg.set("gitosis", "generate-files-in", os.path.join(tmpdir, "generated"))
+    cfg.add_section("group foo")
+    cfg.set("group foo", "members", "jdoe")
+    cfg.set("group foo", "readonly", "foo bar")
+    cfg.set("group foo", "map writable quux", "real/quux")
+    cfg.add_section("group bar")
+    cfg.set("group bar", "members", "@foo")
+    cfg.set("group bar", "writeable", "bar")
+    cfg.add_section("group other")
+    cfg.set("group other", "members", "wsmith")
+    cfg.set("group other", "writable", "secret")
+    return cfg
+
+
+def test_info(tmpdir):
+    cfg = _info_config(tmpdir)
+    assert serve.info(cfg, "jdoe", "info") == "R W  bar\nR    foo\nR W  quux -> real/quux\n"
+    assert serve.info(cfg, "jdoe", "info q* fo?") == "R    foo\nR W  quux -> real/quux\n"
+    assert serve.info(cfg, "nobody", "info") == ""
+    with pytest.raises(serve.UnknownCommandError):
+        serve.info(cfg, "jdoe", "infox")
+
+
+def test_info_uses_generation(tmpdir):
+    cfg = _info_config(tmpdir)
+    generation.regenerate(cfg)
+    # the precomputed grants are used rather than the configuration
+    cfg.set("group foo", "readonly", "foo bar baz")
+    assert serve.info(cfg, "jdoe", "info b*") == "R W  bar\n"
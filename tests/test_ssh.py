@@ -197,3 +197,83 @@ command="gitosis-serve jdoe",no-port-forwarding,\
 no-X11-forwarding,no-agent-forwarding,no-pty {KEY_1}
 """
     )
+
+
+def test_read_keys_skips_blank_and_comments(tmpdir):
+    keydir = os.path.join(tmpdir, "keys")
+    os.makedirs(keydir)
+    write_file(os.path.join(keydir, "jdoe.pub"), f"# laptop\n{KEY_1}\r\n\n")
+    assert list(ssh.read_keys(keydir=keydir)) == [("jdoe", KEY_1)]
+
+
+def test_key_cache(tmpdir):
+    keydir = os.path.join(tmpdir, "keys")
+    os.makedirs(keydir)
+    write_file(os.path.join(keydir, "jdoe.pub"), KEY_1 + "\n")
+    write_file(os.path.join(keydir, "wsmith.pub"), KEY_2 + "\n")
+    path = os.path.join(tmpdir, "cache", "keys.json")
+
+    cache = ssh.KeyCache(path)
+    assert sorted(cache.read_keys(keydir)) == [("jdoe", KEY_1), ("wsmith", KEY_2)]
+    assert (cache.hits, cache.misses) == (0, 2)
+    cache.save()
+
+    cache = ssh.KeyCache(path)
+    write_file(os.path.join(keydir, "wsmith.pub"), KEY_1 + "\n")
+    os.unlink(os.path.join(keydir, "jdoe.pub"))
+    write_file(os.path.join(keydir, "fred.pub"), KEY_2 + "\n")
+    assert sorted(cache.read_keys(keydir)) == [("fred", KEY_2), ("wsmith", KEY_1)]
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert sorted(cache.entries) == ["fred.pub", "wsmith.pub"]
+
+
+def test_key_cache_ids(tmpdir):
+    keydir = os.path.join(tmpdir, "keys")
+    os.makedirs(keydir)
+    write_file(os.path.join(keydir, "jdoe.pub"), KEY_1 + "\n")
+    cache = ssh.KeyCache(os.path.join(tmpdir, "keys.json"))
+    cache.read_keys(keydir, ids={"jdoe.pub": "1" * 40})
+
+    # checked out afresh, but with the same contents
+    os.unlink(os.path.join(keydir, "jdoe.pub"))
+    write_file(os.path.join(keydir, "jdoe.pub"), "not read\n")
+    assert cache.read_keys(keydir, ids={"jdoe.pub": "1" * 40}) == [("jdoe", KEY_1)]
+    assert cache.hits == 1
+    # and the new stat information is used without ids
+    assert cache.read_keys(keydir) == [("jdoe", KEY_1)]
+    assert cache.hits == 2
+    assert cache.read_keys(keydir, ids={"jdoe.pub": "2" * 40}) == [("jdoe", "not read")]
+
+
+def test_key_cache_corrupt(tmpdir):
+    path = os.path.join(tmpdir, "keys.json")
+    write_file(path, "{")
+    assert ssh.KeyCache(path).entries == {}
+
+
+def test_write_authorized_keys_splices(tmpdir):
+    path = os.path.join(tmpdir, "authorized_keys")
+    write_file(path, "# foo\nbar\n")
+    keydir = os.path.join(tmpdir, "keys")
+    os.makedirs(keydir)
+    write_file(os.path.join(keydir, "jdoe.pub"), KEY_1 + "\n")
+    cache = ssh.KeyCache(os.path.join(tmpdir, "keys.json"))
+    ssh.write_authorized_keys(path=path, keydir=keydir, cache=cache)
+    first = read_file(path)
+    assert first.startswith(f"# foo\nbar\n{ssh.COMMENT}\n")
+
+    cache = ssh.KeyCache(os.path.join(tmpdir, "keys.json"))
+    assert cache.get_unmanaged(path) == "# foo\nbar\n"
+    write_file(os.path.join(keydir, "wsmith.pub"), KEY_2 + "\n")
+    ssh.write_authorized_keys(path=path, keydir=keydir, cache=cache)
+    assert read_file(path).startswith(f"# foo\nbar\n{ssh.COMMENT}\n")
+    assert 'command="gitosis-serve wsmith"' in read_file(path)
+    assert 'command="gitosis-serve jdoe"' in read_file(path)
+
+    # edited behind our back, so filtered as usual
+    with open(path, "a") as fp:
+        fp.write("baz\n")
+    assert cache.get_unmanaged(path) is None
+    os.unlink(os.path.join(keydir, "wsmith.pub"))
+    ssh.write_authorized_keys(path=path, keydir=keydir, cache=cache)
+    assert read_file(path) == "# foo\nbar\nbaz\n" + first.removeprefix("# foo\nbar\n")
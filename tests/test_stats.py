@@ -0,0 +1,168 @@
+import os
+
+import pytest
+
+from gitosis import hooks, repository, serve, stats
+
+from .util import git
+
+
+@pytest.fixture
+def cfg(cfg):
+    cfg.set("gitosis", "repository-stats", "yes")
+    cfg.add_section("repo foo")
+    return cfg
+
+
+@pytest.fixture
+def git_dir(tmpdir):
+    path = os.path.join(tmpdir, "repositories", "foo.git")
+    os.makedirs(os.path.dirname(path))
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg="initial",
+        committer="John Doe <jdoe@example.com>",
+        files=[("README", "hello\n")],
+    )
+    git(path, "branch", "topic", "master")
+    return path
+
+
+@pytest.fixture
+def not_racy(monkeypatch):
+    # everything in these tests was modified just now
+    monkeypatch.setattr(stats, "_RACY_NS", 0)
+
+
+def _add_loose(git_dir, data):
+    return git(git_dir, "hash-object", "-w", "--stdin", stdin=data).decode().strip()
+
+
+def _count_objects(git_dir):
+    output = git(git_dir, "count-objects", "-v").decode()
+    return {key: int(value) for key, value in (line.split(": ") for line in output.splitlines())}
+
+
+def test_scan(git_dir):
+    record = stats.scan(git_dir)
+    counts = _count_objects(git_dir)
+    assert record["loose_objects"] == counts["count"] > 0
+    assert record["packs"] == counts["packs"] == 0
+    assert record["refs"] == 2
+    assert record["size"] > record["loose_size"] > 0
+    assert record["last_push"] is None
+
+    git(git_dir, "repack", "-a", "-d", "-q")
+    record = stats.scan(git_dir, record)
+    assert record["loose_objects"] == 0
+    assert record["packs"] == 1
+    assert record["pack_size"] > 0
+
+
+@pytest.mark.usefixtures("not_racy")
+def test_scan_incremental(git_dir, monkeypatch):
+    previous = stats.scan(git_dir)
+    listed = []
+    real_list_dir = stats._list_dir
+
+    def list_dir(path):
+        listed.append(os.path.relpath(path, git_dir))
+        return real_list_dir(path)
+
+    monkeypatch.setattr(stats, "_list_dir", list_dir)
+    assert stats.scan(git_dir, previous)["loose_objects"] == 3
+    assert listed == []
+
+    object_id = _add_loose(git_dir, b"loose\n")
+    record = stats.scan(git_dir, previous)
+    assert record["loose_objects"] == 4
+    assert listed == ["objects", f"objects/{object_id[:2]}"]
+
+    git(git_dir, "pack-refs", "--all")
+    git(git_dir, "branch", "other", "master")
+    assert stats.scan(git_dir, record)["refs"] == 3
+
+
+def test_scan_racy(git_dir):
+    previous = stats.scan(git_dir)
+    assert previous["dirs"][""]["mtime"] is None
+    _add_loose(git_dir, b"loose\n")
+    assert stats.scan(git_dir, previous)["loose_objects"] == 4
+
+
+def test_index(cfg, git_dir):
+    index = stats.Index(stats.get_stats_dir(cfg))
+    assert index.read("foo") is None
+    record = index.update("foo", git_dir, pushed=True)
+    assert record["last_push"] == record["updated"]
+    assert index.names() == ["foo"]
+    assert index.update("foo", git_dir)["last_push"] == record["last_push"]
+    assert index.update("foo", git_dir, rescan=True)["last_push"] == record["last_push"]
+    index.remove("foo")
+    assert index.names() == []
+
+
+def test_update_all(cfg, git_dir, tmpdir):
+    index = stats.Index(stats.get_stats_dir(cfg))
+    index.update("gone", git_dir)
+    stats.update_all(cfg)
+    assert index.names() == ["foo"]
+    assert index.read("foo")["refs"] == 2
+    assert os.path.basename(git_dir) in os.listdir(os.path.join(tmpdir, "repositories"))
+
+
+def test_record_push(cfg, git_dir, tmpdir):
+    stats.record_push(cfg, git_dir)
+    assert stats.Index(stats.get_stats_dir(cfg)).read("foo")["last_push"] is not None
+    # not ours to keep track of
+    stats.record_push(cfg, os.path.join(tmpdir, "elsewhere.git"))
+    assert stats.Index(stats.get_stats_dir(cfg)).names() == ["foo"]
+
+
+def test_install_hooks(cfg, git_dir):
+    hooks.install_all(cfg)
+    assert os.access(os.path.join(git_dir, "hooks", "post-receive"), os.X_OK)
+
+
+def test_quota(cfg, git_dir, tmpdir, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmpdir))
+    cfg.set("gitosis", "repositories", "repositories")
+    cfg.add_section("group foo")
+    cfg.set("group foo", "members", "jdoe")
+    cfg.set("group foo", "writable", "foo")
+    assert not stats.is_over_quota(cfg, "foo")
+    cfg.set("gitosis", "quota", "1")
+    # nothing recorded yet
+    assert not stats.is_over_quota(cfg, "foo")
+    stats.Index(stats.get_stats_dir(cfg)).update("foo", git_dir)
+    assert stats.is_over_quota(cfg, "foo")
+    with pytest.raises(serve.QuotaExceededError):
+        serve.serve(cfg, "jdoe", "git-receive-pack 'foo'")
+    assert serve.serve(cfg, "jdoe", "git-upload-pack 'foo'") == f"git-upload-pack '{git_dir}'"
+    cfg.set("repo foo", "quota", "1G")
+    assert not stats.is_over_quota(cfg, "foo")
+    # a bad quota is no quota, rather than failing every push
+    cfg.set("repo foo", "quota", "1.5G")
+    assert stats.get_quota(cfg, "foo") is None
+    assert serve.serve(cfg, "jdoe", "git-receive-pack 'foo'") == f"git-receive-pack '{git_dir}'"
+
+
+def test_needs_gc(cfg):
+    record = {"loose_objects": 100, "packs": 3}
+    assert not stats.needs_gc(cfg, record)
+    cfg.set("gitosis", "gc-loose-limit", "99")
+    assert stats.needs_gc(cfg, record)
+    cfg.set("gitosis", "gc-loose-limit", "100")
+    cfg.set("gitosis", "gc-pack-limit", "2")
+    assert stats.needs_gc(cfg, record)
+
+
+def test_format_record():
+    record = dict.fromkeys(stats.FIELDS, 0)
+    record["last_push"] = None
+    assert stats.format_record("foo", record) == (
+        "foo size=0 loose_objects=0 loose_size=0 packs=0 pack_size=0 refs=0 last_push=never"
+    )
+    record["last_push"] = 0
+    assert stats.format_record("foo", record).endswith(" last_push=1970-01-01T00:00:00Z")
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from gitosis import transaction
+from gitosis.util import read_file, write_file
+
+
+def test_commit(tmpdir):
+    foo = os.path.join(tmpdir, "foo")
+    write_file(foo, "old\n")
+    with transaction.WriteTransaction() as writes:
+        writes.write_file(foo, "new\n")
+        writes.write_file(os.path.join(tmpdir, "bar"), "bar\n")
+        # nothing is replaced until the transaction is committed
+        assert read_file(foo) == "old\n"
+        assert len(writes) == 2
+    assert read_file(foo) == "new\n"
+    assert read_file(os.path.join(tmpdir, "bar")) == "bar\n"
+    assert sorted(os.listdir(tmpdir)) == ["bar", "foo"]
+
+
+def test_commit_syncfs(tmpdir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(transaction, "_syncfs", lambda fd: calls.append(fd) or 0)
+    with transaction.WriteTransaction() as writes:
+        for i in range(transaction.SYNCFS_THRESHOLD):
+            writes.write_file(os.path.join(tmpdir, str(i)), f"{i}\n")
+    # everything is on the same filesystem
+    assert len(calls) == 1
+    assert read_file(os.path.join(tmpdir, "3")) == "3\n"
+
+
+def test_abort(tmpdir):
+    foo = os.path.join(tmpdir, "foo")
+    write_file(foo, "old\n")
+
+    def stage_and_fail():
+        with transaction.WriteTransaction() as writes:
+            writes.write_file(foo, "new\n")
+            raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        stage_and_fail()
+    assert read_file(foo) == "old\n"
+    assert os.listdir(tmpdir) == ["foo"]
+
+
+def test_flush_failure_replaces_nothing(tmpdir, monkeypatch):
+    def fail(path):  # noqa: ARG001
+        raise OSError(5, "Input/output error")
+
+    monkeypatch.setattr(transaction, "_fsync_path", fail)
+    writes = transaction.WriteTransaction()
+    writes.write_file(os.path.join(tmpdir, "foo"), "new\n")
+    with pytest.raises(OSError, match="Input/output error"):
+        writes.commit()
+    assert os.listdir(tmpdir) == []
+
+
+def test_write_twice(tmpdir):
+    foo = os.path.join(tmpdir, "foo")
+    with transaction.WriteTransaction() as writes:
+        writes.write_file(foo, "first\n")
+        writes.write_file(foo, "second\n")
+        assert len(writes) == 1
+    assert read_file(foo) == "second\n"
+    assert os.listdir(tmpdir) == ["foo"]
+
+
+def test_write_file_if_changed(tmpdir):
+    foo = os.path.join(tmpdir, "foo")
+    write_file(foo, "same\n")
+    with transaction.WriteTransaction() as writes:
+        assert not writes.write_file_if_changed(foo, "same\n")
+        assert writes.write_file_if_changed(os.path.join(tmpdir, "bar"), "bar\n")
+        assert len(writes) == 1
+    assert read_file(os.path.join(tmpdir, "bar")) == "bar\n"
+
+
+@pytest.mark.parametrize("mode", transaction.MODES)
+def test_benchmark(tmpdir, mode):
+    assert transaction.benchmark(str(tmpdir), 20, 8, mode) > 0
+    assert read_file(os.path.join(tmpdir, "07", "7.txt")) == "x" * 8
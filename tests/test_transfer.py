@@ -0,0 +1,82 @@
+import os
+import subprocess
+
+import pytest
+
+from gitosis import repository, transfer
+
+from .util import git
+
+
+@pytest.fixture
+def cfg(cfg):
+    cfg.add_section("repo foo")
+    return cfg
+
+
+@pytest.fixture
+def git_dir(tmpdir):
+    path = os.path.join(tmpdir, "repositories", "foo.git")
+    os.makedirs(os.path.dirname(path))
+    repository.init(path)
+    repository.fast_import(
+        git_dir=path,
+        commit_msg="initial",
+        committer="John Doe <jdoe@example.com>",
+        files=[("big.bin", "x" * 10000), ("README", "hello\n")],
+    )
+    return path
+
+
+def test_get_protocol(cfg):
+    assert transfer.get_protocol(cfg, "foo", None) is None
+    assert transfer.get_protocol(cfg, "foo", "version=2") == "version=2"
+    assert transfer.get_protocol(cfg, "foo", "version=1:version=2:evil=$(rm -rf /)") == "version=2"
+    assert transfer.get_protocol(cfg, "foo", "version=0") is None
+    assert transfer.get_protocol(cfg, "foo", "garbage") is None
+    cfg.set("gitosis", "protocol-version", "1")
+    assert transfer.get_protocol(cfg, "foo", "version=2") == "version=1"
+    assert transfer.get_protocol(cfg, None, "version=2") == "version=1"
+    cfg.set("repo foo", "protocol-version", "0")
+    assert transfer.get_protocol(cfg, "foo", "version=2") is None
+
+    environ = {"GIT_PROTOCOL": "version=2:x=y"}
+    transfer.set_protocol(cfg, "bar", environ)
+    assert environ == {"GIT_PROTOCOL": "version=1"}
+    transfer.set_protocol(cfg, "foo", environ)
+    assert environ == {}
+
+
+def test_apply(cfg, git_dir):
+    assert transfer.get_settings(cfg, "foo") == {}
+    assert not transfer.apply(cfg, "foo", git_dir)
+    # as set by earlier versions
+    git(git_dir, "config", "uploadpack.allowAnySHA1InWant", "true")
+    cfg.set("gitosis", "partial-clone", "yes")
+    assert transfer.apply(cfg, "foo", git_dir)
+    assert git(git_dir, "config", "uploadpack.allowFilter") == b"true\n"
+    assert git(git_dir, "config", "uploadpack.allowReachableSHA1InWant") == b"true\n"
+    assert git(git_dir, "config", "--default=unset", "uploadpack.allowAnySHA1InWant") == b"unset\n"
+    # already applied
+    assert not transfer.apply(cfg, "foo", git_dir)
+    cfg.set("repo foo", "partial-clone", "no")
+    transfer.apply_all(cfg)
+    assert git(git_dir, "config", "uploadpack.allowFilter") == b"false\n"
+
+
+def test_partial_clone(cfg, git_dir, tmpdir):
+    cfg.set("repo foo", "partial-clone", "yes")
+    transfer.apply_all(cfg)
+    clone = os.path.join(tmpdir, "clone")
+    subprocess.run(  # noqa: S603
+        ["git", "clone", "-q", "--bare", "--no-local", "--filter=blob:none", f"file://{git_dir}", clone],  # noqa: S607
+        check=True,
+    )
+    assert git(clone, "config", "remote.origin.promisor") == b"true\n"
+    # the blobs are left out until they're needed
+    assert b"?" in git(clone, "rev-list", "--objects", "--missing=print", "HEAD")
+    # and can be fetched when they are, even with protocol version 0
+    output = subprocess.check_output(  # noqa: S603
+        ["git", "-c", "protocol.version=0", f"--git-dir={clone}", "cat-file", "-p", "HEAD:README"],  # noqa: S607
+    )
+    assert output == b"hello\n"
@@ -0,0 +1,27 @@
+import configparser
+
+import pytest
+
+from gitosis import util
+
+
+def test_parse_size():
+    assert util.parse_size("1024") == 1024
+    assert util.parse_size("512k") == 512 << 10
+    assert util.parse_size(" 2G ") == 2 << 30
+    with pytest.raises(ValueError, match="invalid literal"):
+        util.parse_size("lots")
+    with pytest.raises(ValueError, match="invalid literal"):
+        util.parse_size("1.5G")
+
+
+def test_get_float(caplog):
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.add_section("gitosis")
+    assert util.get_float(cfg, "gitosis", "replicate-backoff", default=1.0) == 1.0
+    assert util.get_float(cfg, "missing", "replicate-backoff", default=1.0) == 1.0
+    cfg.set("gitosis", "replicate-backoff", "0.5")
+    assert util.get_float(cfg, "gitosis", "replicate-backoff", default=1.0) == 0.5
+    cfg.set("gitosis", "replicate-backoff", "soon")
+    assert util.get_float(cfg, "gitosis", "replicate-backoff", default=1.0) == 1.0
+    assert "Ignoring bad value for replicate-backoff in [gitosis]" in caplog.text
@@ -1,5 +1,7 @@
 import os
 import stat
+import subprocess
+import typing as t
 
 
 def check_mode(path: str, mode: int, *, is_file: bool = False, is_dir: bool = False) -> None:
@@ -11,3 +13,7 @@ def check_mode(path: str, mode: int, *, is_file: bool = False, is_dir: bool = Fa
 
     got = stat.S_IMODE(st.st_mode)
     assert got == mode, f"File mode {got:04o}!={mode:04o} for {path}"
+
+
+def git(git_dir: str, *args: str, stdin: t.Optional[bytes] = None) -> bytes:
+    return subprocess.check_output(["git", f"--git-dir={git_dir}", *args], input=stdin)  # noqa: S603, S607